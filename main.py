@@ -1,16 +1,41 @@
 import requests
 import gzip
 import xml.etree.ElementTree as ET
+import copy
 import re
 import os
 import json
 import time
 import unicodedata
+import sys
+import sqlite3
+import zlib
+import hashlib
+import bisect
+import mmap
+import threading
+import multiprocessing
+import cProfile
+import pstats
+import glob
+import pickle
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from difflib import SequenceMatcher
-from datetime import datetime, timedelta
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
-from collections import defaultdict  # NUEVO: para almacenar por canal
+from collections import defaultdict, Counter  # NUEVO: para almacenar por canal
+from functools import lru_cache
+from itertools import accumulate
+import argparse
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
 
 # =========================
 # CONFIGURACIÓN
@@ -40,45 +65,49 @@ EPG_MITV_PE = f"{MITV_BASE}/pe.xml"
 EPG_MITV_PY = f"{MITV_BASE}/py.xml"
 EPG_MITV_SV = f"{MITV_BASE}/sv.xml"
 
-EPG_URLS = []
+def build_epg_urls():
+    """Fuentes EPG en orden de prioridad (la primera que aporta un canal se queda con él)."""
+    epg_urls = []
 
-for code in EPG_COUNTRY_CODES:
-    if code in MITV_COUNTRIES:
-        continue
-    if code in SPECIAL_EPG:
-        EPG_URLS.append(SPECIAL_EPG[code])
-    else:
-        EPG_URLS.append(f"https://iptv-epg.org/files/epg-{code}.xml")
+    for code in EPG_COUNTRY_CODES:
+        if code in MITV_COUNTRIES:
+            continue
+        if code in SPECIAL_EPG:
+            epg_urls.append(SPECIAL_EPG[code])
+        else:
+            epg_urls.append(f"https://iptv-epg.org/files/epg-{code}.xml")
 
-EPG_URLS += [
-    "https://epgshare01.online/epgshare01/epg_ripper_RAKUTEN1.xml.gz",
-    "https://epgshare01.online/epgshare01/epg_ripper_PLEX1.xml.gz",
-    "https://helmerluzo.github.io/RakutenTV_HL/epg/RakutenTV.xml.gz",
-    "https://epgshare01.online/epgshare01/epg_ripper_IT1.xml.gz",
-]
+    epg_urls += [
+        "https://epgshare01.online/epgshare01/epg_ripper_RAKUTEN1.xml.gz",
+        "https://epgshare01.online/epgshare01/epg_ripper_PLEX1.xml.gz",
+        "https://helmerluzo.github.io/RakutenTV_HL/epg/RakutenTV.xml.gz",
+        "https://epgshare01.online/epgshare01/epg_ripper_IT1.xml.gz",
+    ]
 
-EPG_URLS += [
-    EPG_MITV_AR,
-    EPG_MITV_CL,
-    EPG_MITV_CO,
-    EPG_MITV_GT,
-    EPG_MITV_HN,
-    EPG_MITV_MX,
-    EPG_MITV_PE,
-    EPG_MITV_PY,
-    EPG_MITV_SV,
-]
+    epg_urls += [
+        EPG_MITV_AR,
+        EPG_MITV_CL,
+        EPG_MITV_CO,
+        EPG_MITV_GT,
+        EPG_MITV_HN,
+        EPG_MITV_MX,
+        EPG_MITV_PE,
+        EPG_MITV_PY,
+        EPG_MITV_SV,
+    ]
 
-# Nueva fuente EPG de tvpassport.com
-EPG_URLS.append("https://raw.githubusercontent.com/dashbrox/otherepg/refs/heads/master/guides/tvpassport.com/guide.xml")
+    # Nueva fuente EPG de tvpassport.com
+    epg_urls.append("https://raw.githubusercontent.com/dashbrox/otherepg/refs/heads/master/guides/tvpassport.com/guide.xml")
 
-EPG_URLS = list(dict.fromkeys(EPG_URLS))
+    return list(dict.fromkeys(epg_urls))
 
 CHANNELS_FILE = "channels.txt"
 OUTPUT_FILE = "guia.xml.gz"
 TEMP_INPUT = "temp_input.xml"
-TEMP_OUTPUT = "output_temp.xml"
+SEEKABLE_INDEX_SUFFIX = ".idx.json"
+SEEKABLE_INDEX_FORMAT = 3
 CACHE_FILE = "api_cache.json"
+SHARED_CACHE_FILE = "api_cache.shared.sqlite"
 
 CACHE_MAX_AGE_DAYS = 5
 CACHE_MAX_AGE_SECONDS = CACHE_MAX_AGE_DAYS * 24 * 60 * 60
@@ -88,9 +117,80 @@ TMDB_API_KEY = os.getenv("TMDB_API_KEY", "").strip()
 FORCE_SEASON_EPISODE_IN_TITLE_ONLY = True
 REMOVE_SUBTITLE_ENTIRELY = False
 
+# Backend XML: "auto" usa lxml si está instalado y si no xml.etree; "lxml"/"stdlib" fuerzan uno
+XML_BACKEND = os.getenv("EPG_XML_BACKEND", "auto").strip().lower() or "auto"
+
+# Programas por lote en el enriquecimiento columnar de cada fuente
+PROGRAMME_BATCH_SIZE = max(1, int(os.getenv("EPG_BATCH_SIZE", "2000") or "2000"))
+
+# Procesos para parsear/enriquecer fuentes en paralelo (1 = secuencial)
+FEED_WORKERS = int(os.getenv("EPG_WORKERS", "1") or "1")
+
 DOWNLOAD_TIMEOUT = (20, 120)
+
+# Salud de fuentes: latencias recientes y racha de fallos persistidas entre ejecuciones.
+# Alimentan timeouts adaptativos y un circuit breaker que, durante el enfriamiento,
+# usa la última copia buena guardada en FEED_STORE_DIR en lugar de descargar.
+FEED_HEALTH_FILE = "feed_health.json"
+FEED_STORE_DIR = "feeds"
+FEED_LATENCY_HISTORY = 8
+FEED_MIN_READ_TIMEOUT = 20
+FEED_MIN_DOWNLOAD_SECONDS = 60
+FEED_MAX_DOWNLOAD_SECONDS = 600
+FEED_BREAKER_THRESHOLD = 3
+FEED_BREAKER_COOLDOWN = 6 * 60 * 60
+FEED_BREAKER_MAX_COOLDOWN = 48 * 60 * 60
+# Una copia más vieja que esto ya cubre casi solo programación vencida: no se usa
+FEED_STORE_MAX_AGE = 72 * 60 * 60
+
+# Índice fuente -> canales de la última lectura completa. Permite omitir la descarga de
+# fuentes cuyos canales ya cubren fuentes de mayor prioridad; cada FEED_INDEX_RESCAN_DAYS
+# se recorren todas para descubrir canales nuevos.
+FEED_INDEX_FILE = "feed_channels.json"
+FEED_INDEX_RESCAN_DAYS = 7
+FEED_INDEX_RESCAN_SECONDS = FEED_INDEX_RESCAN_DAYS * 24 * 60 * 60
 API_TIMEOUT = (5, 10)
 MAX_RETRIES = 2
+
+# Presupuesto de enriquecimiento (0 = sin límite): llamadas a TMDB/TVMaze y segundos
+# de red por ejecución. Con presupuesto, los lookups sin caché se priorizan por hora
+# de emisión y orden del canal en channels.txt; el resto queda con el título crudo
+# hasta una ejecución posterior.
+ENRICH_MAX_API_CALLS = int(os.getenv("EPG_API_BUDGET", "0") or "0")
+ENRICH_MAX_SECONDS = int(os.getenv("EPG_ENRICH_SECONDS", "0") or "0")
+ENRICH_PRIORITY_WINDOW_HOURS = 6
+ENRICH_CALLS_PER_LOOKUP = 2.0
+ENRICH_EST_CALL_SECONDS = 0.5
+
+# Deadline de la ejecución (--deadline, en minutos; 0 = sin deadline). Al consumirse cada
+# fracción del tiempo se desactiva una etapa costosa, en este orden; la última deja de
+# empezar fuentes para que la guía siempre alcance a escribirse antes del límite.
+RUN_DEADLINE_MINUTES = float(os.getenv("EPG_DEADLINE_MINUTES", "0") or "0")
+DEADLINE_STAGES = {
+    "tvmaze": 0.50,     # TVMaze (canales autoritativos)
+    "episode": 0.60,    # detalle de episodio en TMDB
+    "fallback": 0.70,   # búsquedas TMDB secundarias (tras la principal sin candidato)
+    "network": 0.80,    # toda llamada de red: solo caché y copias guardadas de las fuentes
+    "feeds": 0.90,      # no se empiezan más fuentes
+}
+
+# Búsquedas TMDB: puntaje mínimo para aceptar un candidato y cuántas búsquedas sin
+# caché de un mismo título se lanzan a la vez
+TMDB_MATCH_MIN_SCORE = 5.5
+# Un candidato del índice local sin nombre idéntico se acepta sin buscar solo con este puntaje
+TMDB_INDEX_ACCEPT_SCORE = 10.0
+TMDB_SEARCH_WORKERS = 2
+
+# Precalentado del caché fuera del ciclo del build (comando prewarm)
+PREWARM_HORIZON_HOURS = 48
+PREWARM_CALLS_PER_SECOND = 1.0
+PREWARM_SAVE_EVERY = 100
+
+# Checkpoint por fuente (--checkpoint): journal con lo que aportó cada fuente terminada,
+# para que una ejecución cortada se reanude desde ahí; el caché se guarda cada N fuentes
+CHECKPOINT_FILE = "guia.checkpoint"
+CHECKPOINT_MAX_AGE_HOURS = 12
+CHECKPOINT_CACHE_EVERY = 5
 USER_AGENT = "xmltv-title-normalizer/3.1-Universal"
 
 LATAM_FEED_CODES = {
@@ -154,12 +254,12 @@ CHANNEL_SOURCE_RULES = {}
 # SESIÓN HTTP
 # =========================
 
-def build_session():
+def build_session(max_retries=MAX_RETRIES):
     session = requests.Session()
     retry = Retry(
-        total=MAX_RETRIES,
-        connect=MAX_RETRIES,
-        read=MAX_RETRIES,
+        total=max_retries,
+        connect=max_retries,
+        read=max_retries,
         backoff_factor=1,
         status_forcelist=(429, 500, 502, 503, 504),
         allowed_methods=frozenset(["GET"]),
@@ -171,13 +271,23 @@ def build_session():
     session.headers.update({"User-Agent": USER_AGENT})
     return session
 
-SESSION = build_session()
+# La sesión se crea al primer uso: importar el módulo no abre nada
+SESSION = None
+
+def get_session():
+    global SESSION
+    if SESSION is None:
+        SESSION = build_session()
+    return SESSION
 
 # =========================
 # CACHE
 # =========================
 
+# api_cache se carga de forma explícita (GuideBuilder) o perezosa al primer acceso
 api_cache = {}
+cache_loaded = False
+cache_path = CACHE_FILE
 
 def now_ts():
     return int(time.time())
@@ -198,8 +308,91 @@ def purge_old_cache():
     if removed:
         print(f"Caché limpiado: {removed} entradas expiradas.", flush=True)
 
+# Caché compartido entre procesos (modo multi-proceso): SQLite en modo WAL.
+# Cada worker parte de una copia de api_cache, consulta la base ante un fallo local
+# y publica en ella cada entrada nueva; el proceso principal la fusiona al final.
+shared_cache_db = None
+
+def _connect_shared_cache(path):
+    conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, ts INTEGER, data TEXT)")
+    return conn
+
+def create_shared_cache(path):
+    """Crea la base vacía sin dejarla abierta en este proceso (el principal no la consulta)."""
+    remove_shared_cache(path)
+    _connect_shared_cache(path).close()
+
+def open_shared_cache(path):
+    global shared_cache_db
+    shared_cache_db = _connect_shared_cache(path)
+    return shared_cache_db
+
+def close_shared_cache():
+    global shared_cache_db
+    if shared_cache_db is not None:
+        shared_cache_db.close()
+        shared_cache_db = None
+
+def _shared_cache_lookup(key):
+    try:
+        row = shared_cache_db.execute("SELECT ts, data FROM cache WHERE key = ?", (key,)).fetchone()
+    except sqlite3.Error:
+        return None
+    if not row:
+        return None
+    entry = {"ts": row[0], "data": json.loads(row[1])}
+    api_cache[key] = entry
+    return entry
+
+def merge_shared_cache(path):
+    """Incorpora a api_cache las entradas publicadas por los workers."""
+    if not os.path.exists(path):
+        return 0
+    conn = sqlite3.connect(path, timeout=60)
+    merged = 0
+    try:
+        for key, ts, data in conn.execute("SELECT key, ts, data FROM cache"):
+            current = api_cache.get(key)
+            if isinstance(current, dict) and int(current.get("ts", 0)) > ts:
+                continue
+            api_cache[key] = {"ts": ts, "data": json.loads(data)}
+            cache_dirty_keys.add(key)
+            merged += 1
+    finally:
+        conn.close()
+    return merged
+
+def remove_shared_cache(path):
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+def load_cache(path=CACHE_FILE):
+    global api_cache, cache_loaded, cache_path
+    cache_path = path
+    cache_loaded = True
+    api_cache = {}
+    if not os.path.exists(path):
+        return
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            api_cache = json.load(f)
+        purge_old_cache()
+        print(f"Caché cargado: {len(api_cache)} entradas vigentes.", flush=True)
+    except Exception:
+        api_cache = {}
+
+def ensure_cache_loaded(path=CACHE_FILE):
+    if not cache_loaded:
+        load_cache(path)
+
 def cache_get(key):
+    ensure_cache_loaded()
     entry = api_cache.get(key)
+    if entry is None and shared_cache_db is not None:
+        entry = _shared_cache_lookup(key)
     if not isinstance(entry, dict):
         return None
     if "ts" not in entry or "data" not in entry:
@@ -213,25 +406,34 @@ def cache_get(key):
         return None
     return entry["data"]
 
+# Claves escritas durante esta ejecución (delta de caché para builds por shards)
+cache_dirty_keys = set()
+
 def cache_set(key, data):
+    ensure_cache_loaded()
     api_cache[key] = {
         "ts": now_ts(),
         "data": data
     }
-
-if os.path.exists(CACHE_FILE):
-    try:
-        with open(CACHE_FILE, "r", encoding="utf-8") as f:
-            api_cache = json.load(f)
-        purge_old_cache()
-        print(f"Caché cargado: {len(api_cache)} entradas vigentes.", flush=True)
-    except Exception:
-        api_cache = {}
+    cache_dirty_keys.add(key)
+    if shared_cache_db is not None:
+        try:
+            shared_cache_db.execute(
+                "INSERT OR REPLACE INTO cache (key, ts, data) VALUES (?, ?, ?)",
+                (key, api_cache[key]["ts"], json.dumps(data, ensure_ascii=False)),
+            )
+        except sqlite3.Error as e:
+            print(f"Error caché compartido: {e}", flush=True)
 
 def save_cache():
+    if not cache_loaded:
+        return
     purge_old_cache()
-    with open(CACHE_FILE, "w", encoding="utf-8") as f:
+    # Reemplazo atómico: un corte a mitad de escritura no deja el caché truncado
+    tmp_path = f"{cache_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
         json.dump(api_cache, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, cache_path)
 
 # =========================
 # ALIAS MANUALES DE CANALES
@@ -274,13 +476,25 @@ def canonical_channel_id(ch_id):
 # UTILS TEXTO Y SIMILITUD
 # =========================
 
+# Tabla acotada de textos ya normalizados: el mismo título/descripción se normaliza
+# muchas veces por programa (claves de caché, tokens, similitud, deduplicación).
+NORMALIZED_TEXT_CACHE_SIZE = 100000
+_NON_ALNUM_RE = re.compile(r"[^a-z0-9\s]")
+
+@lru_cache(maxsize=NORMALIZED_TEXT_CACHE_SIZE)
+def _normalized_entry(text):
+    """Retorna (texto normalizado, tokens significativos) para un texto crudo."""
+    low = text.lower()
+    if not low.isascii():
+        low = unicodedata.normalize("NFKD", low).encode("ascii", "ignore").decode("ascii")
+    norm = sys.intern(" ".join(_NON_ALNUM_RE.sub(" ", low).split()))
+    tokens = frozenset(t for t in norm.split() if len(t) > 2 and t not in STOPWORDS)
+    return norm, tokens
+
 def normalize_text(text):
     if not text:
         return ""
-    text = text.lower()
-    text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
-    text = re.sub(r"[^a-z0-9\s]", " ", text)
-    return " ".join(text.split())
+    return _normalized_entry(text)[0]
 
 def clean_punctuation_spacing(text):
     """Limpia espacios alrededor de signos de puntuación, sin colapsar guiones."""
@@ -442,9 +656,58 @@ def calculate_channel_similarity(id1, id2):
     norm2 = normalize_channel_id_for_matching(id2)
     if not norm1 or not norm2:
         return 0.0
-    return SequenceMatcher(None, norm1, norm2).ratio() * 0.5
+    return sequence_ratio(norm1, norm2) * 0.5
+
+# Motor de similitud: firmas precalculadas (longitud, conteo de caracteres, trigramas)
+# por texto normalizado. El conteo de caracteres da una cota superior barata del
+# ratio de SequenceMatcher (equivalente a quick_ratio), que permite descartar pares
+# antes de calcular el ratio exacto, y este último se memoiza por par. Los trigramas
+# no acotan el ratio: solo sirven para buscar candidatos en el índice local TMDB.
+SIMILARITY_CACHE_SIZE = 200000
+
+@lru_cache(maxsize=SIMILARITY_CACHE_SIZE)
+def text_signature(norm):
+    padded = f"  {norm} "
+    trigrams = frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+    return len(norm), Counter(norm), trigrams
+
+@lru_cache(maxsize=SIMILARITY_CACHE_SIZE)
+def sequence_ratio(na, nb):
+    return SequenceMatcher(None, na, nb).ratio()
+
+def similarity_upper_bound(na, nb):
+    """Cota superior de text_similarity para dos textos ya normalizados."""
+    la, counts_a, _ = text_signature(na)
+    lb, counts_b, _ = text_signature(nb)
+    if la > lb:
+        counts_a, counts_b = counts_b, counts_a
+    matches = sum(min(n, counts_b[c]) for c, n in counts_a.items())
+    bound = 2.0 * matches / (la + lb)
+    if na in nb or nb in na:
+        bound = max(bound, min(la, lb) / max(la, lb))
+    return bound
+
+def text_similarity(a, b, min_ratio=0.0):
+    """
+    Ratio de similitud entre dos textos (0.0 - 1.0) sobre su forma normalizada.
+    Con min_ratio, los pares cuya cota superior queda por debajo del umbral se
+    descartan sin calcular el ratio exacto y retornan 0.0.
+    """
+    na = normalize_text(a)
+    nb = normalize_text(b)
+    if not na or not nb:
+        return 0.0
+    if na == nb:
+        return 1.0
+    if min_ratio and similarity_upper_bound(na, nb) < min_ratio:
+        return 0.0
+    ratio = sequence_ratio(na, nb)
+    if na in nb or nb in na:
+        ratio = max(ratio, min(len(na), len(nb)) / max(len(na), len(nb)))
+    return ratio
 
-def text_similarity(a, b):
+def _text_similarity_reference(a, b):
+    # Implementación original, solo para verificar paridad en benchmark_text_similarity
     na = normalize_text(a)
     nb = normalize_text(b)
     if not na or not nb:
@@ -482,10 +745,9 @@ def should_replace_with_localized_title(source_title, localized_title):
     return False
 
 def token_set(text):
-    return {
-        t for t in normalize_text(text).split()
-        if len(t) > 2 and t not in STOPWORDS
-    }
+    if not text:
+        return frozenset()
+    return _normalized_entry(text)[1]
 
 def overlap_score(a, b):
     ta = token_set(a)
@@ -709,6 +971,202 @@ def extract_english_title(elem):
                 return text
     return None
 
+# =========================
+# PRESUPUESTO DE ENRIQUECIMIENTO
+# =========================
+
+class ApiCallRefused(Exception):
+    """La llamada no cabe en el presupuesto: el lookup se pospone y no se cachea como fallido."""
+
+class EnrichmentScheduler:
+    """
+    Reparte un presupuesto de llamadas/segundos de API entre los lookups sin caché.
+    plan() ordena las claves tmdb_match por prioridad (ventana de emisión más próxima,
+    luego importancia del canal); admits() deja pasar a la red solo las claves cuyo
+    puesto cabe en lo que el presupuesto alcanza a cubrir, estimado con el costo medio
+    observado por lookup.
+    """
+
+    # Posiciones en counters: llamadas, segundos de API, lookups, postergados, rechazadas
+    COUNTERS = ("calls", "api_seconds", "lookups", "deferred", "refused")
+
+    def __init__(self, max_calls=0, max_seconds=0, min_interval=0.0):
+        self.max_calls = max_calls
+        self.max_seconds = max_seconds
+        # Separación mínima entre llamadas (prewarm a ritmo bajo)
+        self.min_interval = min_interval
+        self.last_call = 0.0
+        self.ranks = {}
+        # Lista local; share() la pasa a memoria compartida entre procesos
+        self.counters = [0.0] * len(self.COUNTERS)
+        self.shared = False
+
+    def plan(self, candidates):
+        """candidates: (clave tmdb_match o de plan TVMaze, inicio epoch, fin epoch, puesto del canal)."""
+        now = now_ts()
+        best = {}
+        for key, start_ts, stop_ts, channel_rank in candidates:
+            if stop_ts < now or cache_get(key) is not None:
+                continue
+            window = max(start_ts - now, 0) // (ENRICH_PRIORITY_WINDOW_HOURS * 3600)
+            priority = (window, channel_rank, start_ts)
+            if key not in best or priority < best[key]:
+                best[key] = priority
+        self.ranks = {key: rank for rank, key in enumerate(sorted(best, key=best.get))}
+
+    def share(self, workers):
+        """
+        Pasa los contadores a memoria compartida antes de crear el pool: los workers
+        heredan la instancia y consumen un único presupuesto con el plan global de
+        prioridades. Los segundos de API corren en paralelo, así que su tope se
+        multiplica por la cantidad de workers.
+        """
+        if not self.shared:
+            self.counters = multiprocessing.Array("d", list(self.counters))
+            self.shared = True
+            if self.max_seconds:
+                self.max_seconds *= workers
+        return self
+
+    def lock(self):
+        return self.counters.get_lock() if self.shared else _api_budget_lock
+
+    def exhausted(self):
+        return bool((self.max_calls and self.calls >= self.max_calls)
+                    or (self.max_seconds and self.api_seconds >= self.max_seconds))
+
+    def affordable_lookups(self):
+        """
+        Lookups que cubre el presupuesto: los ya admitidos más los que alcanza lo que queda.
+        Lo comprometido es lo gastado o, si aún no se gastó, lo estimado para los admitidos.
+        """
+        per_lookup = self.calls / self.lookups if self.lookups >= 20 else ENRICH_CALLS_PER_LOOKUP
+        per_lookup = max(per_lookup, 1.0)
+        limits = []
+        if self.max_calls:
+            committed = max(self.calls, self.lookups * per_lookup)
+            limits.append(self.lookups + max(self.max_calls - committed, 0) / per_lookup)
+        if self.max_seconds:
+            per_call = self.api_seconds / self.calls if self.calls >= 20 else ENRICH_EST_CALL_SECONDS
+            per_lookup_seconds = max(per_call, 0.01) * per_lookup
+            committed = max(self.api_seconds, self.lookups * per_lookup_seconds)
+            limits.append(self.lookups + max(self.max_seconds - committed, 0) / per_lookup_seconds)
+        return min(limits) if limits else float("inf")
+
+    def admits(self, key):
+        # Las claves fuera del plan (títulos nuevos) van al final de la cola
+        rank = self.ranks.get(key, len(self.ranks))
+        with self.lock():
+            if self.exhausted() or rank >= self.affordable_lookups():
+                self.deferred += 1
+                return False
+            self.lookups += 1
+        return True
+
+    def call(self, url, params):
+        wait = 0.0
+        with self.lock():
+            if self.exhausted():
+                self.refused += 1
+                raise ApiCallRefused(url)
+            self.calls += 1
+            if self.min_interval:
+                # Se reserva el turno bajo el lock y se espera fuera, sin bloquear a los demás
+                now = time.monotonic()
+                slot = max(self.last_call + self.min_interval, now)
+                self.last_call = slot
+                wait = slot - now
+        if wait > 0:
+            time.sleep(wait)
+        started = time.monotonic()
+        try:
+            return get_session().get(url, params=params, timeout=API_TIMEOUT)
+        finally:
+            with self.lock():
+                self.api_seconds += time.monotonic() - started
+
+    def summary(self):
+        return (f"Enriquecimiento: {self.calls} llamadas API ({self.api_seconds:.0f}s), "
+                f"{self.lookups} lookups con red, {self.deferred} postergados, {self.refused} rechazadas")
+
+def _scheduler_counter(position):
+    def get(self):
+        value = self.counters[position]
+        return value if position == 1 else int(value)
+
+    def set(self, value):
+        self.counters[position] = value
+    return property(get, set)
+
+for _position, _name in enumerate(EnrichmentScheduler.COUNTERS):
+    setattr(EnrichmentScheduler, _name, _scheduler_counter(_position))
+
+# None = sin presupuesto (comportamiento de siempre)
+enrichment_scheduler = None
+# Las búsquedas TMDB concurrentes descuentan del mismo presupuesto
+_api_budget_lock = threading.Lock()
+
+def api_get(url, params):
+    """GET a TMDB/TVMaze descontado del presupuesto de enriquecimiento, si lo hay."""
+    if run_deadline is not None and not run_deadline.allows("network"):
+        run_deadline.refused += 1
+        raise ApiCallRefused(url)
+    if enrichment_scheduler is None:
+        return get_session().get(url, params=params, timeout=API_TIMEOUT)
+    return enrichment_scheduler.call(url, params)
+
+def api_admits(cache_key):
+    return enrichment_scheduler is None or enrichment_scheduler.admits(cache_key)
+
+def api_calls_refused():
+    refused = enrichment_scheduler.refused if enrichment_scheduler is not None else 0
+    if run_deadline is not None:
+        refused += run_deadline.refused
+    return refused
+
+# =========================
+# DEADLINE (--deadline)
+# =========================
+
+class RunDeadline:
+    """
+    Tiempo total de la ejecución. allows(etapa) deja de autorizar cada etapa de
+    DEADLINE_STAGES cuando la fracción transcurrida alcanza su umbral. Usa el reloj de
+    pared (time.time) para que la misma instancia valga en los workers.
+    """
+
+    def __init__(self, seconds, started=None):
+        self.seconds = seconds
+        self.started = time.time() if started is None else started
+        self.refused = 0
+        self.disabled = []
+
+    def remaining(self):
+        return self.started + self.seconds - time.time()
+
+    def seconds_until(self, stage):
+        return self.started + self.seconds * DEADLINE_STAGES[stage] - time.time()
+
+    def allows(self, stage):
+        if self.seconds_until(stage) > 0:
+            return True
+        if stage not in self.disabled:
+            self.disabled.append(stage)
+            print(f"Deadline: quedan {max(self.remaining(), 0):.0f}s, se desactiva '{stage}'", flush=True)
+        return False
+
+    def summary(self):
+        elapsed = time.time() - self.started
+        disabled = ", ".join(stage for stage in DEADLINE_STAGES if self.seconds_until(stage) <= 0) or "ninguna"
+        return (f"Deadline: {elapsed:.0f}s de {self.seconds:.0f}s | etapas desactivadas: {disabled} | "
+                f"llamadas rechazadas: {self.refused}")
+
+# None = sin deadline
+run_deadline = None
+
+def deadline_allows(stage):
+    return run_deadline is None or run_deadline.allows(stage)
+
 # =========================
 # TMDB
 # =========================
@@ -719,27 +1177,69 @@ def extract_candidate_year(item):
         return date_str[:4]
     return None
 
+def tmdb_search_cache_key(query, language, year=None):
+    return f"tmdb_search:{normalize_text(query)}:{language}:{year or ''}"
+
+def _tmdb_search_request(query, language, year=None):
+    """Solo la petición HTTP (se puede lanzar desde hilos); None si no responde 200."""
+    url = "https://api.themoviedb.org/3/search/multi"
+    params = {"api_key": TMDB_API_KEY, "query": query, "language": language}
+    if year:
+        params["year"] = year
+    r = api_get(url, params)
+    if r.status_code == 200:
+        return r.json()
+    return None
+
+def _tmdb_search_store(cache_key, data):
+    cache_set(cache_key, data)
+    if data is not None:
+        tmdb_index_add_search_results(data)
+
 def tmdb_search_multi(query, language, year=None):
     if not TMDB_API_KEY:
         return None
-    cache_key = f"tmdb_search:{normalize_text(query)}:{language}:{year or ''}"
+    cache_key = tmdb_search_cache_key(query, language, year)
     cached = cache_get(cache_key)
     if cached is not None:
         return cached
-    url = "https://api.themoviedb.org/3/search/multi"
-    params = {"api_key": TMDB_API_KEY, "query": query, "language": language}
-    if year:
-        params["year"] = year
     try:
-        r = SESSION.get(url, params=params, timeout=API_TIMEOUT)
-        if r.status_code == 200:
-            data = r.json()
-            cache_set(cache_key, data)
-            return data
+        data = _tmdb_search_request(query, language, year)
+    except ApiCallRefused:
+        return None
     except Exception as e:
         print(f"Error TMDB search: {e}", flush=True)
-    cache_set(cache_key, None)
-    return None
+        data = None
+    _tmdb_search_store(cache_key, data)
+    return data
+
+def tmdb_search_many(searches, year=None):
+    """
+    Búsquedas sin caché [(query, idioma)] en paralelo. Solo las peticiones corren en
+    hilos; el caché y el índice local se actualizan aquí, en orden.
+    """
+    def request(search):
+        try:
+            return _tmdb_search_request(search[0], search[1], year)
+        except ApiCallRefused:
+            return ApiCallRefused
+        except Exception as e:
+            print(f"Error TMDB search: {e}", flush=True)
+            return None
+
+    if len(searches) == 1:
+        responses = [request(searches[0])]
+    else:
+        with ThreadPoolExecutor(max_workers=min(len(searches), TMDB_SEARCH_WORKERS)) as pool:
+            responses = list(pool.map(request, searches))
+    results = []
+    for (query, language), data in zip(searches, responses):
+        if data is ApiCallRefused:
+            results.append(None)
+            continue
+        _tmdb_search_store(tmdb_search_cache_key(query, language, year), data)
+        results.append(data)
+    return results
 
 def tmdb_get_localized_details(tmdb_id, media_type, prefer_latam=False):
     if not TMDB_API_KEY or not tmdb_id or media_type not in ("movie", "tv"):
@@ -758,18 +1258,25 @@ def tmdb_get_localized_details(tmdb_id, media_type, prefer_latam=False):
         url = f"https://api.themoviedb.org/3/{media_type}/{tmdb_id}"
         params = {"api_key": TMDB_API_KEY, "language": lang}
         try:
-            r = SESSION.get(url, params=params, timeout=API_TIMEOUT)
-            if r.status_code == 200:
-                data = r.json()
-                title = (data.get("title") or data.get("name") or "").strip()
-                overview = (data.get("overview") or "").strip()
-                if title:
-                    result = {"title": title, "overview": overview}
-                    cache_set(cache_key, result)
-                    return title, overview
+            r = api_get(url, params)
+            data = r.json() if r.status_code == 200 else None
+        except ApiCallRefused:
+            return None, None
         except Exception as e:
+            # Error de red: no equivale a "sin datos", no se cachea
             print(f"Error TMDB localized details: {e}", flush=True)
-        cache_set(cache_key, None)
+            continue
+        if data is None and r.status_code != 404:
+            continue
+        title = ((data or {}).get("title") or (data or {}).get("name") or "").strip()
+        overview = ((data or {}).get("overview") or "").strip()
+        if title:
+            result = {"title": title, "overview": overview}
+            cache_set(cache_key, result)
+            tmdb_index_add_localized_title(tmdb_id, media_type, title)
+            return title, overview
+        # Respuesta real sin título en este idioma (o 404)
+        cache_set(cache_key, {})
     return None, None
 
 def tmdb_get_episode_details(tmdb_id, season, episode, prefer_latam=False):
@@ -786,21 +1293,29 @@ def tmdb_get_episode_details(tmdb_id, season, episode, prefer_latam=False):
             if cached:
                 return cached.get("name"), cached.get("overview")
             continue
+        if not deadline_allows("episode"):
+            return None, None
         url = f"https://api.themoviedb.org/3/tv/{tmdb_id}/season/{season}/episode/{episode}"
         params = {"api_key": TMDB_API_KEY, "language": lang}
         try:
-            r = SESSION.get(url, params=params, timeout=API_TIMEOUT)
-            if r.status_code == 200:
-                data = r.json()
-                name = (data.get("name") or "").strip()
-                overview = (data.get("overview") or "").strip()
-                if name:
-                    result = {"name": name, "overview": overview}
-                    cache_set(cache_key, result)
-                    return name, overview
+            r = api_get(url, params)
+            data = r.json() if r.status_code == 200 else None
+        except ApiCallRefused:
+            return None, None
         except Exception as e:
+            # Error de red: no equivale a "sin datos", no se cachea
             print(f"Error TMDB episode details: {e}", flush=True)
-        cache_set(cache_key, None)
+            continue
+        if data is None and r.status_code != 404:
+            continue
+        name = ((data or {}).get("name") or "").strip()
+        overview = ((data or {}).get("overview") or "").strip()
+        if name:
+            result = {"name": name, "overview": overview}
+            cache_set(cache_key, result)
+            return name, overview
+        # Respuesta real sin episodio (404 o sin nombre en este idioma)
+        cache_set(cache_key, {})
     return None, None
 
 def _score_tmdb_item(item, title, desc, year, expected_type, source_sequel, ambiguous_title):
@@ -808,11 +1323,14 @@ def _score_tmdb_item(item, title, desc, year, expected_type, source_sequel, ambi
     candidate_original = (item.get("original_title") or item.get("original_name") or "").strip()
     overview = item.get("overview") or ""
     candidate_year = extract_candidate_year(item)
-    title_ratio = max(text_similarity(title, candidate_title), text_similarity(title, candidate_original))
-    desc_ratio = overlap_score(desc, overview) if desc and overview else 0.0
     min_title_ratio = 0.78 if ambiguous_title else 0.58
+    title_ratio = max(
+        text_similarity(title, candidate_title, min_ratio=min_title_ratio),
+        text_similarity(title, candidate_original, min_ratio=min_title_ratio),
+    )
     if title_ratio < min_title_ratio:
         return None
+    desc_ratio = overlap_score(desc, overview) if desc and overview else 0.0
     if desc and overview:
         if title_ratio < 0.93 and desc_ratio < 0.18:
             return None
@@ -857,111 +1375,337 @@ def _score_tmdb_item(item, title, desc, year, expected_type, source_sequel, ambi
         pass
     return score
 
-def _build_tmdb_result(best_item, prefer_latam, season=None, episode=None):
-    result = {
+def _build_tmdb_match(best_item, prefer_latam):
+    match = {
         "type": best_item.get("media_type"),
         "year": extract_candidate_year(best_item),
         "id": best_item.get("id"),
         "canonical_title": (best_item.get("title") or best_item.get("name") or "").strip() or None,
         "match_score": 0.0
     }
-    loc_title, loc_overview = tmdb_get_localized_details(result["id"], result["type"], prefer_latam)
+    loc_title, loc_overview = tmdb_get_localized_details(match["id"], match["type"], prefer_latam)
     if loc_title:
-        result["localized_title"] = loc_title
-        result["localized_overview"] = loc_overview
-    if result["type"] == "tv" and season is not None and episode is not None:
-        ep_name, ep_overview = tmdb_get_episode_details(result["id"], season, episode, prefer_latam)
-        if ep_name:
-            result["episode_name"] = ep_name
-        if ep_overview:
-            result["episode_overview"] = ep_overview
-    return result
+        match["localized_title"] = loc_title
+        match["localized_overview"] = loc_overview
+    return match
 
-def get_tmdb_data(title, desc="", subtitle="", year=None, prefer_latam=False,
-                  season=None, episode=None, english_title=None):
-    if not TMDB_API_KEY or not title:
-        return None
-    cache_key = f"tmdb_v4:{normalize_text(title)}:{normalize_text(english_title or '')}:{year or ''}:{season or ''}:{episode or ''}:{'latam' if prefer_latam else 'eng'}"
-    cached = cache_get(cache_key)
-    if cached is not None:
-        return cached
+def _pool_tmdb_results(pool, data, title, desc, year, expected_type, source_sequel, ambiguous_title):
+    """
+    Agrega al pool {(tipo, id): (puntaje, item)} los resultados aún no evaluados.
+    Retorna True si entre ellos estaba el título exacto y fue rechazado.
+    """
+    exact_rejected = False
+    if not data or not data.get("results"):
+        return exact_rejected
+    norm_title = normalize_text(title)
+    for item in data["results"][:10]:
+        if item.get("media_type") not in ("movie", "tv"):
+            continue
+        key = (item.get("media_type"), item.get("id"))
+        if key in pool:
+            continue
+        sc = _score_tmdb_item(item, title, desc, year, expected_type, source_sequel, ambiguous_title)
+        pool[key] = (sc, item)
+        if sc is None or sc < TMDB_MATCH_MIN_SCORE:
+            names = (item.get("title") or item.get("name") or "", item.get("original_title") or item.get("original_name") or "")
+            if any(normalize_text(name) == norm_title for name in names):
+                exact_rejected = True
+    return exact_rejected
+
+def _best_in_tmdb_pool(pool):
+    best_item = None
+    best_score = -999.0
+    for sc, item in pool.values():
+        if sc is not None and sc > best_score:
+            best_score = sc
+            best_item = item
+    return best_item, best_score
 
-    expected_type = infer_media_type_from_desc(desc)
-    source_sequel = detect_sequel_marker(title)
-    ambiguous_title = is_ambiguous_title(title)
+# =========================
+# ÍNDICE LOCAL DE TÍTULOS TMDB
+# =========================
 
-    if english_title:
-        data = tmdb_search_multi(english_title, "en-US", year=year)
-        if data and data.get("results"):
-            best_item = None
-            best_score = -999.0
-            for item in data["results"][:10]:
-                if item.get("media_type") not in ("movie", "tv"):
-                    continue
-                sc = _score_tmdb_item(item, title, desc, year, expected_type, source_sequel, ambiguous_title)
-                if sc is not None and sc > best_score:
-                    best_score = sc
-                    best_item = item
-            if best_item and best_score >= 5.5:
-                result = _build_tmdb_result(best_item, prefer_latam, season, episode)
-                result["match_score"] = round(best_score, 3)
-                cache_set(cache_key, result)
-                return result
+# Índice construido a partir de los resultados de búsqueda y detalles localizados
+# ya presentes en api_cache. Permite reconocer variantes de títulos conocidos sin
+# llamar a /search/multi. Se construye al primer uso y se actualiza con cada búsqueda.
+TMDB_INDEX_FIELDS = (
+    "id", "media_type", "title", "name", "original_title", "original_name",
+    "release_date", "first_air_date", "overview", "popularity",
+)
 
-    search_lang = "es-MX" if prefer_latam else "en-US"
-    data = tmdb_search_multi(title, search_lang, year=year)
-    if data and data.get("results"):
-        best_item = None
-        best_score = -999.0
-        for item in data["results"][:10]:
-            if item.get("media_type") not in ("movie", "tv"):
-                continue
-            sc = _score_tmdb_item(item, title, desc, year, expected_type, source_sequel, ambiguous_title)
+tmdb_title_index = None
+
+def _new_tmdb_title_index():
+    return {
+        "records": {},                # "tv:1396" -> {"item": {...}, "names": set()}
+        "by_name": defaultdict(set),  # título normalizado -> claves de registro
+        "by_token": defaultdict(set), # token -> claves de registro
+        "by_trigram": defaultdict(set), # trigrama -> claves de registro
+    }
+
+def _tmdb_index_add_name(index, record_key, name):
+    norm = normalize_text(name)
+    if not norm:
+        return
+    record = index["records"][record_key]
+    record["names"].add(name)
+    index["by_name"][norm].add(record_key)
+    for token in token_set(name):
+        index["by_token"][token].add(record_key)
+    for trigram in text_signature(norm)[2]:
+        index["by_trigram"][trigram].add(record_key)
+
+def _tmdb_index_add_item(index, item):
+    if not isinstance(item, dict) or item.get("media_type") not in ("movie", "tv") or not item.get("id"):
+        return
+    record_key = f"{item['media_type']}:{item['id']}"
+    record = index["records"].get(record_key)
+    if record is None:
+        compact = {k: item.get(k) for k in TMDB_INDEX_FIELDS if item.get(k) is not None}
+        record = {"item": compact, "names": set()}
+        index["records"][record_key] = record
+    for field in ("title", "name", "original_title", "original_name"):
+        name = (item.get(field) or "").strip()
+        if name and name not in record["names"]:
+            _tmdb_index_add_name(index, record_key, name)
+
+def _tmdb_index_add_results(index, data):
+    if not isinstance(data, dict):
+        return
+    for item in data.get("results") or []:
+        _tmdb_index_add_item(index, item)
+
+def get_tmdb_title_index():
+    global tmdb_title_index
+    if tmdb_title_index is not None:
+        return tmdb_title_index
+    ensure_cache_loaded()
+    index = _new_tmdb_title_index()
+    localized = []
+    for key, entry in api_cache.items():
+        if not isinstance(entry, dict):
+            continue
+        data = entry.get("data")
+        if key.startswith("tmdb_search:"):
+            _tmdb_index_add_results(index, data)
+        elif key.startswith("tmdb_details:") and isinstance(data, dict) and data.get("title"):
+            parts = key.split(":")
+            if len(parts) >= 3:
+                localized.append((f"{parts[1]}:{parts[2]}", data["title"]))
+    # Los títulos localizados solo se asocian a registros con datos de búsqueda
+    for record_key, name in localized:
+        if record_key in index["records"]:
+            _tmdb_index_add_name(index, record_key, name)
+    tmdb_title_index = index
+    print(f"Índice local TMDB: {len(index['records'])} títulos conocidos.", flush=True)
+    return index
+
+def tmdb_index_add_search_results(data):
+    if tmdb_title_index is not None:
+        _tmdb_index_add_results(tmdb_title_index, data)
+
+def tmdb_index_add_localized_title(tmdb_id, media_type, title):
+    if tmdb_title_index is None or not title:
+        return
+    record_key = f"{media_type}:{tmdb_id}"
+    if record_key in tmdb_title_index["records"]:
+        _tmdb_index_add_name(tmdb_title_index, record_key, title)
+
+# Fracción mínima de trigramas compartidos para considerar un registro sin tokens en común
+TMDB_INDEX_MIN_TRIGRAM_SHARE = 0.5
+
+def _tmdb_index_candidates(index, title, english_title=None):
+    keys = set()
+    for query in (title, english_title):
+        norm = normalize_text(query)
+        if not norm:
+            continue
+        keys |= index["by_name"].get(norm, set())
+        for token in token_set(query):
+            keys |= index["by_token"].get(token, set())
+        trigrams = text_signature(norm)[2]
+        hits = Counter()
+        for trigram in trigrams:
+            hits.update(index["by_trigram"].get(trigram, ()))
+        needed = len(trigrams) * TMDB_INDEX_MIN_TRIGRAM_SHARE
+        keys.update(k for k, n in hits.items() if n >= needed)
+    return keys
+
+def lookup_tmdb_title_index(title, desc, year, expected_type, source_sequel, ambiguous_title,
+                            english_title=None):
+    """
+    Busca el título entre los resultados TMDB ya conocidos aplicando las mismas
+    reglas de _score_tmdb_item. Cada registro se evalúa con todos sus nombres
+    (título, original y localizados). Retorna (item, score, ¿algún nombre del registro
+    coincide exactamente, normalizado, con el título o el título en inglés?) o
+    (None, -999.0, False).
+    """
+    index = get_tmdb_title_index()
+    best_item = None
+    best_score = -999.0
+    best_names = ()
+    for record_key in _tmdb_index_candidates(index, title, english_title):
+        record = index["records"][record_key]
+        item = record["item"]
+        for name in record["names"]:
+            variant = dict(item, title=name, name=name)
+            sc = _score_tmdb_item(variant, title, desc, year, expected_type, source_sequel, ambiguous_title)
             if sc is not None and sc > best_score:
                 best_score = sc
                 best_item = item
-        if best_item and best_score >= 5.5:
-            result = _build_tmdb_result(best_item, prefer_latam, season, episode)
-            result["match_score"] = round(best_score, 3)
-            cache_set(cache_key, result)
-            return result
+                best_names = record["names"]
+    wanted = {normalize_text(t) for t in (title, english_title) if t}
+    exact = any(normalize_text(name) in wanted for name in best_names)
+    return best_item, best_score, exact
+
+def tmdb_match_cache_key(title, year=None, prefer_latam=False, english_title=None):
+    return f"tmdb_match:{normalize_text(title)}:{normalize_text(english_title or '')}:{year or ''}:{'latam' if prefer_latam else 'eng'}"
 
+def plan_tmdb_searches(title, prefer_latam=False, english_title=None):
+    """
+    Búsquedas a /search/multi en orden de preferencia: (query, idioma, es_fallback).
+    Se descartan las que normalizan a una ya planificada en el mismo idioma.
+    """
+    search_lang = "es-MX" if prefer_latam else "en-US"
+    candidates = []
+    if english_title:
+        candidates.append((english_title, "en-US", False))
+    candidates.append((title, search_lang, False))
     # FALLBACK: búsqueda sin signos de puntuación
     fallback_query = re.sub(r'[^\w\s]', ' ', title)
     fallback_query = re.sub(r'\s+', ' ', fallback_query).strip()
-    if fallback_query and normalize_text(fallback_query) != normalize_text(title):
-        data = tmdb_search_multi(fallback_query, search_lang, year=year)
-        if data and data.get("results"):
-            best_item = None
-            best_score = -999.0
-            for item in data["results"][:10]:
-                if item.get("media_type") not in ("movie", "tv"):
-                    continue
-                sc = _score_tmdb_item(item, title, desc, year, expected_type, source_sequel, ambiguous_title)
-                if sc is not None and sc > best_score:
-                    best_score = sc
-                    best_item = item
-            if best_item and best_score >= 5.5:
-                result = _build_tmdb_result(best_item, prefer_latam, season, episode)
-                result["match_score"] = round(best_score, 3)
-                cache_set(cache_key, result)
-                return result
+    if fallback_query:
+        candidates.append((fallback_query, search_lang, True))
+    plan = []
+    seen = set()
+    for query, lang, is_fallback in candidates:
+        key = (normalize_text(query), lang)
+        if not key[0] or key in seen:
+            continue
+        seen.add(key)
+        plan.append((query, lang, is_fallback))
+    return plan
+
+def _store_tmdb_match(cache_key, best_item, best_score, prefer_latam):
+    refused = api_calls_refused()
+    match = _build_tmdb_match(best_item, prefer_latam)
+    match["match_score"] = round(best_score, 3)
+    # Si el presupuesto/deadline cortó los detalles localizados, el match se usa pero no
+    # se guarda: cacheado quedaría sin título traducido hasta que venza
+    if api_calls_refused() == refused:
+        cache_set(cache_key, match)
+    return match
+
+def find_tmdb_match(title, desc="", year=None, prefer_latam=False, english_title=None):
+    """
+    Identifica el título en TMDB (id, tipo, títulos localizados) sin datos de episodio.
+    El match se cachea por título, de modo que cada episodio nuevo de una serie ya
+    identificada no repite las búsquedas. Un match fallido se guarda como {}.
+    """
+    if not TMDB_API_KEY or not title:
+        return None
+    cache_key = tmdb_match_cache_key(title, year, prefer_latam, english_title)
+    cached = cache_get(cache_key)
+    if cached is not None:
+        return cached or None
 
-    cache_set(cache_key, None)
+    expected_type = infer_media_type_from_desc(desc)
+    source_sequel = detect_sequel_marker(title)
+    ambiguous_title = is_ambiguous_title(title)
+
+    # Primero el índice local: un nombre conocido idéntico (o un puntaje muy alto) no
+    # requiere red. Un parecido menor (p. ej. la serie madre de un spin-off) solo entra
+    # al pool como un candidato más y las búsquedas se hacen igual.
+    pool = {}
+    index_item, index_score, index_exact = lookup_tmdb_title_index(
+        title, desc, year, expected_type, source_sequel, ambiguous_title, english_title=english_title
+    )
+    if index_item and index_score >= TMDB_MATCH_MIN_SCORE:
+        if index_exact or index_score >= TMDB_INDEX_ACCEPT_SCORE:
+            return _store_tmdb_match(cache_key, index_item, index_score, prefer_latam)
+        pool[(index_item.get("media_type"), index_item.get("id"))] = (index_score, index_item)
+
+    # Todos los resultados van a un solo pool puntuado; se corta apenas hay un candidato
+    # aceptable. Primero lo que ya está en caché (gratis), luego la búsqueda principal y,
+    # solo si hace falta, el resto en paralelo.
+    exact_rejected = False
+    searched = False
+    pending = []
+    for query, lang, is_fallback in plan_tmdb_searches(title, prefer_latam, english_title):
+        cached_search = cache_get(tmdb_search_cache_key(query, lang, year))
+        if cached_search is None:
+            pending.append((query, lang, is_fallback))
+            continue
+        searched = True
+        exact_rejected |= _pool_tmdb_results(pool, cached_search, title, desc, year, expected_type,
+                                             source_sequel, ambiguous_title)
+    best_item, best_score = _best_in_tmdb_pool(pool)
+    # El candidato del índice no alcanza solo: hace falta al menos una búsqueda que lo compare
+    if best_item and best_score >= TMDB_MATCH_MIN_SCORE and (searched or not pending):
+        return _store_tmdb_match(cache_key, best_item, best_score, prefer_latam)
+
+    if pending and not api_admits(cache_key):
+        return None
+    # Búsqueda rechazada, con error de red o respuesta no 200: el "sin match" no es definitivo
+    incomplete = False
+    batches = [pending[:1], pending[1:]]
+    for secondary, batch in enumerate(batches):
+        if exact_rejected:
+            # El título exacto ya apareció y no sirve: la variante sin puntuación no aporta
+            batch = [search for search in batch if not search[2]]
+        if not batch:
+            continue
+        if secondary and not deadline_allows("fallback"):
+            # Cerca del deadline basta la búsqueda principal; el resto queda para otra ejecución
+            incomplete = True
+            break
+        for data in tmdb_search_many([(query, lang) for query, lang, _ in batch], year=year):
+            incomplete |= data is None
+            exact_rejected |= _pool_tmdb_results(pool, data, title, desc, year, expected_type,
+                                                 source_sequel, ambiguous_title)
+        best_item, best_score = _best_in_tmdb_pool(pool)
+        if best_item and best_score >= TMDB_MATCH_MIN_SCORE:
+            return _store_tmdb_match(cache_key, best_item, best_score, prefer_latam)
+
+    # Solo se guarda como fallido tras respuestas reales sin candidato: un lookup cortado
+    # por el presupuesto, el deadline o un error de red se reintenta en otra ejecución
+    if not incomplete:
+        cache_set(cache_key, {})
     return None
 
+def get_tmdb_data(title, desc="", subtitle="", year=None, prefer_latam=False,
+                  season=None, episode=None, english_title=None):
+    match = find_tmdb_match(title, desc=desc, year=year, prefer_latam=prefer_latam,
+                            english_title=english_title)
+    if not match:
+        return None
+    result = dict(match)
+    if result["type"] == "tv" and season is not None and episode is not None:
+        ep_name, ep_overview = tmdb_get_episode_details(result["id"], season, episode, prefer_latam)
+        if ep_name:
+            result["episode_name"] = ep_name
+        if ep_overview:
+            result["episode_overview"] = ep_overview
+    return result
+
 # =========================
 # TVMAZE (solo canales autoritativos)
 # =========================
 
-def get_tvmaze_episode(show_name, air_date, desc="", subtitle="", year=None, english_title=None):
+def get_tvmaze_episode(show_name, air_date, desc="", subtitle="", year=None, english_title=None, plan_key=None):
+    """
+    plan_key: clave con la que el plan de enriquecimiento priorizó este lookup (la del
+    caché depende del resultado de TMDB y no se conoce antes de la ejecución).
+    """
     cache_key = f"tvmaze_v4:{normalize_text(show_name)}:{air_date}:{year or ''}:{english_title or ''}"
     cached = cache_get(cache_key)
     if cached is not None:
         return cached
+    if not deadline_allows("tvmaze") or not api_admits(plan_key or cache_key):
+        return None
     query = english_title if english_title else show_name
     try:
-        r_show = SESSION.get("https://api.tvmaze.com/search/shows", params={"q": query}, timeout=API_TIMEOUT)
+        r_show = api_get("https://api.tvmaze.com/search/shows", {"q": query})
         if r_show.status_code != 200:
             cache_set(cache_key, None)
             return None
@@ -977,19 +1721,19 @@ def get_tvmaze_episode(show_name, air_date, desc="", subtitle="", year=None, eng
             if not show_title:
                 continue
             show_id = show.get("id")
+            show_score = text_similarity(show_name, show_title) * 8.0
             
             dates_to_try = [air_date]
             try:
-                d = datetime.strptime(air_date, "%Y-%m-%d")
-                dates_to_try.append((d - timedelta(days=1)).strftime("%Y-%m-%d"))
-                dates_to_try.append((d + timedelta(days=1)).strftime("%Y-%m-%d"))
+                dates_to_try.append(shift_iso_date(air_date, -1))
+                dates_to_try.append(shift_iso_date(air_date, 1))
             except Exception:
                 pass
             dates_to_try = list(dict.fromkeys(dates_to_try))
             
             episodes = []
             for candidate_date in dates_to_try:
-                r_ep = SESSION.get(f"https://api.tvmaze.com/shows/{show_id}/episodesbydate", params={"date": candidate_date}, timeout=API_TIMEOUT)
+                r_ep = api_get(f"https://api.tvmaze.com/shows/{show_id}/episodesbydate", {"date": candidate_date})
                 if r_ep.status_code == 200:
                     episodes = r_ep.json() or []
                     if episodes:
@@ -998,7 +1742,7 @@ def get_tvmaze_episode(show_name, air_date, desc="", subtitle="", year=None, eng
             for ep in episodes:
                 ep_name = (ep.get("name") or "").strip()
                 ep_summary = strip_html_tags(ep.get("summary") or "")
-                ep_score = text_similarity(show_name, show_title) * 8.0
+                ep_score = show_score
                 if subtitle:
                     ep_score += text_similarity(subtitle, ep_name) * 3.0
                 if ep_score > best_score:
@@ -1016,6 +1760,8 @@ def get_tvmaze_episode(show_name, air_date, desc="", subtitle="", year=None, eng
             best_episode = None
         cache_set(cache_key, best_episode)
         return best_episode
+    except ApiCallRefused:
+        return None
     except Exception as e:
         print(f"Error TVMaze: {e}", flush=True)
     cache_set(cache_key, None)
@@ -1113,30 +1859,79 @@ def remove_episode_title_from_series_title(title_text, subtitle_text=""):
 
     return base
 
-def process_programme(elem, start_time_str, prefer_latam=False,
-                      spanish_season_episode_format=False, tvmaze_authoritative=False):
+def programme_fields(elem, prefer_latam=False):
+    """
+    Textos de un <programme> de los que depende su enriquecimiento:
+    (título, título en inglés, subtítulo, descripción, ¿título en español?, episode-num, año de la imagen).
+    Dos programas con los mismos campos (y fecha de emisión, si aplica TVMaze) se enriquecen igual.
+    """
     spanish_title = pick_best_localized_text(elem, "title", prefer_latam=True)
-    english_title = extract_english_title(elem)
-
     raw_title = spanish_title if spanish_title else pick_best_localized_text(elem, "title", prefer_latam=False)
-    raw_subtitle = pick_best_localized_text(elem, "sub-title", prefer_latam=prefer_latam)
-    raw_desc = pick_best_localized_text(elem, "desc", prefer_latam=prefer_latam)
-
-    xml_has_spanish_title = has_spanish_variant(elem, "title")
+    return (
+        raw_title,
+        extract_english_title(elem),
+        pick_best_localized_text(elem, "sub-title", prefer_latam=prefer_latam),
+        pick_best_localized_text(elem, "desc", prefer_latam=prefer_latam),
+        has_spanish_variant(elem, "title"),
+        extract_xmltv_episode_num(elem),
+        extract_year_from_image(elem),
+    )
 
+def programme_title_parts(raw_title):
+    """(título limpio, ¿ᴺᵉʷ?, año del título, SxxEyy del título, título sin SxxEyy)."""
     clean_title, has_new = extract_new_marker(raw_title)
     clean_title, year_regex = extract_year_regex(clean_title)
+    return clean_title, has_new, year_regex, extract_se_regex(clean_title), strip_se_from_title(clean_title)
 
-    se_title = extract_se_regex(clean_title)
-    se_desc = extract_se_regex(raw_desc)
-    se_xml = extract_xmltv_episode_num(elem)
-    final_se = se_title or se_desc or se_xml
+def subtitle_hint_text(raw_subtitle):
+    return strip_leading_se_from_text(raw_subtitle or "").strip()
 
-    base_title = strip_se_from_title(clean_title)
-    subtitle_hint = strip_leading_se_from_text(raw_subtitle or "").strip()
-    base_title = remove_episode_title_from_series_title(base_title, subtitle_hint)
+def programme_air_date(start_time_str):
+    """Fecha de emisión para TVMaze; None si el start no es parseable."""
+    try:
+        return xmltv_air_date(start_time_str)
+    except ValueError:
+        return None
+
+def tvmaze_plan_key(lookup_key, air_date):
+    """Clave de plan del lookup TVMaze de un programa: su clave tmdb_match más la fecha."""
+    return f"tvmaze_plan:{air_date}:{lookup_key}"
+
+def programme_lookup_key(elem, prefer_latam=False):
+    """Clave tmdb_match que process_programme consultaría para este <programme> (sin red)."""
+    raw_title, english_title, raw_subtitle, _, _, _, image_year = programme_fields(elem, prefer_latam)
+    _, _, year_regex, _, stripped_title = programme_title_parts(raw_title)
+    base_title = remove_episode_title_from_series_title(stripped_title, subtitle_hint_text(raw_subtitle))
+    return tmdb_match_cache_key(base_title if base_title else raw_title, year_regex or image_year,
+                                prefer_latam, english_title)
+
+def process_programme(elem, start_time_str, prefer_latam=False,
+                      spanish_season_episode_format=False, tvmaze_authoritative=False):
+    fields = programme_fields(elem, prefer_latam)
+    raw_title, _, raw_subtitle, raw_desc = fields[:4]
+    title_parts = programme_title_parts(raw_title)
+    subtitle_hint = subtitle_hint_text(raw_subtitle)
+    return resolve_programme(
+        fields, title_parts, subtitle_hint,
+        remove_episode_title_from_series_title(title_parts[4], subtitle_hint),
+        extract_se_regex(raw_desc),
+        programme_air_date(start_time_str) if tvmaze_authoritative else None,
+        prefer_latam=prefer_latam,
+        spanish_season_episode_format=spanish_season_episode_format,
+        tvmaze_authoritative=tvmaze_authoritative,
+    )
+
+def resolve_programme(fields, title_parts, subtitle_hint, base_title, se_desc, air_date, prefer_latam=False,
+                      spanish_season_episode_format=False, tvmaze_authoritative=False):
+    """
+    Enriquecimiento a partir de los campos ya extraídos (programme_fields) y sus derivados
+    de texto, que el modo por lotes calcula una sola vez por valor distinto.
+    Retorna (título a mostrar, ¿es serie?, subtítulo preferido, descripción preferida).
+    """
+    raw_title, english_title, raw_subtitle, raw_desc, xml_has_spanish_title, se_xml, image_year = fields
+    clean_title, has_new, year_regex, se_title, _ = title_parts
+    final_se = se_title or se_desc or se_xml
 
-    image_year = extract_year_from_image(elem)
     final_year = year_regex or image_year
     final_title = base_title
 
@@ -1149,6 +1944,8 @@ def process_programme(elem, start_time_str, prefer_latam=False,
             tmdb_episode = int(m.group(2))
 
     should_translate = prefer_latam and not xml_has_spanish_title
+    lookup_title = final_title if final_title else raw_title
+    lookup_key = tmdb_match_cache_key(lookup_title, final_year, prefer_latam, english_title)
 
     tmdb_data = get_tmdb_data(
         final_title if final_title else raw_title,
@@ -1175,7 +1972,7 @@ def process_programme(elem, start_time_str, prefer_latam=False,
             final_title = loc_title
             canonical_title = loc_title
         elif canon_from_tmdb and (should_translate or prefer_latam):
-            if text_similarity(final_title, canon_from_tmdb) > 0.4:
+            if text_similarity(final_title, canon_from_tmdb, min_ratio=0.4) > 0.4:
                 final_title = canon_from_tmdb
                 canonical_title = canon_from_tmdb
         elif canon_from_tmdb:
@@ -1198,14 +1995,14 @@ def process_programme(elem, start_time_str, prefer_latam=False,
 
     # TVMaze solo para canales autoritativos
     should_try_tvmaze = tvmaze_authoritative and ((tmdb_data and tmdb_data.get("type") == "tv") or final_se)
-    if should_try_tvmaze:
+    if should_try_tvmaze and air_date is not None:
         try:
-            air_date = datetime.strptime(start_time_str[:8], "%Y%m%d").strftime("%Y-%m-%d")
             query_title = final_title or base_title
             tvmaze_data = get_tvmaze_episode(
                 query_title, air_date,
                 desc=raw_desc, subtitle=subtitle_hint, year=final_year,
-                english_title=english_title
+                english_title=english_title,
+                plan_key=tvmaze_plan_key(lookup_key, air_date),
             )
             if not final_se and tvmaze_data and tvmaze_data.get("season") is not None:
                 final_se = normalize_season_ep_from_numbers(
@@ -1253,18 +2050,116 @@ def process_programme(elem, start_time_str, prefer_latam=False,
 
     return display_title, is_series, preferred_subtitle, preferred_desc
 
+# =========================
+# BACKEND XML
+# =========================
+
+# Caracteres de control que XML 1.0 no admite (pueden llegar desde las APIs)
+XML_INVALID_CHARS_RE = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+class StdlibXmlBackend:
+    """xml.etree.ElementTree: siempre disponible."""
+    name = "xml.etree"
+
+    def Element(self, tag):
+        return ET.Element(tag)
+
+    def fromstring(self, data):
+        return ET.fromstring(data)
+
+    def tostring(self, elem):
+        """Bytes UTF-8 del elemento sin su tail."""
+        tail = elem.tail
+        elem.tail = None
+        try:
+            return ET.tostring(elem, encoding="utf-8")
+        finally:
+            elem.tail = tail
+
+    def clone(self, elem):
+        # Sin el tail, igual que lxml (un tail con texto ni siquiera se podría volver a parsear)
+        return ET.fromstring(self.tostring(elem))
+
+    def iter_elements(self, source, header_only=False):
+        """
+        Recorre los <channel> y <programme> liberando cada uno tras usarlo. Con
+        header_only se detiene al abrir el primer <programme>.
+        """
+        context = ET.iterparse(source, events=("start", "end"))
+        _, root = next(context)
+        for event, elem in context:
+            if event == "start":
+                if header_only and elem.tag == "programme":
+                    break
+                continue
+            if elem.tag in ("channel", "programme"):
+                yield elem
+                root.remove(elem)
+        del context
+
+class LxmlXmlBackend:
+    """
+    lxml: iterparse filtrado por tag (no se construyen eventos para los hijos),
+    huge_tree para fuentes enormes y liberación con clear() + borrado de hermanos
+    previos. tostring produce los mismos bytes que xml.etree (" />" en vacíos).
+    """
+    name = "lxml"
+
+    def Element(self, tag):
+        return lxml_etree.Element(tag)
+
+    def fromstring(self, data):
+        return lxml_etree.fromstring(data, lxml_etree.XMLParser(huge_tree=True))
+
+    def tostring(self, elem):
+        return lxml_etree.tostring(elem, encoding="utf-8", with_tail=False).replace(b"/>", b" />")
+
+    def clone(self, elem):
+        cloned = copy.deepcopy(elem)
+        cloned.tail = None
+        return cloned
+
+    def iter_elements(self, source, header_only=False):
+        context = lxml_etree.iterparse(
+            source, events=("start", "end") if header_only else ("end",), tag=("channel", "programme"),
+            huge_tree=True, remove_comments=True, remove_pis=True,
+        )
+        for event, elem in context:
+            if event == "start":
+                if elem.tag == "programme":
+                    break
+                continue
+            yield elem
+            # El consumidor ya terminó con el elemento: se vacía y se sueltan los anteriores
+            elem.clear(keep_tail=False)
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+        del context
+
+def select_xml_backend(name=XML_BACKEND):
+    if name == "stdlib" or (name == "auto" and lxml_etree is None):
+        return StdlibXmlBackend()
+    if lxml_etree is None:
+        raise RuntimeError("EPG_XML_BACKEND=lxml pero lxml no está instalado")
+    return LxmlXmlBackend()
+
+XML = select_xml_backend()
+
+def xml_text(text):
+    return XML_INVALID_CHARS_RE.sub("", text) if text else text
+
 # =========================
 # Funciones de XML auxiliares
 # =========================
 
 def clone_element(elem):
-    return ET.fromstring(ET.tostring(elem, encoding="utf-8"))
+    return XML.clone(elem)
 
 def replace_all_title_elements(elem, new_title, prefer_latam=False):
     for t in elem.findall("title"):
         elem.remove(t)
-    new_title_elem = ET.Element("title")
-    new_title_elem.text = new_title
+    new_title_elem = XML.Element("title")
+    new_title_elem.text = xml_text(new_title)
     if prefer_latam:
         new_title_elem.set("lang", "es")
     elem.insert(0, new_title_elem)
@@ -1274,8 +2169,8 @@ def set_or_replace_subtitle(elem, subtitle_text, prefer_latam=False):
         elem.remove(s)
     if REMOVE_SUBTITLE_ENTIRELY or not subtitle_text:
         return
-    new_sub = ET.Element("sub-title")
-    new_sub.text = subtitle_text
+    new_sub = XML.Element("sub-title")
+    new_sub.text = xml_text(subtitle_text)
     if prefer_latam:
         new_sub.set("lang", "es")
     title_index = 0
@@ -1290,8 +2185,8 @@ def set_or_replace_desc(elem, desc_text, prefer_latam=False):
         elem.remove(d)
     if not desc_text:
         return
-    new_desc = ET.Element("desc")
-    new_desc.text = desc_text
+    new_desc = XML.Element("desc")
+    new_desc.text = xml_text(desc_text)
     if prefer_latam:
         new_desc.set("lang", "es")
     children = list(elem)
@@ -1331,85 +2226,275 @@ def normalize_episode_num_elements(elem):
             elem.remove(ep)
 
 # =========================
-# FUNCIÓN DE DEDUPLICACIÓN (NUEVA)
+# FECHAS XMLTV
 # =========================
 
-def parse_datetime_from_xmltv(ts_str):
-    """Intenta convertir un string XMLTV (formato YYYYMMDDHHMMSS) a datetime.
-       Retorna (datetime, None) si éxito, o (None, fallback_string) si falla."""
-    if not ts_str:
-        return None, ts_str
-    # Extraer los primeros 14 dígitos
-    m = re.match(r"^(\d{14})", ts_str)
-    if not m:
-        return None, ts_str
-    try:
-        dt = datetime.strptime(m.group(1), "%Y%m%d%H%M%S")
-        return dt, None
-    except ValueError:
-        return None, ts_str
+# Los timestamps "YYYYMMDDHHMMSS +hhmm" se decodifican con slicing y aritmética de
+# días civiles (sin strptime ni datetime). Se repiten muchísimo entre programas.
+XMLTV_TIME_CACHE_SIZE = 65536
+
+_DAYS_IN_MONTH = (0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+def _is_leap_year(year):
+    return year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+
+def _days_from_civil(year, month, day):
+    """Días desde 1970-01-01 para una fecha del calendario gregoriano."""
+    year -= month <= 2
+    era = year // 400
+    yoe = year - era * 400
+    doy = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + day - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+def _civil_from_days(days):
+    days += 719468
+    era = days // 146097
+    doe = days - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    day = doy - (153 * mp + 2) // 5 + 1
+    month = mp + 3 if mp < 10 else mp - 9
+    return yoe + era * 400 + (month <= 2), month, day
+
+def _parse_xmltv_offset(rest):
+    """Minutos de un sufijo "+hhmm"/"-hhmm" o None si no lo hay."""
+    rest = rest.lstrip()
+    if len(rest) < 5 or rest[0] not in "+-" or not (rest[1:5].isascii() and rest[1:5].isdigit()):
+        return None
+    minutes = int(rest[1:3]) * 60 + int(rest[3:5])
+    return -minutes if rest[0] == "-" else minutes
 
-def is_duplicate_programme(channel_id, start_str, stop_str, title, written_by_channel):
+@lru_cache(maxsize=XMLTV_TIME_CACHE_SIZE)
+def parse_xmltv_time(ts_str):
     """
-    Determina si un programa ya existe para el mismo canal considerando:
-    - Título muy similar (normalize_text exacto o overlap_score >= 0.95)
-    - Solapamiento temporal >= 80% del programa más corto.
-    Si no se puede calcular solapamiento (fechas inválidas), se cae a comparación exacta de start/stop strings.
+    Decodifica un timestamp XMLTV a (segundos epoch UTC, minutos de offset) o None.
+    Sin offset se asume UTC; texto después del offset se ignora.
     """
-    stored_list = written_by_channel.get(channel_id)
-    if not stored_list:
-        return False
+    if not ts_str or len(ts_str) < 14:
+        return None
+    digits = ts_str[:14]
+    if not (digits.isascii() and digits.isdigit()):
+        return None
+    year = int(digits[0:4])
+    month = int(digits[4:6])
+    day = int(digits[6:8])
+    hour = int(digits[8:10])
+    minute = int(digits[10:12])
+    second = int(digits[12:14])
+    if not 1 <= month <= 12 or hour > 23 or minute > 59 or second > 59 or year < 1:
+        return None
+    max_day = 29 if month == 2 and _is_leap_year(year) else _DAYS_IN_MONTH[month]
+    if not 1 <= day <= max_day:
+        return None
+    offset = _parse_xmltv_offset(ts_str[14:]) or 0
+    wall = _days_from_civil(year, month, day) * 86400 + hour * 3600 + minute * 60 + second
+    return wall - offset * 60, offset
+
+def format_xmltv_time(epoch, offset=None):
+    """Timestamp XMLTV para un epoch UTC, en hora de pared del offset dado (minutos)."""
+    wall = epoch + (offset or 0) * 60
+    days, seconds = divmod(wall, 86400)
+    year, month, day = _civil_from_days(days)
+    text = (f"{year:04d}{month:02d}{day:02d}"
+            f"{seconds // 3600:02d}{seconds // 60 % 60:02d}{seconds % 60:02d}")
+    if offset is None:
+        return text
+    sign = "-" if offset < 0 else "+"
+    return f"{text} {sign}{abs(offset) // 60:02d}{abs(offset) % 60:02d}"
 
-    # Normalizar título del nuevo programa una sola vez
-    new_norm = normalize_text(title)
+def xmltv_to_epoch(ts_str):
+    """Segundos epoch UTC de un timestamp XMLTV (aplicando su offset) o None."""
+    parsed = parse_xmltv_time(ts_str)
+    return parsed[0] if parsed else None
 
-    # Parsear fechas del nuevo programa
-    new_start_dt, new_start_fallback = parse_datetime_from_xmltv(start_str)
-    new_stop_dt, new_stop_fallback = parse_datetime_from_xmltv(stop_str)
-    new_has_dt = (new_start_dt is not None and new_stop_dt is not None)
+def shift_xmltv_time(ts_str, minutes):
+    """
+    Desplaza la hora de pared de "YYYYMMDDHHMMSS[ +hhmm]" conservando el sufijo de zona
+    tal como venía. None si el texto no tiene exactamente ese formato.
+    """
+    parsed = parse_xmltv_time(ts_str)
+    if parsed is None:
+        return None
+    epoch, offset = parsed
+    rest = ts_str[14:]
+    tz = rest.lstrip()
+    if tz and (_parse_xmltv_offset(tz) is None or len(tz) != 5):
+        return None
+    shifted = format_xmltv_time(epoch + offset * 60 + minutes * 60)
+    return f"{shifted} {tz}" if tz else shifted
+
+def xmltv_air_date(ts_str):
+    """Fecha local "YYYY-MM-DD" de emisión (según el reloj de la fuente). ValueError si es inválida."""
+    if parse_xmltv_time(ts_str) is None:
+        raise ValueError(f"fecha XMLTV inválida: {ts_str!r}")
+    return f"{ts_str[0:4]}-{ts_str[4:6]}-{ts_str[6:8]}"
+
+def shift_iso_date(date_str, days):
+    """Suma días a una fecha "YYYY-MM-DD"."""
+    year, month, day = (int(part) for part in date_str.split("-"))
+    year, month, day = _civil_from_days(_days_from_civil(year, month, day) + days)
+    return f"{year:04d}-{month:02d}-{day:02d}"
+
+# =========================
+# FUNCIÓN DE DEDUPLICACIÓN (NUEVA)
+# =========================
+
+# Marca para fechas no parseables dentro de los arrays de timestamps
+NO_TIMESTAMP = -(2 ** 62)
+
+class ChannelHistory:
+    """Programas escritos de un canal en arrays paralelos de enteros."""
+    __slots__ = ("starts", "stops", "title_ids", "start_str_ids", "stop_str_ids")
 
-    for stored in stored_list:
-        stored_start_dt, stored_stop_dt, stored_raw_title, stored_norm_title, stored_start_str, stored_stop_str = stored
+    def __init__(self):
+        self.starts = array("q")
+        self.stops = array("q")
+        self.title_ids = array("l")
+        self.start_str_ids = array("l")
+        self.stop_str_ids = array("l")
+
+    def __len__(self):
+        return len(self.starts)
+
+class ProgrammeHistory:
+    """
+    Historial de deduplicación: por canal, inicio/fin en segundos epoch y ids de
+    textos internados (títulos y timestamps crudos, que se repiten muchísimo).
+    Reemplaza las tuplas (datetime, datetime, título, normalizado, start, stop).
+    """
+    __slots__ = ("strings", "string_ids", "norm_ids", "channels")
+
+    def __init__(self):
+        self.strings = []      # id -> texto
+        self.string_ids = {}   # texto -> id
+        self.norm_ids = {}     # id de título -> id de su forma normalizada
+        self.channels = {}     # canal -> ChannelHistory
+
+    def intern(self, text):
+        string_id = self.string_ids.get(text)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.strings.append(text)
+            self.string_ids[text] = string_id
+        return string_id
+
+    def title_id(self, title):
+        title_id = self.intern(title)
+        if title_id not in self.norm_ids:
+            self.norm_ids[title_id] = self.intern(normalize_text(title))
+        return title_id
+
+    def get(self, channel_id):
+        return self.channels.get(channel_id)
+
+    def add(self, channel_id, start_str, stop_str, title):
+        history = self.channels.get(channel_id)
+        if history is None:
+            history = self.channels[channel_id] = ChannelHistory()
+        start_ts = xmltv_to_epoch(start_str)
+        stop_ts = xmltv_to_epoch(stop_str)
+        history.starts.append(NO_TIMESTAMP if start_ts is None else start_ts)
+        history.stops.append(NO_TIMESTAMP if stop_ts is None else stop_ts)
+        history.title_ids.append(self.title_id(title))
+        history.start_str_ids.append(self.intern(start_str or ""))
+        history.stop_str_ids.append(self.intern(stop_str or ""))
+
+    def total(self):
+        return sum(len(h) for h in self.channels.values())
+
+    def mark(self):
+        """Posición actual del historial, que solo crece (para since())."""
+        return len(self.strings), len(self.norm_ids), {ch: len(h) for ch, h in self.channels.items()}
+
+    def since(self, mark):
+        """Lo agregado desde mark(), en la forma que extend() vuelve a aplicar."""
+        strings_count, norms_count, lengths = mark
+        channels = {}
+        for ch, history in self.channels.items():
+            n = lengths.get(ch, 0)
+            if len(history) > n:
+                channels[ch] = [getattr(history, name)[n:] for name in ChannelHistory.__slots__]
+        norm_ids = list(self.norm_ids.items())[norms_count:]
+        return self.strings[strings_count:], norm_ids, channels
+
+    def extend(self, delta):
+        strings, norm_ids, channels = delta
+        # Los textos se internan en el mismo orden, así que conservan sus ids
+        for text in strings:
+            self.intern(text)
+        self.norm_ids.update(norm_ids)
+        for ch, columns in channels.items():
+            history = self.channels.get(ch)
+            if history is None:
+                history = self.channels[ch] = ChannelHistory()
+            for name, values in zip(ChannelHistory.__slots__, columns):
+                getattr(history, name).extend(values)
+
+def is_duplicate_programme(channel_id, start_str, stop_str, title, written_by_channel):
+    """
+    Determina si un programa ya existe para el mismo canal considerando:
+    - Título muy similar (normalize_text exacto o overlap_score >= 0.95)
+    - Solapamiento temporal >= 80% del programa más corto.
+    Si no se puede calcular solapamiento (fechas inválidas), se cae a comparación exacta de start/stop strings.
+    written_by_channel es un ProgrammeHistory.
+    """
+    history = written_by_channel.get(channel_id)
+    if not history:
+        return False
+
+    strings = written_by_channel.strings
+    string_ids = written_by_channel.string_ids
+    norm_ids = written_by_channel.norm_ids
+
+    # Ids del nuevo programa (None si el texto nunca se guardó: no puede coincidir)
+    new_norm_id = string_ids.get(normalize_text(title))
+    new_start_str_id = string_ids.get(start_str or "")
+    new_stop_str_id = string_ids.get(stop_str or "")
+    same_strings_possible = new_start_str_id is not None and new_stop_str_id is not None
+
+    new_start = xmltv_to_epoch(start_str)
+    new_stop = xmltv_to_epoch(stop_str)
+    new_has_ts = new_start is not None and new_stop is not None
+
+    overlap_by_title_id = {}
+    for i in range(len(history)):
+        title_id = history.title_ids[i]
 
         # 1. Comparación de títulos
-        if new_norm == stored_norm_title:
-            # títulos exactamente iguales (normalizados)
-            pass  # continuar a verificación temporal
-        else:
-            # Calcular overlap_score
-            if overlap_score(title, stored_raw_title) < 0.95:
+        same_norm = new_norm_id is not None and norm_ids[title_id] == new_norm_id
+        if not same_norm:
+            similar = overlap_by_title_id.get(title_id)
+            if similar is None:
+                similar = overlap_by_title_id[title_id] = overlap_score(title, strings[title_id]) >= 0.95
+            if not similar:
                 continue  # no es duplicado por título
 
+        same_strings = (same_strings_possible
+                        and history.start_str_ids[i] == new_start_str_id
+                        and history.stop_str_ids[i] == new_stop_str_id)
+
         # 2. Verificación temporal
-        if new_has_dt and stored_start_dt is not None and stored_stop_dt is not None:
-            # Calcular solapamiento real
-            overlap_start = max(new_start_dt, stored_start_dt)
-            overlap_end = min(new_stop_dt, stored_stop_dt)
-            if overlap_end > overlap_start:
-                overlap_duration = (overlap_end - overlap_start).total_seconds()
-                dur1 = (new_stop_dt - new_start_dt).total_seconds()
-                dur2 = (stored_stop_dt - stored_start_dt).total_seconds()
-                min_duration = min(dur1, dur2)
-                if min_duration > 0:
-                    overlap_ratio = overlap_duration / min_duration
-                    if overlap_ratio >= 0.80:
-                        return True
-                    else:
-                        continue  # no hay suficiente solapamiento
-                else:
-                    # duración cero, considerar duplicado solo si títulos iguales y fechas iguales?
-                    # En este caso, si títulos iguales y fechas iguales, es duplicado.
-                    if new_norm == stored_norm_title and new_start_str == stored_start_str and new_stop_str == stored_stop_str:
-                        return True
-                    continue
-            else:
-                # sin solapamiento, no es duplicado
+        stored_start = history.starts[i]
+        stored_stop = history.stops[i]
+        if new_has_ts and stored_start != NO_TIMESTAMP and stored_stop != NO_TIMESTAMP:
+            min_duration = min(new_stop - new_start, stored_stop - stored_start)
+            if min_duration <= 0:
+                # Duración cero (no puede solaparse): duplicado solo si títulos y fechas
+                # son exactamente iguales
+                if same_norm and same_strings:
+                    return True
                 continue
-        else:
-            # Fallback: comparación exacta de strings de start/stop
-            if new_start_str == stored_start_str and new_stop_str == stored_stop_str:
+            overlap_start = max(new_start, stored_start)
+            overlap_end = min(new_stop, stored_stop)
+            if overlap_end > overlap_start and (overlap_end - overlap_start) / min_duration >= 0.80:
                 return True
+            # sin solapamiento suficiente, no es duplicado
             continue
+        # Fallback: comparación exacta de strings de start/stop
+        if same_strings:
+            return True
 
     return False
 
@@ -1417,53 +2502,1350 @@ def is_duplicate_programme(channel_id, start_str, stop_str, title, written_by_ch
 # MAIN
 # =========================
 
-def download_xml(url, output_path):
+def download_xml(url, output_path, timeout=DOWNLOAD_TIMEOUT, max_seconds=None, session=None):
     print(f"Descargando: {url}", flush=True)
-    with SESSION.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT) as r:
+    started = time.monotonic()
+    with (session or get_session()).get(url, stream=True, timeout=timeout) as r:
         r.raise_for_status()
         if url.lower().endswith(".gz"):
-            with gzip.GzipFile(fileobj=r.raw) as gz:
-                with open(output_path, "wb") as f:
-                    for chunk in iter(lambda: gz.read(1024 * 1024), b""):
-                        f.write(chunk)
+            gz = gzip.GzipFile(fileobj=r.raw)
+            chunks = iter(lambda: gz.read(1024 * 1024), b"")
         else:
-            with open(output_path, "wb") as f:
-                for chunk in r.iter_content(chunk_size=1024 * 1024):
-                    if chunk:
-                        f.write(chunk)
-
-def main():
-    print("Iniciando script enriquecido v3.1...", flush=True)
-    if not os.path.exists(CHANNELS_FILE):
-        print("Error: No existe channels.txt", flush=True)
+            chunks = r.iter_content(chunk_size=1024 * 1024)
+        with open(output_path, "wb") as f:
+            for chunk in chunks:
+                if chunk:
+                    f.write(chunk)
+                if max_seconds and time.monotonic() - started > max_seconds:
+                    raise TimeoutError(f"descarga excede {max_seconds:.0f}s")
+
+# =========================
+# SALUD DE FUENTES
+# =========================
+
+feed_health = {}
+_fast_fail_session = None
+
+def load_feed_health():
+    global feed_health
+    feed_health = {}
+    if os.path.exists(FEED_HEALTH_FILE):
+        try:
+            with open(FEED_HEALTH_FILE, "r", encoding="utf-8") as f:
+                feed_health = json.load(f)
+        except Exception:
+            feed_health = {}
+
+def save_feed_health():
+    with open(FEED_HEALTH_FILE, "w", encoding="utf-8") as f:
+        json.dump(feed_health, f, ensure_ascii=False, indent=2, sort_keys=True)
+
+def feed_health_record(url):
+    record = feed_health.setdefault(url, {})
+    record.setdefault("latencies", [])
+    record.setdefault("failure_streak", 0)
+    record.setdefault("open_until", 0)
+    return record
+
+def adaptive_feed_timeouts(record):
+    """(timeout de requests, tope total en segundos) según las latencias recientes."""
+    latencies = record["latencies"]
+    if not latencies:
+        return DOWNLOAD_TIMEOUT, FEED_MAX_DOWNLOAD_SECONDS
+    slowest = max(latencies)
+    read_timeout = min(max(slowest * 2, FEED_MIN_READ_TIMEOUT), DOWNLOAD_TIMEOUT[1])
+    max_seconds = min(max(slowest * 4, FEED_MIN_DOWNLOAD_SECONDS), FEED_MAX_DOWNLOAD_SECONDS)
+    return (DOWNLOAD_TIMEOUT[0], read_timeout), max_seconds
+
+def feed_store_path(url):
+    name = re.sub(r"[^\w.\-]", "_", url.rstrip("/").split("/")[-1])
+    if name.endswith(".gz"):
+        name = name[:-3]
+    digest = hashlib.sha1(url.encode("utf-8")).hexdigest()[:10]
+    return os.path.join(FEED_STORE_DIR, f"{digest}_{name}.gz")
+
+def store_last_good_copy(url, path):
+    os.makedirs(FEED_STORE_DIR, exist_ok=True)
+    store_path = feed_store_path(url)
+    with open(path, "rb") as f_in, gzip.open(store_path + ".tmp", "wb", compresslevel=1) as f_out:
+        while True:
+            chunk = f_in.read(1024 * 1024)
+            if not chunk:
+                break
+            f_out.write(chunk)
+    os.replace(store_path + ".tmp", store_path)
+
+def restore_last_good_copy(url, output_path):
+    store_path = feed_store_path(url)
+    if not os.path.exists(store_path):
+        return False
+    age_hours = (now_ts() - int(os.path.getmtime(store_path))) / 3600
+    if age_hours * 3600 > FEED_STORE_MAX_AGE:
+        print(f"  -> Copia guardada demasiado vieja ({age_hours:.1f} h), se descarta: {url.split('/')[-1]}", flush=True)
+        os.remove(store_path)
+        return False
+    with gzip.open(store_path, "rb") as f_in, open(output_path, "wb") as f_out:
+        while True:
+            chunk = f_in.read(1024 * 1024)
+            if not chunk:
+                break
+            f_out.write(chunk)
+    print(f"  -> Usando última copia buena ({age_hours:.1f} h): {url.split('/')[-1]}", flush=True)
+    return True
+
+def fetch_feed(url, output_path):
+    """
+    Descarga una fuente respetando su circuit breaker y con timeouts adaptados a su
+    historial. Si la fuente está en enfriamiento o la descarga falla, recurre a la
+    última copia buena; si tampoco existe, propaga el error.
+    """
+    global _fast_fail_session
+    record = feed_health_record(url)
+    if record["open_until"] > now_ts():
+        print(f"Circuit breaker abierto para {url} ({record['failure_streak']} fallos seguidos)", flush=True)
+        if restore_last_good_copy(url, output_path):
+            return
+        raise RuntimeError("fuente en enfriamiento y sin copia previa")
+    if not deadline_allows("network"):
+        print(f"Deadline cercano: se evita descargar {url}", flush=True)
+        if restore_last_good_copy(url, output_path):
+            return
+
+    timeout, max_seconds = adaptive_feed_timeouts(record)
+    if run_deadline is not None:
+        # La descarga no puede comerse el tiempo reservado para cerrar la guía
+        max_seconds = max(min(max_seconds, run_deadline.seconds_until("feeds")), 1)
+    session = None
+    if record["failure_streak"]:
+        # Una fuente que viene fallando no merece reintentos con backoff
+        if _fast_fail_session is None:
+            _fast_fail_session = build_session(max_retries=0)
+        session = _fast_fail_session
+    started = time.monotonic()
+    try:
+        download_xml(url, output_path, timeout=timeout, max_seconds=max_seconds, session=session)
+    except Exception as e:
+        record["failure_streak"] += 1
+        record["last_failure"] = now_ts()
+        record["last_error"] = str(e)[:200]
+        if record["failure_streak"] >= FEED_BREAKER_THRESHOLD:
+            cooldown = min(FEED_BREAKER_COOLDOWN * 2 ** (record["failure_streak"] - FEED_BREAKER_THRESHOLD),
+                           FEED_BREAKER_MAX_COOLDOWN)
+            record["open_until"] = now_ts() + cooldown
+            print(f"Circuit breaker: {url} en enfriamiento por {cooldown // 3600} h", flush=True)
+        print(f"Error descargando {url}: {e}", flush=True)
+        if restore_last_good_copy(url, output_path):
+            return
+        raise
+    record["latencies"] = (record["latencies"] + [round(time.monotonic() - started, 2)])[-FEED_LATENCY_HISTORY:]
+    record["failure_streak"] = 0
+    record["open_until"] = 0
+    record["last_success"] = now_ts()
+    try:
+        store_last_good_copy(url, output_path)
+    except OSError as e:
+        print(f"No se pudo guardar copia de {url}: {e}", flush=True)
+
+# =========================
+# ÍNDICE FUENTE -> CANALES
+# =========================
+
+feed_channel_index = {"last_full_scan": 0, "feeds": {}}
+
+def load_feed_channel_index():
+    global feed_channel_index
+    feed_channel_index = {"last_full_scan": 0, "feeds": {}}
+    if os.path.exists(FEED_INDEX_FILE):
+        try:
+            with open(FEED_INDEX_FILE, "r", encoding="utf-8") as f:
+                feed_channel_index.update(json.load(f))
+        except Exception:
+            feed_channel_index = {"last_full_scan": 0, "feeds": {}}
+
+def save_feed_channel_index():
+    with open(FEED_INDEX_FILE, "w", encoding="utf-8") as f:
+        json.dump(feed_channel_index, f, ensure_ascii=False, indent=1, sort_keys=True)
+
+def feed_index_full_scan_due():
+    return now_ts() - feed_channel_index.get("last_full_scan", 0) > FEED_INDEX_RESCAN_SECONDS
+
+def record_feed_channels(url, channels):
+    feed_channel_index["feeds"][url] = {"channels": sorted(channels), "ts": now_ts()}
+
+def feed_claimable_channels(url, allowed_canonical):
+    """Canales pedidos que la fuente aportó en su última lectura (None si no hay registro)."""
+    entry = feed_channel_index["feeds"].get(url)
+    if entry is None:
+        return None
+    claimable = set()
+    for ch in entry["channels"]:
+        rules = CHANNEL_SOURCE_RULES.get(ch)
+        if ch in allowed_canonical and (not rules or url in rules):
+            claimable.add(ch)
+    return claimable
+
+def can_skip_feed(url, allowed_canonical, covered_channels):
+    """Una fuente se omite si todo lo que podría aportar ya lo tomó otra de mayor prioridad."""
+    claimable = feed_claimable_channels(url, allowed_canonical)
+    return claimable is not None and all(ch in covered_channels for ch in claimable)
+
+# =========================
+# SALIDAS DE LA GUÍA
+# =========================
+
+XMLTV_HEADER = b'<?xml version="1.0" encoding="UTF-8"?>\n<tv>\n'
+XMLTV_FOOTER = b"</tv>\n"
+
+def write_deterministic_gzip(path, chunks):
+    """Escribe un gzip sin fecha ni nombre de archivo (mismo contenido -> mismos bytes)."""
+    with open(path, "wb") as raw:
+        with gzip.GzipFile(filename="", mode="wb", fileobj=raw, mtime=0) as f_out:
+            for chunk in chunks:
+                f_out.write(chunk)
+
+class GuideWriter:
+    """Reparte cada <channel>/<programme> aceptado entre todas las salidas configuradas."""
+
+    def __init__(self, outputs):
+        self.outputs = list(outputs)
+        # Con --checkpoint: escrituras desde el último fragmento del journal
+        self.recorded = None
+
+    def channel(self, canonical_ch_id, data):
+        if self.recorded is not None:
+            self.recorded.append(("channel", canonical_ch_id, data))
+        for output in self.outputs:
+            output.channel(canonical_ch_id, data)
+
+    def programme(self, canonical_ch_id, start, stop, data):
+        if self.recorded is not None:
+            self.recorded.append(("programme", canonical_ch_id, start, stop, data))
+        for output in self.outputs:
+            output.programme(canonical_ch_id, start, stop, data)
+
+    def take_recorded(self):
+        recorded, self.recorded = self.recorded, []
+        return recorded
+
+    def replay(self, recorded):
+        for call in recorded:
+            if call[0] == "channel":
+                self.channel(*call[1:])
+            else:
+                self.programme(*call[1:])
+
+    def close(self):
+        for output in self.outputs:
+            output.close()
+
+def programme_sort_key(programme):
+    start, stop = programme[0], programme[1]
+    start_ts = xmltv_to_epoch(start)
+    return (start_ts if start_ts is not None else NO_TIMESTAMP, start, stop)
+
+class XmltvGuideOutput:
+    """
+    Guía principal en orden determinista: canales ordenados por id y, después, los
+    programas de cada canal ordenados por inicio. Así el mismo contenido produce
+    exactamente los mismos bytes entre ejecuciones (el gzip no lleva fecha) y las
+    regiones sin cambios no generan diferencias. Se reemplaza de forma atómica.
+
+    Con seekable=True cada canal va en un miembro gzip independiente (sigue siendo
+    un gzip válido) y se escribe <guía>.idx.json con el offset de cada miembro,
+    para que SeekableGuide descomprima solo el canal consultado.
+
+    Los bytes de cada programa se vuelcan a <guía>.spool a medida que llegan; en
+    memoria queda solo (start, stop, offset, largo) para ordenar al cerrar.
+    """
+
+    def __init__(self, path, seekable=False):
+        self.path = path
+        self.seekable = seekable
+        self.channel_data = {}
+        self.programmes = defaultdict(list)   # canal -> [(start, stop, offset, largo)]
+        self.spool_path = f"{path}.spool"
+        self.spool = None
+        self.channel_count = 0
+        self.programme_count = 0
+
+    def channel(self, canonical_ch_id, data):
+        self.channel_data.setdefault(canonical_ch_id, data)
+
+    def programme(self, canonical_ch_id, start, stop, data):
+        if self.spool is None:
+            self.spool = open(self.spool_path, "w+b")
+        self.spool.seek(0, os.SEEK_END)
+        offset = self.spool.tell()
+        self.spool.write(data)
+        self.programmes[canonical_ch_id].append((start, stop, offset, len(data)))
+
+    def read_programme(self, entry):
+        self.spool.seek(entry[2])
+        return self.spool.read(entry[3])
+
+    def discard_spool(self):
+        if self.spool is not None:
+            self.spool.close()
+            self.spool = None
+        if os.path.exists(self.spool_path):
+            os.remove(self.spool_path)
+
+    def header_chunks(self):
+        yield XMLTV_HEADER
+        for ch_id in sorted(self.channel_data):
+            yield self.channel_data[ch_id]
+            yield b"\n"
+
+    def channel_chunks(self, programmes):
+        for entry in programmes:
+            yield self.read_programme(entry)
+            yield b"\n"
+
+    def iter_chunks(self):
+        yield from self.header_chunks()
+        for ch_id in sorted(self.programmes):
+            yield from self.channel_chunks(sorted(self.programmes[ch_id], key=programme_sort_key))
+        yield XMLTV_FOOTER
+
+    def _write_seekable(self, tmp_path):
+        index = {"format": SEEKABLE_INDEX_FORMAT, "channels": []}
+        digest = hashlib.sha256()
+        with open(tmp_path, "wb") as raw:
+            def write_member(chunks):
+                offset = raw.tell()
+                member = gzip.compress(b"".join(chunks), mtime=0)
+                raw.write(member)
+                digest.update(member)
+                return offset, raw.tell() - offset, hashlib.sha256(member).hexdigest()
+            index["header"] = dict(zip(("offset", "length", "sha256"), write_member(self.header_chunks())))
+            for ch_id in sorted(self.programmes):
+                programmes = sorted(self.programmes[ch_id], key=programme_sort_key)
+                offset, length, member_sha256 = write_member(self.channel_chunks(programmes))
+                starts = [s for s in (xmltv_to_epoch(p[0]) for p in programmes) if s is not None]
+                stops = [s for s in (xmltv_to_epoch(p[1]) for p in programmes) if s is not None]
+                index["channels"].append({
+                    "id": ch_id,
+                    "first_start": min(starts) if starts else None,
+                    "last_start": max(starts) if starts else None,
+                    "last_stop": max(stops) if stops else None,
+                    "programmes": len(programmes),
+                    "offset": offset,
+                    "length": length,
+                    "sha256": member_sha256,
+                })
+            index["footer"] = dict(zip(("offset", "length", "sha256"), write_member([XMLTV_FOOTER])))
+            # Identifica la guía que describe: los dos os.replace no son atómicos en conjunto
+            index["guide_size"] = raw.tell()
+            index["guide_sha256"] = digest.hexdigest()
+        return index
+
+    def close(self):
+        self.channel_count = len(self.channel_data)
+        self.programme_count = sum(len(p) for p in self.programmes.values())
+        tmp_path = f"{self.path}.tmp"
+        index_path = self.path + SEEKABLE_INDEX_SUFFIX
+        try:
+            if self.seekable:
+                index = self._write_seekable(tmp_path)
+                with open(index_path + ".tmp", "w", encoding="utf-8") as f:
+                    json.dump(index, f, ensure_ascii=False, indent=1)
+                # Entre ambos reemplazos el índice no coincide con la guía; SeekableGuide
+                # lo detecta por tamaño y por el hash de cada miembro que lee
+                os.replace(index_path + ".tmp", index_path)
+                os.replace(tmp_path, self.path)
+            else:
+                write_deterministic_gzip(tmp_path, self.iter_chunks())
+                os.replace(tmp_path, self.path)
+                # Un índice de una ejecución --seekable anterior ya no describe esta guía
+                if os.path.exists(index_path):
+                    os.remove(index_path)
+        finally:
+            self.discard_spool()
+
+class SplitGuideOutput:
+    """
+    Fragmentos XMLTV por canal (channels/<id>.xml.gz) y por día UTC de inicio
+    (days/<YYYYMMDD>.xml.gz) más manifest.json con hash, tamaño y rango horario
+    de cada fragmento, para que los clientes refresquen solo lo que necesitan.
+
+    Como en XmltvGuideOutput, los bytes de cada programa van a <directorio>.spool y
+    en memoria queda solo (start, stop, offset, largo).
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.channel_data = {}                 # canal -> bytes de <channel>
+        self.programmes = defaultdict(list)    # canal -> [(start, stop, offset, largo)]
+        self.spool_path = f"{directory.rstrip(os.sep)}.spool"
+        self.spool = None
+
+    def channel(self, canonical_ch_id, data):
+        # Gana el primero, igual que en la guía principal
+        self.channel_data.setdefault(canonical_ch_id, data)
+
+    def programme(self, canonical_ch_id, start, stop, data):
+        if self.spool is None:
+            self.spool = open(self.spool_path, "w+b")
+        self.spool.seek(0, os.SEEK_END)
+        offset = self.spool.tell()
+        self.spool.write(data)
+        self.programmes[canonical_ch_id].append((start, stop, offset, len(data)))
+
+    def read_programme(self, entry):
+        self.spool.seek(entry[2])
+        return self.spool.read(entry[3])
+
+    def discard_spool(self):
+        if self.spool is not None:
+            self.spool.close()
+            self.spool = None
+        if os.path.exists(self.spool_path):
+            os.remove(self.spool_path)
+
+    def fragment_chunks(self, channel_ids, programmes):
+        yield XMLTV_HEADER
+        for ch_id in channel_ids:
+            if ch_id in self.channel_data:
+                yield self.channel_data[ch_id]
+                yield b"\n"
+        for entry in programmes:
+            yield self.read_programme(entry)
+            yield b"\n"
+        yield XMLTV_FOOTER
+
+    def _write_fragment(self, rel_path, channel_ids, programmes):
+        path = os.path.join(self.directory, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_deterministic_gzip(path, self.fragment_chunks(channel_ids, programmes))
+        # Epoch: los textos XMLTV con distinto huso no se ordenan bien como cadenas
+        starts = [s for s in (xmltv_to_epoch(p[0]) for p in programmes) if s is not None]
+        stops = [s for s in (xmltv_to_epoch(p[1]) for p in programmes) if s is not None]
+        return {
+            "path": rel_path.replace(os.sep, "/"),
+            "sha256": file_sha256(path),
+            "size": os.path.getsize(path),
+            "programmes": len(programmes),
+            "first_start": min(starts) if starts else None,
+            "last_stop": max(stops) if stops else None,
+        }
+
+    def _write_manifest(self, manifest):
+        """
+        Escribe manifest.json solo si cambió algún fragmento: "generated" indica desde
+        cuándo rige este contenido, así que el mismo contenido produce los mismos bytes.
+        """
+        path = os.path.join(self.directory, "manifest.json")
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                previous = json.load(f)
+        except (OSError, ValueError):
+            previous = {}
+        if {k: v for k, v in previous.items() if k != "generated"} == manifest:
+            return
+        manifest = {"generated": now_ts(), **manifest}
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(path + ".tmp", path)
+
+    def close(self):
+        manifest = {"channels": {}, "days": {}}
+        by_day = defaultdict(list)
+        by_day_channels = defaultdict(set)
+        try:
+            for ch_id in sorted(set(self.channel_data) | set(self.programmes)):
+                programmes = self.programmes.get(ch_id, [])
+                safe_id = re.sub(r"[^\w.\-]", "_", ch_id)
+                manifest["channels"][ch_id] = self._write_fragment(
+                    os.path.join("channels", f"{safe_id}.xml.gz"), [ch_id], programmes
+                )
+                for programme in programmes:
+                    # Día UTC del inicio: el texto local de cada fuente no es comparable
+                    start = xmltv_to_epoch(programme[0])
+                    if start is not None:
+                        day = time.strftime("%Y%m%d", time.gmtime(start))
+                        by_day[day].append(programme)
+                        by_day_channels[day].add(ch_id)
+            for day in sorted(by_day):
+                manifest["days"][day] = self._write_fragment(
+                    os.path.join("days", f"{day}.xml.gz"), sorted(by_day_channels[day]), by_day[day]
+                )
+        finally:
+            self.discard_spool()
+        self._write_manifest(manifest)
+        print(f"Fragmentos: {len(manifest['channels'])} canales, {len(manifest['days'])} días en {self.directory}", flush=True)
+
+# =========================
+# GUÍAS REGIONALES
+# =========================
+
+# Varias guías desde una sola pasada: cada salida tiene su lista de canales y recibe
+# solo esos canales y sus programas. Las fuentes se descargan, parsean, enriquecen y
+# deduplican una vez para la unión de todas las listas.
+
+def parse_output_spec(spec):
+    """'guía=lista de canales' -> (guía, lista de canales)."""
+    guide, sep, channels_file = (spec or "").partition("=")
+    if not sep or not guide.strip() or not channels_file.strip():
+        raise argparse.ArgumentTypeError(f"salida inválida: {spec!r} (formato guia.xml.gz=canales.txt)")
+    return guide.strip(), channels_file.strip()
+
+class ChannelSubsetOutput:
+    """Reenvía a una salida solo los canales (canónicos) de su lista."""
+
+    def __init__(self, output, channels):
+        self.output = output
+        self.channels = channels
+
+    def channel(self, canonical_ch_id, data):
+        if canonical_ch_id in self.channels:
+            self.output.channel(canonical_ch_id, data)
+
+    def programme(self, canonical_ch_id, start, stop, data):
+        if canonical_ch_id in self.channels:
+            self.output.programme(canonical_ch_id, start, stop, data)
+
+    def close(self):
+        self.output.close()
+
+# =========================
+# CHECKPOINT Y REANUDACIÓN
+# =========================
+
+class BuildCheckpoint:
+    """
+    Journal de una construcción a medias: una cabecera (formato, firma, fecha) y, por
+    cada fuente terminada, un fragmento con lo que esa fuente agregó: asignaciones de
+    canal, historial de deduplicación, escrituras en las salidas, su salud y su entrada
+    del índice de fuentes y los contadores del presupuesto de enriquecimiento. Los
+    fragmentos se agregan al final del archivo (no se reescribe lo anterior) y se
+    aplican en orden al reanudar; un fragmento final a medio escribir se descarta.
+    Se borra al escribir la guía. Solo se reanuda si la firma coincide (mismas fuentes,
+    canales y salidas) y no es más viejo que CHECKPOINT_MAX_AGE_HOURS: pasado ese
+    plazo conviene volver a descargar todo.
+    """
+    FORMAT = 2
+
+    def __init__(self, path, signature):
+        self.path = path
+        self.signature = signature
+        self.created = now_ts()
+        self.full_scan = False
+        self.claims_mark = 0
+        self.history_mark = None
+
+    @staticmethod
+    def build_signature(epg_urls, allowed_canonical, output_file, split_dir, regional_outputs=()):
+        payload = json.dumps([list(epg_urls), sorted(allowed_canonical), output_file, split_dir,
+                              [list(output) for output in regional_outputs]])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def load(self):
+        """Fragmentos guardados, en orden, o None si no hay un journal reanudable."""
+        if not os.path.exists(self.path):
+            return None
+        fragments = []
+        try:
+            with open(self.path, "rb") as f:
+                header = pickle.load(f)
+                valid_size = f.tell()
+                while True:
+                    try:
+                        fragment = pickle.load(f)
+                    except Exception:
+                        break
+                    fragments.append(fragment)
+                    valid_size = f.tell()
+        except Exception as e:
+            print(f"Checkpoint ilegible, se ignora: {e}", flush=True)
+            return None
+        if not isinstance(header, dict) or header.get("format") != self.FORMAT \
+                or header.get("signature") != self.signature:
+            print("Checkpoint de otra configuración, se ignora.", flush=True)
+            return None
+        if header.get("created", 0) < now_ts() - CHECKPOINT_MAX_AGE_HOURS * 3600:
+            print("Checkpoint vencido, se ignora.", flush=True)
+            return None
+        if valid_size < os.path.getsize(self.path):
+            # Corte a mitad de un fragmento: los siguientes se agregan tras el último completo
+            print("Checkpoint: se descarta un fragmento incompleto.", flush=True)
+            with open(self.path, "r+b") as f:
+                f.truncate(valid_size)
+        self.created = header["created"]
+        self.full_scan = header["full_scan"]
+        return fragments
+
+    def start(self, full_scan):
+        """Empieza un journal nuevo (descarta el anterior)."""
+        self.full_scan = full_scan
+        with open(self.path, "wb") as f:
+            pickle.dump({"format": self.FORMAT, "signature": self.signature, "created": self.created,
+                         "full_scan": full_scan}, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def mark(self, state):
+        """Recuerda hasta dónde llega el estado; el próximo fragmento lleva solo lo posterior."""
+        self.claims_mark = len(state["channel_source_assigned"])
+        self.history_mark = state["written_programmes_by_channel"].mark()
+
+    def append(self, url, state, writer):
+        fragment = {
+            "url": url,
+            # channel_source_assigned solo agrega claves: las nuevas quedan al final
+            "claims": list(state["channel_source_assigned"].items())[self.claims_mark:],
+            "history": state["written_programmes_by_channel"].since(self.history_mark),
+            "writes": writer.take_recorded(),
+            "feed_health": feed_health.get(url),
+            "feed_channels": feed_channel_index["feeds"].get(url),
+            "budget": list(enrichment_scheduler.counters) if enrichment_scheduler is not None else None,
+        }
+        with open(self.path, "ab") as f:
+            pickle.dump(fragment, f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.mark(state)
+
+    @staticmethod
+    def apply(fragment, state, writer):
+        """Rehace en state y en las salidas lo que una fuente había aportado."""
+        url = fragment["url"]
+        state["channel_source_assigned"].update(fragment["claims"])
+        state["written_programmes_by_channel"].extend(fragment["history"])
+        state["written_channels"].update(call[1] for call in fragment["writes"] if call[0] == "channel")
+        writer.replay(fragment["writes"])
+        if fragment["feed_health"] is not None:
+            feed_health[url] = fragment["feed_health"]
+        if fragment["feed_channels"] is not None:
+            feed_channel_index["feeds"][url] = fragment["feed_channels"]
+        if fragment["budget"] is not None and enrichment_scheduler is not None:
+            for position, value in enumerate(fragment["budget"]):
+                enrichment_scheduler.counters[position] = value
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+# =========================
+# DELTA ENTRE GUÍAS
+# =========================
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def iter_guide_entries(path):
+    """(tipo, canal, start, bytes) de cada elemento de una guía, re-serializado de forma canónica."""
+    with gzip.open(path, "rb") as f:
+        for elem in iter_feed_elements(f):
+            data = XML.tostring(elem)
+            if elem.tag == "channel":
+                yield "channel", elem.get("id"), "", data
+            else:
+                yield "programme", elem.get("channel"), elem.get("start", ""), data
+
+def index_guide_entries(path, db_path):
+    """
+    Guarda en SQLite (db_path) el sha1 de cada elemento de la guía, por (tipo, canal, start),
+    para comparar después sin tener la guía anterior en memoria. Retorna (sha256 del
+    archivo o None si no existe, db_path).
+    """
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    db = sqlite3.connect(db_path)
+    try:
+        db.execute("CREATE TABLE entries (kind TEXT, channel TEXT, start TEXT, digest BLOB, "
+                   "seen INTEGER DEFAULT 0, PRIMARY KEY (kind, channel, start))")
+        if not os.path.exists(path):
+            return None, db_path
+        db.executemany("INSERT OR REPLACE INTO entries (kind, channel, start, digest) VALUES (?, ?, ?, ?)",
+                       ((kind, ch, start, hashlib.sha1(data).digest())
+                        for kind, ch, start, data in iter_guide_entries(path)))
+        db.commit()
+        return file_sha256(path), db_path
+    finally:
+        db.close()
+
+def build_guide_delta(previous, guide_path):
+    """
+    Delta de programas (clave canal+start) y canales entre la guía indexada con
+    index_guide_entries y la recién escrita, que se recorre en streaming: en memoria
+    solo quedan los elementos nuevos o cambiados.
+    """
+    base_sha, db_path = previous
+    db = sqlite3.connect(db_path)
+    found = {"channel": ({}, {}), "programme": ({}, {})}   # tipo -> (agregados, cambiados)
+    try:
+        new_entries = {}
+        for kind, ch, start, data in iter_guide_entries(guide_path):
+            # Si una clave se repite vale la última (igual que la guía anterior)
+            new_entries[(kind, ch, start)] = data
+            if len(new_entries) >= 5000:
+                _compare_guide_entries(db, new_entries, found)
+        _compare_guide_entries(db, new_entries, found)
+        removed = {"channel": [], "programme": []}
+        for kind, ch, start in db.execute(
+                "SELECT kind, channel, start FROM entries WHERE seen = 0 ORDER BY kind, channel, start"):
+            removed[kind].append((ch, start))
+    finally:
+        db.close()
+    c_added, c_changed = found["channel"]
+    p_added, p_changed = found["programme"]
+
+    def programme_entries(entries):
+        return [{"channel": k[0], "start": k[1], "xml": entries[k].decode("utf-8")} for k in sorted(entries)]
+
+    def channel_entries(entries):
+        return [{"id": k[0], "xml": entries[k].decode("utf-8")} for k in sorted(entries)]
+
+    return {
+        "base_sha256": base_sha,
+        "target_sha256": file_sha256(guide_path),
+        "channels": {
+            "added": channel_entries(c_added),
+            "changed": channel_entries(c_changed),
+            "removed": [k[0] for k in removed["channel"]],
+        },
+        "programmes": {
+            "added": programme_entries(p_added),
+            "changed": programme_entries(p_changed),
+            "removed": [{"channel": k[0], "start": k[1]} for k in removed["programme"]],
+        },
+    }
+
+def _compare_guide_entries(db, new_entries, found):
+    """Compara un lote de elementos nuevos contra el índice y marca los vistos."""
+    for (kind, ch, start), data in new_entries.items():
+        row = db.execute("SELECT digest FROM entries WHERE kind = ? AND channel = ? AND start = ?",
+                         (kind, ch, start)).fetchone()
+        added, changed = found[kind]
+        if row is None:
+            added[(ch, start)] = data
+            continue
+        if bytes(row[0]) != hashlib.sha1(data).digest():
+            changed[(ch, start)] = data
+        else:
+            changed.pop((ch, start), None)
+        db.execute("UPDATE entries SET seen = 1 WHERE kind = ? AND channel = ? AND start = ?", (kind, ch, start))
+    new_entries.clear()
+
+def guide_delta_path(guide_path):
+    """Delta junto a la guía que describe: guia.xml.gz -> guia.delta.json.gz."""
+    base = guide_path
+    for suffix in (".gz", ".xml"):
+        if base.endswith(suffix):
+            base = base[:-len(suffix)]
+    return base + ".delta.json.gz"
+
+def write_guide_delta(previous, guide_path, delta_path):
+    try:
+        delta = build_guide_delta(previous, guide_path)
+    finally:
+        os.remove(previous[1])
+    payload = json.dumps(delta, ensure_ascii=False, sort_keys=True, indent=1).encode("utf-8")
+    write_deterministic_gzip(delta_path, [payload])
+    p = delta["programmes"]
+    print(f"Delta: {delta_path} | +{len(p['added'])} ~{len(p['changed'])} -{len(p['removed'])} programas", flush=True)
+
+def iter_feed_elements(path):
+    """Recorre los <channel> y <programme> de un XMLTV liberando cada uno tras usarlo."""
+    return XML.iter_elements(path)
+
+def iter_feed_channels(path):
+    """Recorre solo la cabecera de <channel>; se detiene al abrir el primer <programme>."""
+    return XML.iter_elements(path, header_only=True)
+
+def serialize_channel(elem, canonical_ch_id):
+    channel_elem = clone_element(elem)
+    channel_elem.set("id", canonical_ch_id)
+    return XML.tostring(channel_elem)
+
+def claim_channel_source(channel_source_assigned, canonical_ch_id, url):
+    """La primera fuente (en orden de prioridad) que aporta un canal se queda con él."""
+    if canonical_ch_id not in channel_source_assigned:
+        channel_source_assigned[canonical_ch_id] = url
+    return channel_source_assigned[canonical_ch_id] == url
+
+def write_programme_if_new(writer, canonical_ch_id, start, stop, title, data, written_programmes_by_channel,
+                           written_span=None):
+    # --- DEDUPLICACIÓN --- (sobre los horarios originales de la fuente)
+    if is_duplicate_programme(canonical_ch_id, start, stop, title, written_programmes_by_channel):
+        return False
+    written_programmes_by_channel.add(canonical_ch_id, start, stop, title)
+    out_start, out_stop = written_span or (start, stop)
+    writer.programme(canonical_ch_id, out_start, out_stop, data)
+    return True
+
+# =========================
+# PROCESAMIENTO POR LOTES
+# =========================
+
+# Los programas que se conservan de una fuente se acumulan en columnas (canal, start,
+# stop, títulos, subtítulo, descripción, episode-num...). La normalización, la
+# extracción de temporada/episodio, la fecha de emisión y el enriquecimiento completo
+# se calculan una vez por valor distinto de cada columna: en una guía EPG los mismos
+# títulos, descripciones y repeticiones aparecen cientos de veces.
+
+class ProgrammeBatch:
+    """Programas pendientes de una fuente en columnas paralelas."""
+    __slots__ = ("elems", "ch_ids", "channels", "starts", "stops", "titles", "english_titles",
+                 "subtitles", "descs", "spanish_titles", "episode_nums", "image_years")
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, [])
+
+    def __len__(self):
+        return len(self.elems)
+
+    def append(self, elem, ch_id, canonical_ch_id, prefer_latam):
+        # Copia propia: el backend XML libera el elemento original al avanzar el parseo
+        self.elems.append(clone_element(elem))
+        self.ch_ids.append(ch_id)
+        self.channels.append(canonical_ch_id)
+        self.starts.append(elem.get("start", ""))
+        self.stops.append(elem.get("stop", ""))
+        (raw_title, english_title, raw_subtitle, raw_desc,
+         has_spanish_title, se_xml, image_year) = programme_fields(elem, prefer_latam)
+        self.titles.append(raw_title)
+        self.english_titles.append(english_title)
+        self.subtitles.append(raw_subtitle)
+        self.descs.append(raw_desc)
+        self.spanish_titles.append(has_spanish_title)
+        self.episode_nums.append(se_xml)
+        self.image_years.append(image_year)
+
+    def fields(self, i):
+        return (self.titles[i], self.english_titles[i], self.subtitles[i], self.descs[i],
+                self.spanish_titles[i], self.episode_nums[i], self.image_years[i])
+
+def map_unique(func, column, memo):
+    """Aplica func una sola vez por valor distinto (memo persiste entre lotes de la misma fuente)."""
+    for value in column:
+        if value not in memo:
+            memo[value] = func(value)
+    return [memo[value] for value in column]
+
+class FeedBatchEnricher:
+    """
+    Enriquecimiento columnar de los programas de una fuente. add() acumula y, al llenarse
+    el lote, retorna los programas ya enriquecidos; flush() retorna lo que quede.
+    Cada resultado es (canal, start, stop, título, bytes, (start, stop) escritos), en el
+    orden de la fuente. Las repeticiones exactas dentro de la fuente (mismo canal, horario
+    y campos) se descartan antes de enriquecer: la deduplicación las rechazaría igual.
+    """
+
+    def __init__(self, url, batch_size=PROGRAMME_BATCH_SIZE):
+        self.url = url
+        self.batch_size = batch_size
+        self.prefer_latam = is_latam_feed(url)
+        self.spanish_se_format = use_spanish_season_episode_format(url)
+        self.batch = ProgrammeBatch()
+        self.memo = defaultdict(dict)
+        self.seen_rows = set()
+
+    def add(self, elem, ch_id, canonical_ch_id):
+        self.batch.append(elem, ch_id, canonical_ch_id, self.prefer_latam)
+        if len(self.batch) >= self.batch_size:
+            return self.flush()
+        return []
+
+    def flush(self):
+        batch, self.batch = self.batch, ProgrammeBatch()
+        if not len(batch):
+            return []
+        url = self.url
+        memo = self.memo
+        tvmaze_auth = map_unique(lambda ch_id: should_use_tvmaze_authoritative(url, ch_id),
+                                 batch.ch_ids, memo["tvmaze_auth"])
+        title_parts = map_unique(programme_title_parts, batch.titles, memo["title_parts"])
+        subtitle_hints = map_unique(subtitle_hint_text, batch.subtitles, memo["subtitle_hint"])
+        base_titles = map_unique(lambda pair: remove_episode_title_from_series_title(*pair),
+                                 [(parts[4], hint) for parts, hint in zip(title_parts, subtitle_hints)],
+                                 memo["base_title"])
+        se_descs = map_unique(extract_se_regex, batch.descs, memo["se_desc"])
+        air_dates = map_unique(lambda start: programme_air_date(start) if start is not None else None,
+                               [start if auth else None for start, auth in zip(batch.starts, tvmaze_auth)],
+                               memo["air_date"])
+
+        outcomes = memo["outcome"]
+        results = []
+        for i, elem in enumerate(batch.elems):
+            canonical_ch_id, start, stop = batch.channels[i], batch.starts[i], batch.stops[i]
+            key = (batch.fields(i), air_dates[i], tvmaze_auth[i])
+            row = (canonical_ch_id, start, stop, key)
+            if row in self.seen_rows:
+                continue
+            self.seen_rows.add(row)
+            outcome = outcomes.get(key)
+            if outcome is None:
+                outcome = outcomes[key] = resolve_programme(
+                    key[0], title_parts[i], subtitle_hints[i], base_titles[i], se_descs[i], air_dates[i],
+                    prefer_latam=self.prefer_latam,
+                    spanish_season_episode_format=self.spanish_se_format,
+                    tvmaze_authoritative=tvmaze_auth[i],
+                )
+            new_title, is_series, pref_sub, pref_desc = outcome
+            replace_all_title_elements(elem, new_title, self.prefer_latam)
+            normalize_subtitle_and_desc(elem, self.prefer_latam, is_series, pref_sub, pref_desc)
+            normalize_episode_num_elements(elem)
+            apply_channel_offset(elem)
+            elem.set("channel", canonical_ch_id)
+            written_span = (elem.get("start", ""), elem.get("stop", ""))
+            results.append((canonical_ch_id, start, stop, new_title, XML.tostring(elem), written_span))
+        return results
+
+def write_enriched_programmes(writer, enriched_programmes, state):
+    for canonical_ch_id, start, stop, title, data, written_span in enriched_programmes:
+        write_programme_if_new(writer, canonical_ch_id, start, stop, title, data,
+                               state["written_programmes_by_channel"], written_span)
+
+def process_feed_sequential(url, path, allowed_canonical, state, writer):
+    """Procesa una fuente descargada y retorna los canales (canónicos) que contiene."""
+    enricher = FeedBatchEnricher(url)
+    processed_programmes = 0
+    feed_channels = set()
+    try:
+        for elem in iter_feed_elements(path):
+            if not deadline_allows("feeds"):
+                # Como una fuente truncada: lo leído se conserva, pero no queda terminada
+                raise RuntimeError("interrumpida por deadline")
+            if elem.tag == "channel":
+                ch_id = elem.get("id")
+                canonical_ch_id = canonical_channel_id(ch_id)
+                feed_channels.add(canonical_ch_id)
+                if (canonical_ch_id in allowed_canonical
+                        and is_source_allowed_for_channel(ch_id, url)
+                        and canonical_ch_id not in state["written_channels"]
+                        and claim_channel_source(state["channel_source_assigned"], canonical_ch_id, url)):
+                    writer.channel(canonical_ch_id, serialize_channel(elem, canonical_ch_id))
+                    state["written_channels"].add(canonical_ch_id)
+            else:
+                processed_programmes += 1
+                if processed_programmes % 5000 == 0:
+                    print(f"Procesando... {processed_programmes} programas", flush=True)
+                ch_id = elem.get("channel")
+                canonical_ch_id = canonical_channel_id(ch_id)
+                feed_channels.add(canonical_ch_id)
+                if (canonical_ch_id in allowed_canonical
+                        and is_source_allowed_for_channel(ch_id, url)
+                        and claim_channel_source(state["channel_source_assigned"], canonical_ch_id, url)):
+                    write_enriched_programmes(writer, enricher.add(elem, ch_id, canonical_ch_id), state)
+    finally:
+        # Una fuente truncada conserva lo ya leído: sus canales ya quedaron reclamados
+        write_enriched_programmes(writer, enricher.flush(), state)
+    feed_channels.discard(None)
+    return feed_channels
+
+# =========================
+# PERFILADO (--profile)
+# =========================
+
+# Cada etapa (escaneo, cada fuente, fusión, escritura) se perfila por separado con
+# cProfile (<etapa>.pstats) y, en paralelo, un hilo muestrea la pila del hilo que
+# trabaja y la acumula en formato folded (<etapa>.folded, apto para flamegraph.pl o
+# speedscope). Al final se imprime un resumen de las funciones más costosas.
+PROFILE_DIR = "profile"
+PROFILE_SAMPLE_INTERVAL = 0.005
+PROFILE_TOP_N = 25
+# Etapa del resumen -> función que la mide ("XML.<método>" es el backend XML activo)
+PROFILE_STAGE_FUNCTIONS = (
+    ("descarga", "download_xml"),
+    ("parseo XML", "XML.iter_elements"),
+    ("enriquecimiento por lotes", "FeedBatchEnricher.flush"),
+    ("resolve_programme", "resolve_programme"),
+    ("normalize_subtitle_and_desc", "normalize_subtitle_and_desc"),
+    ("deduplicación", "is_duplicate_programme"),
+    ("serialización", "XML.tostring"),
+)
+
+# Directorio de salida del perfilado; None = desactivado
+profile_dir = None
+
+class StackSampler(threading.Thread):
+    """Muestrea la pila de un hilo cada `interval` segundos y cuenta stacks folded."""
+
+    def __init__(self, thread_id, interval=PROFILE_SAMPLE_INTERVAL):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.done = threading.Event()
+
+    def run(self):
+        while not self.done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def stop(self):
+        self.done.set()
+        self.join()
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f"{stack} {count}\n")
+
+def profile_label(url):
+    name = re.sub(r"[^\w.\-]", "_", url.rstrip("/").split("/")[-1])
+    return f"{hashlib.sha1(url.encode('utf-8')).hexdigest()[:8]}_{name}"
+
+@contextmanager
+def profile_stage(label):
+    if profile_dir is None:
+        yield
         return
-    with open(CHANNELS_FILE, "r", encoding="utf-8-sig") as f:
-        allowed_channels = {line.strip() for line in f if line.strip()}
-    if not allowed_channels:
-        print("Error: channels.txt vacío", flush=True)
+    sampler = StackSampler(threading.get_ident())
+    profiler = cProfile.Profile()
+    sampler.start()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        sampler.stop()
+        base = os.path.join(profile_dir, label)
+        profiler.dump_stats(base + ".pstats")
+        sampler.write(base + ".folded")
+
+def start_profiling(directory):
+    global profile_dir
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, "*.pstats")) + glob.glob(os.path.join(directory, "*.folded")):
+        os.remove(path)
+    profile_dir = directory
+
+def profile_stage_key(function_path):
+    """
+    Clave pstats (archivo, línea, nombre) de la función de una etapa. Se compara la
+    función exacta y no solo su nombre: hay varios flush/tostring/iter_elements.
+    """
+    head, *attrs = function_path.split(".")
+    function = globals()[head]
+    for attr in attrs:
+        function = getattr(function, attr)
+    code = getattr(function, "__func__", function).__code__
+    return code.co_filename, code.co_firstlineno, code.co_name
+
+def print_profile_summary(directory, top_n=PROFILE_TOP_N):
+    """Suma los .pstats de todas las etapas (también los de los workers) y resume."""
+    paths = sorted(glob.glob(os.path.join(directory, "*.pstats")))
+    if not paths:
         return
-    allowed_canonical = {canonical_channel_id(ch) for ch in allowed_channels}
+    stats = pstats.Stats(*paths)
+    print(f"Perfil: {len(paths)} etapas en {directory}/ ({stats.total_tt:.2f}s de CPU perfilada)", flush=True)
+    for stage, function_path in PROFILE_STAGE_FUNCTIONS:
+        entry = stats.stats.get(profile_stage_key(function_path))
+        cumulative = entry[3] if entry else 0.0
+        print(f"  {stage:<28} {cumulative:9.2f}s", flush=True)
+    print(f"  Top {top_n} por tiempo propio:", flush=True)
+    ranked = sorted(stats.stats.items(), key=lambda entry: entry[1][2], reverse=True)[:top_n]
+    for (filename, line, name), (_, calls, tottime, cumtime, _) in ranked:
+        print(f"  {tottime:9.3f}s {cumtime:9.3f}s {calls:>9} {name} ({os.path.basename(filename)}:{line})", flush=True)
 
-    channel_source_assigned = {}
+# =========================
+# MODO MULTI-PROCESO
+# =========================
 
-    good_sources = set()
-    for sources in CHANNEL_SOURCE_RULES.values():
-        for s in sources:
-            good_sources.add(s)
+def _init_feed_worker(shared_cache_path, cache_file, scheduler=None, profile_directory=None, deadline=None):
+    global SESSION, enrichment_scheduler, profile_dir, run_deadline
+    # Cada proceso usa su propia sesión HTTP (no se comparten sockets heredados)
+    SESSION = build_session()
+    # Con fork el caché ya viene cargado; con spawn se lee del archivo
+    ensure_cache_loaded(cache_file)
+    open_shared_cache(shared_cache_path)
+    enrichment_scheduler = scheduler
+    profile_dir = profile_directory
+    run_deadline = deadline
+
+def enrich_feed_task(idx, url, allowed_canonical, health_record, prefetched_path=None):
+    """
+    Worker: descarga (o toma la copia ya descargada en prefetched_path), parsea y enriquece
+    una fuente completa sin conocer qué canales tomaron fuentes de mayor prioridad.
+    Retorna eventos compactos en orden de aparición:
+    ("channel", canal, bytes) y ("programme", canal, start, stop, título, bytes, (start, stop) escritos).
+    También retorna el registro de salud de la fuente actualizado, los canales que contiene
+    y las llamadas que el deadline rechazó en el worker; el presupuesto de enriquecimiento
+    se descuenta directo en los contadores compartidos.
+    """
+    path = prefetched_path or f"{TEMP_INPUT}.{idx}"
+    events = []
+    feed_channels = set()
+    error = None
+    enricher = FeedBatchEnricher(url)
+    processed_programmes = 0
+    feed_health[url] = health_record
+    refused_before = run_deadline.refused if run_deadline is not None else 0
+    try:
+        with profile_stage(profile_label(url)):
+            if not prefetched_path:
+                fetch_feed(url, path)
+            try:
+                for elem in iter_feed_elements(path):
+                    if not deadline_allows("feeds"):
+                        # El proceso principal ya no fusiona fuentes: se entrega lo leído y
+                        # el worker queda libre para que el pool cierre sin esperar
+                        error = "interrumpida por deadline"
+                        break
+                    if elem.tag == "channel":
+                        ch_id = elem.get("id")
+                        canonical_ch_id = canonical_channel_id(ch_id)
+                        feed_channels.add(canonical_ch_id)
+                        if canonical_ch_id in allowed_canonical and is_source_allowed_for_channel(ch_id, url):
+                            events.append(("channel", canonical_ch_id, serialize_channel(elem, canonical_ch_id)))
+                    else:
+                        processed_programmes += 1
+                        if processed_programmes % 5000 == 0:
+                            print(f"Procesando... {processed_programmes} programas ({url.split('/')[-1]})", flush=True)
+                        ch_id = elem.get("channel")
+                        canonical_ch_id = canonical_channel_id(ch_id)
+                        feed_channels.add(canonical_ch_id)
+                        if canonical_ch_id in allowed_canonical and is_source_allowed_for_channel(ch_id, url):
+                            for enriched in enricher.add(elem, ch_id, canonical_ch_id):
+                                events.append(("programme",) + enriched)
+            finally:
+                # Una fuente truncada conserva lo ya leído (igual que el modo secuencial)
+                for enriched in enricher.flush():
+                    events.append(("programme",) + enriched)
+    except Exception as e:
+        error = str(e)
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    feed_channels.discard(None)
+    refused = run_deadline.refused - refused_before if run_deadline is not None else 0
+    return events, error, feed_health[url], feed_channels, refused
+
+def merge_feed_events(url, events, state, writer):
+    """Aplica en el proceso principal las reglas de asignación de fuente y deduplicación."""
+    for event in events:
+        if event[0] == "channel":
+            _, canonical_ch_id, data = event
+            if (canonical_ch_id not in state["written_channels"]
+                    and claim_channel_source(state["channel_source_assigned"], canonical_ch_id, url)):
+                writer.channel(canonical_ch_id, data)
+                state["written_channels"].add(canonical_ch_id)
+        else:
+            _, canonical_ch_id, start, stop, title, data, written_span = event
+            if claim_channel_source(state["channel_source_assigned"], canonical_ch_id, url):
+                write_programme_if_new(writer, canonical_ch_id, start, stop, title, data,
+                                       state["written_programmes_by_channel"], written_span)
 
-    CHANNEL_ID_ALIASES = {}
-    print("Analizando fuentes priorizadas...", flush=True)
-    for url in good_sources:
-        if url not in EPG_URLS:
+def process_feed_url(idx, url, allowed_canonical, state, writer, full_scan=False, prefetched_path=None):
+    """
+    Descarga y procesa una fuente en este proceso, salvo que el índice permita omitirla.
+    Si ya fue descargada (prefetched_path) se reutiliza ese archivo. Retorna True si la
+    fuente quedó terminada (u omitida) y False si falló.
+    """
+    path = prefetched_path or TEMP_INPUT
+    try:
+        if not full_scan and can_skip_feed(url, allowed_canonical, state["channel_source_assigned"]):
+            print(f"[{idx}] Fuente omitida (sus canales ya están cubiertos): {url}", flush=True)
+            return True
+        print(f"[{idx}] Fuente: {url}", flush=True)
+        with profile_stage(profile_label(url)):
+            if not prefetched_path:
+                fetch_feed(url, path)
+            feed_channels = process_feed_sequential(url, path, allowed_canonical, state, writer)
+        record_feed_channels(url, feed_channels)
+        print(f"Fuente terminada: {url.split('/')[-1]}", flush=True)
+        return True
+    except Exception as e:
+        print(f"Error en fuente {url}: {e}", flush=True)
+        return False
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+def plan_parallel_skips(epg_urls, allowed_canonical, claimed=()):
+    """
+    Predice con el índice qué fuentes no aportarían nada, suponiendo que las de mayor
+    prioridad vuelven a entregar sus canales. La decisión final se toma al fusionar.
+    Retorna (fuentes omitidas, {url: canales que se prevé tomará una fuente anterior});
+    claimed son los canales ya asignados (p. ej. al reanudar desde un checkpoint).
+    """
+    predicted = set(claimed)
+    skipped = set()
+    claimed_before = {}
+    for url in epg_urls:
+        claimed_before[url] = frozenset(predicted)
+        claimable = feed_claimable_channels(url, allowed_canonical)
+        if claimable is None:
             continue
-        try:
-            download_xml(url, TEMP_INPUT)
-            context = ET.iterparse(TEMP_INPUT, events=("start", "end"))
-            _, root = next(context)
-            for event, elem in context:
-                if event != "end":
+        if claimable <= predicted:
+            skipped.add(url)
+        predicted |= claimable
+    return skipped, claimed_before
+
+def process_feeds_parallel(epg_urls, allowed_canonical, state, writer, workers, full_scan=False,
+                           prefetched=None, on_feed_done=None):
+    create_shared_cache(SHARED_CACHE_FILE)
+    print(f"Modo multi-proceso: {workers} workers", flush=True)
+    skipped, claimed_before = plan_parallel_skips(epg_urls, allowed_canonical, state["channel_source_assigned"])
+    if full_scan:
+        skipped = set()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_feed_worker,
+                                 initargs=(SHARED_CACHE_FILE, cache_path,
+                                           enrichment_scheduler.share(workers)
+                                           if enrichment_scheduler is not None else None,
+                                           profile_dir, run_deadline)) as pool:
+            prefetched = prefetched or {}
+            futures = [
+                None if url in skipped else
+                # El worker no gasta API en canales que se prevé tomará una fuente anterior
+                pool.submit(enrich_feed_task, idx, url, allowed_canonical - claimed_before[url],
+                            feed_health_record(url), prefetched.get(url))
+                for idx, url in enumerate(epg_urls, start=1)
+            ]
+            # Se fusiona en orden de prioridad de las fuentes, no en orden de llegada
+            for idx, (url, future) in enumerate(zip(epg_urls, futures), start=1):
+                if not deadline_allows("feeds"):
+                    # Descarta lo que no empezó; los workers en curso cortan su propio bucle
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    print(f"[{idx}/{len(epg_urls)}] Fuente omitida por deadline: {url}", flush=True)
                     continue
-                if elem.tag == "channel":
+                if future is None:
+                    # Si una fuente prioritaria falló, la omitida se procesa aquí mismo
+                    done = process_feed_url(f"{idx}/{len(epg_urls)}", url, allowed_canonical, state, writer,
+                                            prefetched_path=prefetched.get(url))
+                    if done and on_feed_done is not None:
+                        on_feed_done(url)
+                    continue
+                print(f"[{idx}/{len(epg_urls)}] Fuente: {url}", flush=True)
+                try:
+                    events, error, feed_health[url], feed_channels, refused = future.result()
+                    if run_deadline is not None:
+                        run_deadline.refused += refused
+                except Exception as e:
+                    events, error = [], str(e)
+                with profile_stage(profile_label(url) + ".merge"):
+                    merge_feed_events(url, events, state, writer)
+                done = not error
+                if error:
+                    print(f"Error en fuente {url}: {error}", flush=True)
+                else:
+                    record_feed_channels(url, feed_channels)
+                    print(f"Fuente terminada: {url.split('/')[-1]}", flush=True)
+                    # La predicción falló (una fuente anterior no entregó el canal): lo que el
+                    # worker dejó sin enriquecer se procesa aquí mismo
+                    missing = {ch for ch in claimed_before[url] & feed_channels & allowed_canonical
+                               if ch not in state["channel_source_assigned"]}
+                    if missing:
+                        print(f"  -> Reprocesando {len(missing)} canales no cubiertos: {url}", flush=True)
+                        done = process_feed_url(f"{idx}/{len(epg_urls)}", url, missing, state, writer,
+                                                full_scan=True)
+                # Una fuente fallida no entra al journal: al reanudar se vuelve a procesar
+                if done and on_feed_done is not None:
+                    # El checkpoint incluye lo que los workers ya publicaron en el caché compartido
+                    merge_shared_cache(SHARED_CACHE_FILE)
+                    on_feed_done(url)
+    finally:
+        merged = merge_shared_cache(SHARED_CACHE_FILE)
+        remove_shared_cache(SHARED_CACHE_FILE)
+        print(f"Caché compartido fusionado: {merged} entradas.", flush=True)
+
+class GuideBuilder:
+    """
+    Construcción completa de la guía. Toda la inicialización costosa (caché de API,
+    salud de fuentes, sesión HTTP, lista de fuentes) ocurre aquí y no al importar el
+    módulo, de modo que las funciones de normalización se pueden usar como librería.
+    """
+
+    def __init__(self, channels_file=CHANNELS_FILE, output_file=OUTPUT_FILE, cache_file=CACHE_FILE,
+                 epg_urls=None, workers=None, shard=None, split_dir=None, delta=False, seekable=False,
+                 full_scan=False, api_budget=None, enrich_seconds=None, profile=None, checkpoint=None,
+                 deadline_minutes=None, regional_outputs=None):
+        self.channels_file = channels_file
+        self.output_file = output_file
+        self.cache_file = cache_file
+        self.epg_urls = list(epg_urls) if epg_urls is not None else build_epg_urls()
+        self.workers = FEED_WORKERS if workers is None else workers
+        self.shard = shard
+        self.split_dir = split_dir
+        self.delta = delta
+        self.seekable = seekable
+        self.full_scan = full_scan
+        self.api_budget = ENRICH_MAX_API_CALLS if api_budget is None else api_budget
+        self.enrich_seconds = ENRICH_MAX_SECONDS if enrich_seconds is None else enrich_seconds
+        # Directorio para --profile (None = sin perfilado)
+        self.profile = profile
+        # Archivo de checkpoint por fuente (None = sin checkpoint)
+        self.checkpoint = checkpoint
+        self.deadline_minutes = RUN_DEADLINE_MINUTES if deadline_minutes is None else deadline_minutes
+        # Guías adicionales [(guía, lista de canales)] generadas en la misma pasada
+        self.regional_outputs = list(regional_outputs or [])
+        if self.regional_outputs and shard:
+            print("Aviso: las guías regionales no se generan en builds por shards.", flush=True)
+            self.regional_outputs = []
+        # Fuentes ya descargadas por el escaneo de priorizadas: url -> archivo local
+        self.prefetched = {}
+
+    def read_channel_list(self, channels_file):
+        if not os.path.exists(channels_file):
+            print(f"Error: No existe {channels_file}", flush=True)
+            return None
+        with open(channels_file, "r", encoding="utf-8-sig") as f:
+            # En orden: la posición en channels.txt define la importancia del canal
+            channels = list(dict.fromkeys(line.strip() for line in f if line.strip()))
+        if not channels:
+            print(f"Error: {channels_file} vacío", flush=True)
+            return None
+        return channels
+
+    def read_allowed_channels(self):
+        """Canales de la guía principal y, a continuación, los de las guías regionales."""
+        allowed_channels = self.read_channel_list(self.channels_file)
+        if not allowed_channels:
+            return None
+        for _, channels_file in self.regional_outputs:
+            allowed_channels += self.read_channel_list(channels_file) or []
+        return list(dict.fromkeys(allowed_channels))
+
+    def build_outputs(self, output_file):
+        """
+        Salidas de la construcción: la guía principal (más fragmentos con --split-dir) y
+        cada guía regional. Con guías regionales, cada salida se limita a su lista.
+        Retorna (writer, guía principal, [(ruta, guía regional)]).
+        """
+        guide_output = XmltvGuideOutput(output_file, seekable=self.seekable)
+        outputs = [guide_output]
+        if self.split_dir:
+            outputs.append(SplitGuideOutput(self.split_dir))
+        regional = []
+        if self.regional_outputs:
+            main_channels = {canonical_channel_id(ch) for ch in self.read_channel_list(self.channels_file)}
+            outputs = [ChannelSubsetOutput(output, main_channels) for output in outputs]
+            for path, channels_file in self.regional_outputs:
+                channels = self.read_channel_list(channels_file)
+                if not channels:
+                    continue
+                regional_output = XmltvGuideOutput(path, seekable=self.seekable)
+                outputs.append(ChannelSubsetOutput(regional_output, {canonical_channel_id(ch) for ch in channels}))
+                regional.append((path, regional_output))
+        return GuideWriter(outputs), guide_output, regional
+
+    def scan_prioritized_sources(self, allowed_channels):
+        good_sources = set()
+        for sources in CHANNEL_SOURCE_RULES.values():
+            for s in sources:
+                good_sources.add(s)
+
+        CHANNEL_ID_ALIASES = {}
+        print("Analizando fuentes priorizadas...", flush=True)
+        for url in good_sources:
+            if url not in self.epg_urls:
+                continue
+            # El archivo se conserva para la pasada principal: no se descarga dos veces
+            path = f"{TEMP_INPUT}.prio{self.epg_urls.index(url) + 1}"
+            try:
+                fetch_feed(url, path)
+                self.prefetched[url] = path
+                for elem in iter_feed_channels(path):
                     real_id = elem.get("id")
                     if real_id:
                         canonical_real = canonical_channel_id(real_id)
@@ -1471,115 +3853,247 @@ def main():
                             if canonical_real == canonical_channel_id(user_id):
                                 CHANNEL_ID_ALIASES.setdefault(real_id, []).append(user_id)
                                 print(f"  -> Match validado: '{real_id}' == '{user_id}'", flush=True)
-                    root.remove(elem)
-                elif elem.tag == "programme":
-                    root.remove(elem)
-            del context
-            if os.path.exists(TEMP_INPUT):
-                os.remove(TEMP_INPUT)
-        except Exception as e:
-            print(f"Error escaneando fuente {url}: {e}", flush=True)
-
-    # NUEVO: estructura por canal para deduplicación
-    written_programmes_by_channel = defaultdict(list)  # canal -> lista de tuplas (start_dt, stop_dt, raw_title, norm_title, start_str, stop_str)
-    written_channels = set()
-
-    try:
-        with open(TEMP_OUTPUT, "wb") as out_f:
-            out_f.write(b'<?xml version="1.0" encoding="UTF-8"?>\n<tv>\n')
-            for idx, url in enumerate(EPG_URLS, start=1):
-                processed_programmes = 0
-                prefer_latam = is_latam_feed(url)
-                spanish_se_format = use_spanish_season_episode_format(url)
-                try:
-                    print(f"[{idx}/{len(EPG_URLS)}] Fuente: {url}", flush=True)
-                    download_xml(url, TEMP_INPUT)
-                    context = ET.iterparse(TEMP_INPUT, events=("start", "end"))
-                    _, root = next(context)
-                    for event, elem in context:
-                        if event != "end":
+            except Exception as e:
+                print(f"Error escaneando fuente {url}: {e}", flush=True)
+                if url not in self.prefetched and os.path.exists(path):
+                    os.remove(path)
+        return CHANNEL_ID_ALIASES
+
+    def iter_stored_programmes(self, allowed_canonical):
+        """(url, <programme>, canal, inicio, fin) de las copias guardadas de cada fuente."""
+        for url in self.epg_urls:
+            store_path = feed_store_path(url)
+            if not os.path.exists(store_path):
+                continue
+            try:
+                with gzip.open(store_path, "rb") as f:
+                    for elem in iter_feed_elements(f):
+                        if elem.tag != "programme":
                             continue
-                        if elem.tag == "channel":
-                            ch_id = elem.get("id")
-                            canonical_ch_id = canonical_channel_id(ch_id)
-                            if (canonical_ch_id in allowed_canonical
-                                    and is_source_allowed_for_channel(ch_id, url)
-                                    and canonical_ch_id not in written_channels):
-                                if canonical_ch_id not in channel_source_assigned:
-                                    channel_source_assigned[canonical_ch_id] = url
-                                if channel_source_assigned[canonical_ch_id] != url:
-                                    root.remove(elem)
-                                    continue
-                                channel_elem = clone_element(elem)
-                                channel_elem.set("id", canonical_ch_id)
-                                out_f.write(ET.tostring(channel_elem, encoding="utf-8"))
-                                out_f.write(b"\n")
-                                written_channels.add(canonical_ch_id)
-                            root.remove(elem)
-                        elif elem.tag == "programme":
-                            processed_programmes += 1
-                            if processed_programmes % 5000 == 0:
-                                print(f"Procesando... {processed_programmes} programas", flush=True)
-                            ch_id = elem.get("channel")
-                            canonical_ch_id = canonical_channel_id(ch_id)
-                            if canonical_ch_id in allowed_canonical and is_source_allowed_for_channel(ch_id, url):
-                                if canonical_ch_id not in channel_source_assigned:
-                                    channel_source_assigned[canonical_ch_id] = url
-                                if channel_source_assigned[canonical_ch_id] != url:
-                                    root.remove(elem)
-                                    continue
-                                start = elem.get("start", "")
-                                stop = elem.get("stop", "")
-                                tvmaze_auth = should_use_tvmaze_authoritative(url, ch_id)
-                                new_title, is_series, pref_sub, pref_desc = process_programme(
-                                    elem, start,
-                                    prefer_latam=prefer_latam,
-                                    spanish_season_episode_format=spanish_se_format,
-                                    tvmaze_authoritative=tvmaze_auth,
-                                )
-                                replace_all_title_elements(elem, new_title, prefer_latam)
-                                normalize_subtitle_and_desc(elem, prefer_latam, is_series, pref_sub, pref_desc)
-                                normalize_episode_num_elements(elem)
-                                apply_channel_offset(elem)
-                                cloned = clone_element(elem)
-                                cloned.set("channel", canonical_ch_id)
-
-                                # --- NUEVA LÓGICA DE DEDUPLICACIÓN ---
-                                # Parsear fechas y almacenar en la estructura
-                                start_dt, _ = parse_datetime_from_xmltv(start)
-                                stop_dt, _ = parse_datetime_from_xmltv(stop)
-
-                                # Verificar duplicado
-                                if not is_duplicate_programme(canonical_ch_id, start, stop, new_title, written_programmes_by_channel):
-                                    # No duplicado: almacenar y escribir
-                                    new_norm = normalize_text(new_title)
-                                    written_programmes_by_channel[canonical_ch_id].append(
-                                        (start_dt, stop_dt, new_title, new_norm, start, stop)
-                                    )
-                                    out_f.write(ET.tostring(cloned, encoding="utf-8"))
-                                    out_f.write(b"\n")
-                                # else: duplicado, se omite
-                            root.remove(elem)
-                    del context
-                    print(f"Fuente terminada: {url.split('/')[-1]}", flush=True)
-                except Exception as e:
-                    print(f"Error en fuente {url}: {e}", flush=True)
-                finally:
-                    if os.path.exists(TEMP_INPUT):
-                        os.remove(TEMP_INPUT)
-            out_f.write(b"</tv>\n")
-    finally:
-        save_cache()
-
-    print("Comprimiendo...", flush=True)
-    with open(TEMP_OUTPUT, "rb") as f_in:
-        with gzip.open(OUTPUT_FILE, "wb") as f_out:
-            f_out.writelines(f_in)
-    if os.path.exists(TEMP_OUTPUT):
-        os.remove(TEMP_OUTPUT)
-    # Contar programas escritos (para estadística)
-    total_written = sum(len(lst) for lst in written_programmes_by_channel.values())
-    print(f"Proceso completado: {OUTPUT_FILE} | canales: {len(written_channels)} | programas: {total_written}", flush=True)
+                        ch_id = elem.get("channel")
+                        canonical_ch_id = canonical_channel_id(ch_id)
+                        if canonical_ch_id not in allowed_canonical or not is_source_allowed_for_channel(ch_id, url):
+                            continue
+                        start_ts = xmltv_to_epoch(elem.get("start", ""))
+                        stop_ts = xmltv_to_epoch(elem.get("stop", ""))
+                        if start_ts is None or stop_ts is None:
+                            continue
+                        yield url, elem, canonical_ch_id, start_ts, stop_ts
+            except Exception as e:
+                print(f"Error leyendo copia de {url}: {e}", flush=True)
+
+    def iter_lookup_candidates(self, allowed_canonical, channel_rank):
+        """
+        Lookups de la ejecución anterior (copias guardadas de cada fuente): el de TMDB y,
+        en canales autoritativos, el de TVMaze por fecha de emisión.
+        """
+        for url, elem, canonical_ch_id, start_ts, stop_ts in self.iter_stored_programmes(allowed_canonical):
+            key = programme_lookup_key(elem, is_latam_feed(url))
+            rank = channel_rank.get(canonical_ch_id, len(channel_rank))
+            yield key, start_ts, stop_ts, rank
+            air_date = programme_air_date(elem.get("start", ""))
+            if air_date is not None and should_use_tvmaze_authoritative(url, elem.get("channel")):
+                yield tvmaze_plan_key(key, air_date), start_ts, stop_ts, rank
+
+    def prewarm(self, calls_per_second=PREWARM_CALLS_PER_SECOND, max_calls=0, horizon_hours=PREWARM_HORIZON_HOURS):
+        """
+        Resuelve por adelantado, a ritmo bajo, los lookups de TMDB/TVMaze que el próximo
+        build pediría para la programación cercana de las copias guardadas. Recorre los
+        programas por prioridad (emisión más próxima, canal más importante) pasándolos por
+        process_programme, de modo que se consultan exactamente las mismas claves de caché.
+        """
+        global enrichment_scheduler
+        allowed_channels = self.read_allowed_channels()
+        if not allowed_channels:
+            return
+        allowed_canonical = {canonical_channel_id(ch) for ch in allowed_channels}
+        channel_rank = {}
+        for ch in allowed_channels:
+            channel_rank.setdefault(canonical_channel_id(ch), len(channel_rank))
+        load_cache(self.cache_file)
+
+        now = now_ts()
+        horizon = now + horizon_hours * 3600
+        pending = {}
+        for url, elem, canonical_ch_id, start_ts, stop_ts in self.iter_stored_programmes(allowed_canonical):
+            if stop_ts < now or start_ts > horizon:
+                continue
+            prefer_latam = is_latam_feed(url)
+            tvmaze_auth = should_use_tvmaze_authoritative(url, elem.get("channel"))
+            start = elem.get("start", "")
+            episode_marker = (extract_xmltv_episode_num(elem) or extract_se_regex(elem.findtext("title") or "")
+                              or extract_se_regex(elem.findtext("desc") or ""))
+            key = (programme_lookup_key(elem, prefer_latam), episode_marker, start[:8] if tvmaze_auth else "")
+            priority = (max(start_ts - now, 0) // (ENRICH_PRIORITY_WINDOW_HOURS * 3600),
+                        channel_rank.get(canonical_ch_id, len(channel_rank)), start_ts)
+            if key not in pending or priority < pending[key][0]:
+                # Copia: el backend libera el elemento original al avanzar el parseo
+                pending[key] = (priority, url, clone_element(elem), start, tvmaze_auth)
+        print(f"Prewarm: {len(pending)} lookups distintos en las próximas {horizon_hours} h", flush=True)
+
+        # Un ritmo no positivo significa sin pausa entre llamadas (la CLI exige > 0)
+        min_interval = 1.0 / calls_per_second if calls_per_second > 0 else 0.0
+        enrichment_scheduler = EnrichmentScheduler(max_calls, 0, min_interval=min_interval)
+        saved_at = 0
+        try:
+            for _, url, elem, start, tvmaze_auth in sorted(pending.values(), key=lambda p: p[0]):
+                if enrichment_scheduler.exhausted():
+                    break
+                process_programme(elem, start,
+                                  prefer_latam=is_latam_feed(url),
+                                  spanish_season_episode_format=use_spanish_season_episode_format(url),
+                                  tvmaze_authoritative=tvmaze_auth)
+                if enrichment_scheduler.calls - saved_at >= PREWARM_SAVE_EVERY:
+                    save_cache()
+                    saved_at = enrichment_scheduler.calls
+                    print(f"Prewarm: {enrichment_scheduler.calls} llamadas, caché guardado", flush=True)
+        finally:
+            print(enrichment_scheduler.summary(), flush=True)
+            enrichment_scheduler = None
+            save_cache()
+
+    def plan_enrichment(self, allowed_canonical, channel_rank):
+        scheduler = EnrichmentScheduler(self.api_budget, self.enrich_seconds)
+        scheduler.plan(self.iter_lookup_candidates(allowed_canonical, channel_rank))
+        print(f"Plan de enriquecimiento: {len(scheduler.ranks)} lookups sin caché priorizados "
+              f"(presupuesto: {self.api_budget or '-'} llamadas, {self.enrich_seconds or '-'} s)", flush=True)
+        return scheduler
+
+    def save_checkpoint(self, checkpoint, completed, state, writer):
+        """
+        Agrega al journal el fragmento de la última fuente terminada. El caché de API
+        (que puede ser grande) se guarda cada CHECKPOINT_CACHE_EVERY fuentes: lo que se
+        pierda en un corte solo se vuelve a consultar.
+        """
+        checkpoint.append(completed[-1], state, writer)
+        if len(completed) % CHECKPOINT_CACHE_EVERY == 0:
+            save_cache()
+            save_feed_health()
+            save_feed_channel_index()
+        print(f"Checkpoint: {len(completed)}/{len(self.epg_urls)} fuentes", flush=True)
+
+    def discard_prefetched(self):
+        for path in self.prefetched.values():
+            if os.path.exists(path):
+                os.remove(path)
+        self.prefetched = {}
+
+    def build(self):
+        global enrichment_scheduler, profile_dir, run_deadline
+        if self.deadline_minutes:
+            # El reloj corre desde el inicio: descargas y escaneo también consumen el deadline
+            run_deadline = RunDeadline(self.deadline_minutes * 60)
+        output_file = self.output_file
+        shard = self.shard
+        print(f"Iniciando script enriquecido v3.1... (XML: {XML.name})", flush=True)
+        allowed_channels = self.read_allowed_channels()
+        if not allowed_channels:
+            return
+        allowed_canonical = {canonical_channel_id(ch) for ch in allowed_channels}
+        channel_rank = {}
+        for ch in allowed_channels:
+            channel_rank.setdefault(canonical_channel_id(ch), len(channel_rank))
+        if shard:
+            shard_index, shard_count = shard
+            allowed_canonical = {ch for ch in allowed_canonical if channel_shard(ch, shard_count) == shard_index}
+            output_file, cache_delta_file = shard_output_paths(shard, self.output_file, self.cache_file)
+            print(f"Shard {shard_index}/{shard_count}: {len(allowed_canonical)} canales", flush=True)
+
+        load_cache(self.cache_file)
+        load_feed_health()
+        load_feed_channel_index()
+        full_scan = self.full_scan or feed_index_full_scan_due()
+        if full_scan:
+            print("Recorrido completo de fuentes (se actualiza el índice de canales).", flush=True)
+
+        if self.profile:
+            start_profiling(self.profile)
+        with profile_stage("escaneo_priorizadas"):
+            self.scan_prioritized_sources(allowed_channels)
+        if self.api_budget or self.enrich_seconds:
+            enrichment_scheduler = self.plan_enrichment(allowed_canonical, channel_rank)
+
+        state = {
+            "channel_source_assigned": {},
+            "written_channels": set(),
+            "written_programmes_by_channel": ProgrammeHistory(),
+        }
+
+        previous_guide = index_guide_entries(output_file, f"{output_file}.delta.sqlite") if self.delta else None
+        writer, guide_output, regional = self.build_outputs(output_file)
+
+        epg_urls = self.epg_urls
+        checkpoint = None
+        completed = []
+        if self.checkpoint:
+            checkpoint = BuildCheckpoint(self.checkpoint, BuildCheckpoint.build_signature(
+                epg_urls, allowed_canonical, output_file, self.split_dir, self.regional_outputs))
+            fragments = checkpoint.load()
+            if fragments is None:
+                checkpoint.start(full_scan)
+            else:
+                full_scan = checkpoint.full_scan
+                for fragment in fragments:
+                    BuildCheckpoint.apply(fragment, state, writer)
+                    completed.append(fragment["url"])
+                print(f"Reanudando desde checkpoint: {len(completed)}/{len(epg_urls)} fuentes ya procesadas", flush=True)
+            checkpoint.mark(state)
+            writer.recorded = []
+
+        def feed_done(url):
+            completed.append(url)
+            if checkpoint is not None:
+                self.save_checkpoint(checkpoint, completed, state, writer)
+
+        try:
+            if self.workers > 1:
+                pending_urls = [url for url in epg_urls if url not in completed]
+                process_feeds_parallel(pending_urls, allowed_canonical, state, writer, self.workers, full_scan,
+                                       self.prefetched, on_feed_done=feed_done)
+            else:
+                for idx, url in enumerate(epg_urls, start=1):
+                    if url in completed:
+                        continue
+                    if not deadline_allows("feeds"):
+                        print(f"[{idx}/{len(epg_urls)}] Fuente omitida por deadline: {url}", flush=True)
+                        continue
+                    if process_feed_url(f"{idx}/{len(epg_urls)}", url, allowed_canonical, state, writer,
+                                        full_scan, self.prefetched.get(url)):
+                        feed_done(url)
+            if full_scan:
+                feed_channel_index["last_full_scan"] = now_ts()
+            with profile_stage("escritura"):
+                writer.close()
+            if checkpoint is not None:
+                checkpoint.remove()
+        finally:
+            self.discard_prefetched()
+            if enrichment_scheduler is not None:
+                print(enrichment_scheduler.summary(), flush=True)
+                enrichment_scheduler = None
+            if run_deadline is not None:
+                print(run_deadline.summary(), flush=True)
+                run_deadline = None
+            save_cache()
+            save_feed_health()
+            save_feed_channel_index()
+            if shard:
+                save_cache_delta(cache_delta_file)
+            if profile_dir is not None:
+                print_profile_summary(profile_dir)
+                profile_dir = None
+
+        if self.delta:
+            write_guide_delta(previous_guide, output_file, guide_delta_path(output_file))
+        # Contar programas escritos (para estadística)
+        total_written = guide_output.programme_count
+        print(f"Proceso completado: {output_file} | canales: {guide_output.channel_count} | programas: {total_written}", flush=True)
+        for path, regional_output in regional:
+            print(f"Guía regional: {path} | canales: {regional_output.channel_count} | "
+                  f"programas: {regional_output.programme_count}", flush=True)
+
+def main(**options):
+    GuideBuilder(**options).build()
 
 def apply_channel_offset(elem):
     ch_id = canonical_channel_id(elem.get("channel"))
@@ -1589,11 +4103,8 @@ def apply_channel_offset(elem):
     for attr in ("start", "stop"):
         val = elem.get(attr)
         if val:
-            m = re.match(r"^(\d{14})(?:\s*([+-]\d{4}))?$", val)
-            if m:
-                dt = datetime.strptime(m.group(1), "%Y%m%d%H%M%S") + timedelta(minutes=offset)
-                tz = m.group(2)
-                new_val = f"{dt.strftime('%Y%m%d%H%M%S')} {tz}" if tz else dt.strftime("%Y%m%d%H%M%S")
+            new_val = shift_xmltv_time(val, offset)
+            if new_val:
                 elem.set(attr, new_val)
 
 def is_source_allowed_for_channel(channel_id, source_url):
@@ -1602,5 +4113,500 @@ def is_source_allowed_for_channel(channel_id, source_url):
         return True
     return source_url in allowed
 
+# =========================
+# BUILDS POR SHARDS Y FUSIÓN
+# =========================
+
+# Cada shard procesa los canales cuyo id canónico cae en su partición (crc32 % N),
+# genera una guía parcial y el delta de caché de su ejecución; "merge" los combina.
+
+def parse_shard_spec(spec):
+    """'i/N' -> (i, N), con 0 <= i < N."""
+    m = re.fullmatch(r"\s*(\d+)\s*/\s*(\d+)\s*", spec or "")
+    if not m or int(m.group(2)) < 1 or int(m.group(1)) >= int(m.group(2)):
+        raise argparse.ArgumentTypeError(f"shard inválido: {spec!r} (formato i/N, 0 <= i < N)")
+    return int(m.group(1)), int(m.group(2))
+
+def channel_shard(canonical_ch_id, shard_count):
+    return zlib.crc32(canonical_ch_id.encode("utf-8")) % shard_count
+
+def shard_output_paths(shard, output_file=OUTPUT_FILE, cache_file=CACHE_FILE):
+    """Guía parcial y delta de caché del shard, junto a la guía y el caché de la ejecución."""
+    shard_index, shard_count = shard
+    base = output_file[:-len(".xml.gz")] if output_file.endswith(".xml.gz") else output_file
+    cache_base = os.path.splitext(cache_file)[0]
+    return (f"{base}.part-{shard_index}-of-{shard_count}.xml.gz",
+            f"{cache_base}.part-{shard_index}-of-{shard_count}.json")
+
+def save_cache_delta(path):
+    delta = {key: api_cache[key] for key in sorted(cache_dirty_keys) if key in api_cache}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(delta, f, ensure_ascii=False, indent=2)
+    print(f"Delta de caché: {path} ({len(delta)} entradas)", flush=True)
+
+def merge_partial_guides(part_paths, output_path):
+    """
+    Combina guías parciales en una sola con el mismo orden determinista que un
+    build completo (XmltvGuideOutput). Las partes se recorren en orden de nombre y
+    ante un canal repetido gana la primera.
+    """
+    output = XmltvGuideOutput(output_path)
+    for path in sorted(part_paths):
+        with gzip.open(path, "rb") as f:
+            for elem in iter_feed_elements(f):
+                data = XML.tostring(elem)
+                if elem.tag == "channel":
+                    output.channel(elem.get("id"), data)
+                else:
+                    output.programme(elem.get("channel"), elem.get("start", ""), elem.get("stop", ""), data)
+    output.close()
+    print(f"Guía fusionada: {output_path} | partes: {len(part_paths)} | canales: {output.channel_count} | programas: {output.programme_count}", flush=True)
+
+def merge_cache_deltas(delta_paths, cache_path):
+    """Aplica los deltas sobre el caché base; ante la misma clave gana la entrada más reciente."""
+    merged = {}
+    if os.path.exists(cache_path):
+        with open(cache_path, "r", encoding="utf-8") as f:
+            merged = json.load(f)
+    for path in sorted(delta_paths):
+        with open(path, "r", encoding="utf-8") as f:
+            delta = json.load(f)
+        for key, entry in delta.items():
+            current = merged.get(key)
+            if isinstance(current, dict) and int(current.get("ts", 0)) > int(entry.get("ts", 0)):
+                continue
+            merged[key] = entry
+    merged = {key: merged[key] for key in sorted(merged)}
+    with open(cache_path, "w", encoding="utf-8") as f:
+        json.dump(merged, f, ensure_ascii=False, indent=2)
+    print(f"Caché fusionado: {cache_path} ({len(merged)} entradas)", flush=True)
+
+# =========================
+# LECTOR DE GUÍA POR BLOQUES
+# =========================
+
+class SeekableGuide:
+    """
+    Lector de guías escritas con --seekable: mapea el archivo en memoria y, con el
+    índice <guía>.idx.json, descomprime únicamente el miembro gzip del canal pedido.
+
+        with SeekableGuide("guia.xml.gz") as guide:
+            guide.now_next("tnt.ar")
+    """
+
+    def __init__(self, path, index_path=None):
+        with open(index_path or path + SEEKABLE_INDEX_SUFFIX, "r", encoding="utf-8") as f:
+            index = json.load(f)
+        if index.get("format") != SEEKABLE_INDEX_FORMAT:
+            raise ValueError(f"el índice de {path} tiene un formato anterior; regenerar con --seekable")
+        self.path = path
+        self.blocks = {entry["id"]: entry for entry in index["channels"]}
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        # El índice debe describir este archivo (no uno anterior o posterior). Abrir no
+        # recorre la guía: el tamaño se compara aquí y cada miembro al leerlo.
+        if len(self._map) != index.get("guide_size"):
+            self.close()
+            raise self._mismatch()
+
+    def _mismatch(self):
+        return ValueError(f"el índice de {self.path} no corresponde a la guía (¿se está reescribiendo?)")
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def channel_ids(self):
+        return sorted(self.blocks)
+
+    def programmes(self, ch_id):
+        """Lista [(inicio epoch, fin epoch, Element)] del canal, ordenada por inicio."""
+        entry = self.blocks.get(canonical_channel_id(ch_id))
+        if entry is None:
+            return []
+        block = self._map[entry["offset"]:entry["offset"] + entry["length"]]
+        if hashlib.sha256(block).hexdigest() != entry["sha256"]:
+            raise self._mismatch()
+        xml = zlib.decompressobj(wbits=31).decompress(block)
+        result = []
+        for elem in XML.fromstring(b"<tv>" + xml + b"</tv>"):
+            start = xmltv_to_epoch(elem.get("start", ""))
+            if start is None:
+                continue
+            stop = xmltv_to_epoch(elem.get("stop", ""))
+            result.append((start, stop if stop is not None else start, elem))
+        return result
+
+    def now_next(self, ch_id, ts=None):
+        """Programa en emisión y el siguiente (si existen) para el canal."""
+        ts = now_ts() if ts is None else ts
+        entry = self.blocks.get(canonical_channel_id(ch_id))
+        if entry is None or (entry["last_stop"] is not None and entry["last_stop"] <= ts):
+            return []
+        items = self.programmes(ch_id)
+        i = bisect.bisect_right([p[0] for p in items], ts) - 1
+        current = items[i] if i >= 0 and items[i][1] > ts else None
+        following = items[i + 1] if i + 1 < len(items) else None
+        return [p[2] for p in (current, following) if p is not None]
+
+# =========================
+# MODO SERVIDOR
+# =========================
+
+SERVE_RELOAD_INTERVAL = 30
+
+class GuideIndex:
+    """Índice en memoria de una guía generada: canal -> programas ordenados por inicio."""
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        self.channels = {}     # canal -> bytes de <channel>
+        self.starts = {}       # canal -> [inicio epoch]
+        self.max_stops = {}    # canal -> [mayor fin entre los programas hasta ese índice]
+        self.entries = {}      # canal -> [(inicio, fin, bytes)]
+        with open(path, "rb") as f:
+            self.sha256 = hashlib.sha256(f.read()).hexdigest()
+        programmes = defaultdict(list)
+        with gzip.open(path, "rb") as f:
+            for elem in iter_feed_elements(f):
+                data = XML.tostring(elem)
+                if elem.tag == "channel":
+                    self.channels[elem.get("id")] = data
+                    continue
+                start = xmltv_to_epoch(elem.get("start", ""))
+                stop = xmltv_to_epoch(elem.get("stop", ""))
+                if start is None:
+                    continue
+                programmes[elem.get("channel")].append((start, stop if stop is not None else start, data))
+        for ch_id, items in programmes.items():
+            items.sort(key=lambda p: (p[0], p[1]))
+            self.entries[ch_id] = items
+            self.starts[ch_id] = [p[0] for p in items]
+            self.max_stops[ch_id] = list(accumulate((p[1] for p in items), max))
+
+    def range(self, ch_id, start_ts, end_ts):
+        """Programas del canal que se emiten (total o parcialmente) en [start_ts, end_ts)."""
+        items = self.entries.get(ch_id, [])
+        # Antes del primer índice cuyo fin acumulado supera start_ts nada puede solaparse;
+        # un programa largo que empezó mucho antes sigue apareciendo
+        i = bisect.bisect_right(self.max_stops.get(ch_id, []), start_ts)
+        result = []
+        while i < len(items) and items[i][0] < end_ts:
+            if items[i][1] > start_ts or items[i][0] >= start_ts:
+                result.append(items[i])
+            i += 1
+        return result
+
+    def now_next(self, ch_id, ts):
+        items = self.entries.get(ch_id, [])
+        i = bisect.bisect_right(self.starts.get(ch_id, []), ts) - 1
+        current = items[i] if i >= 0 and items[i][1] > ts else None
+        following = items[i + 1] if i + 1 < len(items) else None
+        return [p for p in (current, following) if p is not None]
+
+def _parse_query_time(value, default):
+    if not value:
+        return default
+    value = value.strip()
+    if value.isdigit() and len(value) <= 11:
+        return int(value)
+    ts = xmltv_to_epoch(value)
+    if ts is None:
+        raise ValueError(f"fecha inválida: {value}")
+    return ts
+
+def programme_to_json(ch_id, data):
+    elem = XML.fromstring(data)
+    return {
+        "channel": ch_id,
+        "start": elem.get("start"),
+        "stop": elem.get("stop"),
+        "title": (elem.findtext("title") or "").strip(),
+        "sub_title": (elem.findtext("sub-title") or "").strip() or None,
+        "desc": (elem.findtext("desc") or "").strip() or None,
+    }
+
+class GuideRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET /guide.xml | /guide.json ?channels=a,b&from=...&to=...  (epoch o XMLTV)
+    GET /now.xml   | /now.json   ?channels=a,b                    (programa actual y siguiente)
+    GET /channels.json
+    """
+    server_version = "xmltv-guide-server/1.0"
+
+    def log_message(self, fmt, *args):
+        print(f"[serve] {self.address_string()} {fmt % args}", flush=True)
+
+    def _send(self, status, body, content_type, etag=None):
+        headers = {"Content-Type": content_type, "Cache-Control": "no-cache"}
+        if etag:
+            headers["ETag"] = etag
+        if "gzip" in (self.headers.get("Accept-Encoding") or "") and len(body) > 512:
+            body = gzip.compress(body, mtime=0)
+            headers["Content-Encoding"] = "gzip"
+        headers["Vary"] = "Accept-Encoding"
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        index = self.server.guide_index
+        parsed = urlparse(self.path)
+        params = parse_qs(parsed.query)
+        route, _, fmt = parsed.path.strip("/").partition(".")
+        if index is None:
+            return self._send(503, b"guia no disponible\n", "text/plain; charset=utf-8")
+        if route not in ("guide", "now", "channels") or fmt not in ("xml", "json"):
+            return self._send(404, b"no encontrado\n", "text/plain; charset=utf-8")
+
+        now = now_ts()
+        requested = [c for v in params.get("channels", []) for c in v.split(",") if c.strip()]
+        ch_ids = [canonical_channel_id(c.strip()) for c in requested] or sorted(index.channels)
+        try:
+            if route == "guide":
+                start_ts = _parse_query_time((params.get("from") or [""])[0], now)
+                end_ts = _parse_query_time((params.get("to") or [""])[0], start_ts + 24 * 3600)
+        except ValueError as e:
+            return self._send(400, f"{e}\n".encode("utf-8"), "text/plain; charset=utf-8")
+
+        # El ETag depende del contenido de la guía, de la consulta y de la ventana resuelta
+        # (sin from/to la ventana se mueve con el reloj)
+        etag_source = f"{index.sha256}|{parsed.path}|{parsed.query}"
+        if route == "now":
+            etag_source += f"|{now // 60}"
+        elif route == "guide":
+            etag_source += f"|{start_ts}|{end_ts}"
+        etag = '"' + hashlib.sha256(etag_source.encode("utf-8")).hexdigest()[:32] + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        if route == "channels":
+            body = json.dumps(sorted(index.channels), ensure_ascii=False).encode("utf-8")
+            return self._send(200, body, "application/json; charset=utf-8", etag)
+
+        if route == "now":
+            selected = {ch: index.now_next(ch, now) for ch in ch_ids}
+        else:
+            selected = {ch: index.range(ch, start_ts, end_ts) for ch in ch_ids}
+
+        if fmt == "json":
+            payload = [programme_to_json(ch, p[2]) for ch in ch_ids for p in selected[ch]]
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            return self._send(200, body, "application/json; charset=utf-8", etag)
+        chunks = [XMLTV_HEADER]
+        for ch in ch_ids:
+            if ch in index.channels:
+                chunks += [index.channels[ch], b"\n"]
+        for ch in ch_ids:
+            for p in selected[ch]:
+                chunks += [p[2], b"\n"]
+        chunks.append(XMLTV_FOOTER)
+        return self._send(200, b"".join(chunks), "application/xml; charset=utf-8", etag)
+
+def _watch_guide(server, path, interval):
+    """Reconstruye el índice cuando aparece una guía nueva y lo reemplaza de una vez."""
+    while True:
+        time.sleep(interval)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            continue
+        current = server.guide_index
+        if current is not None and current.mtime == mtime:
+            continue
+        try:
+            server.guide_index = GuideIndex(path)
+            print(f"[serve] Índice recargado: {len(server.guide_index.entries)} canales", flush=True)
+        except Exception as e:
+            print(f"[serve] Error recargando {path}: {e}", flush=True)
+
+def serve_guide(path=OUTPUT_FILE, host="0.0.0.0", port=8080, reload_interval=SERVE_RELOAD_INTERVAL):
+    server = ThreadingHTTPServer((host, port), GuideRequestHandler)
+    server.guide_index = GuideIndex(path) if os.path.exists(path) else None
+    if server.guide_index is not None:
+        print(f"[serve] Índice cargado: {len(server.guide_index.entries)} canales", flush=True)
+    watcher = threading.Thread(target=_watch_guide, args=(server, path, reload_interval), daemon=True)
+    watcher.start()
+    print(f"[serve] Sirviendo {path} en http://{host}:{port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+# =========================
+# BENCHMARK DE SIMILITUD
+# =========================
+
+BENCHMARK_SAMPLE_TITLES = [
+    "Breaking Bad", "Better Call Saul", "La Casa de Papel", "Money Heist",
+    "The Office", "The Office (US)", "Grey's Anatomy", "Anatomía de Grey",
+    "Law & Order: Special Victims Unit", "La ley y el orden: Unidad de víctimas especiales",
+    "CSI: Miami", "CSI: Vegas", "NCIS: Los Angeles", "NCIS", "Friends", "Fringe",
+    "Los Simpson", "The Simpsons", "Bob Esponja", "SpongeBob SquarePants",
+    "El Señor de los Anillos: La Comunidad del Anillo", "The Lord of the Rings",
+    "Rápidos y Furiosos 7", "Furious 7", "M3GAN 2.0", "DTF St. Louis",
+]
+
+def _benchmark_similarity_titles(limit):
+    ensure_cache_loaded()
+    titles = []
+    for key, entry in api_cache.items():
+        if not key.startswith("tmdb_search:") or not isinstance(entry, dict):
+            continue
+        data = entry.get("data")
+        if not isinstance(data, dict):
+            continue
+        for item in data.get("results") or []:
+            name = (item.get("title") or item.get("name") or "").strip()
+            if name:
+                titles.append(name)
+        if len(titles) >= limit:
+            break
+    titles.extend(BENCHMARK_SAMPLE_TITLES)
+    return list(dict.fromkeys(titles))[:limit]
+
+def benchmark_text_similarity(max_pairs=20000, threshold=0.58):
+    """Compara paridad y velocidad de text_similarity frente a la implementación original."""
+    titles = _benchmark_similarity_titles(int(max_pairs ** 0.5) + 1)
+    pairs = [(a, b) for a in titles for b in titles][:max_pairs]
+    print(f"Benchmark similitud: {len(titles)} títulos, {len(pairs)} pares", flush=True)
+
+    t0 = time.perf_counter()
+    reference = [_text_similarity_reference(a, b) for a, b in pairs]
+    t_ref = time.perf_counter() - t0
+
+    text_signature.cache_clear()
+    sequence_ratio.cache_clear()
+    t0 = time.perf_counter()
+    exact = [text_similarity(a, b) for a, b in pairs]
+    t_exact = time.perf_counter() - t0
+
+    text_signature.cache_clear()
+    sequence_ratio.cache_clear()
+    t0 = time.perf_counter()
+    pruned = [text_similarity(a, b, min_ratio=threshold) for a, b in pairs]
+    t_pruned = time.perf_counter() - t0
+
+    exact_mismatch = sum(1 for r, e in zip(reference, exact) if r != e)
+    threshold_mismatch = sum(
+        1 for r, p in zip(reference, pruned)
+        if (r >= threshold) != (p >= threshold) or (p >= threshold and p != r)
+    )
+    print(f"  original:             {t_ref:.3f}s", flush=True)
+    print(f"  nuevo (exacto):       {t_exact:.3f}s | diferencias: {exact_mismatch}", flush=True)
+    print(f"  nuevo (umbral {threshold}): {t_pruned:.3f}s | diferencias: {threshold_mismatch}", flush=True)
+    return exact_mismatch == 0 and threshold_mismatch == 0
+
+def parse_rate(value):
+    """Llamadas por segundo de prewarm: debe ser positiva."""
+    try:
+        rate = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"ritmo inválido: {value!r}")
+    if not rate > 0:
+        raise argparse.ArgumentTypeError(f"el ritmo debe ser mayor que 0: {value!r}")
+    return rate
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description="Genera la guía EPG enriquecida.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Procesos para parsear/enriquecer fuentes en paralelo (por defecto EPG_WORKERS o 1).")
+    parser.add_argument("--shard", type=parse_shard_spec, default=None,
+                        help="Procesa solo la partición i/N de canales y genera guía parcial + delta de caché.")
+    parser.add_argument("--delta", action="store_true",
+                        help="Genera <guía>.delta.json.gz con los cambios respecto de la guía anterior.")
+    parser.add_argument("--seekable", action="store_true",
+                        help=f"Escribe la guía con un miembro gzip por canal e índice {SEEKABLE_INDEX_SUFFIX}.")
+    parser.add_argument("--full-scan", action="store_true",
+                        help="Descarga todas las fuentes aunque el índice de canales permita omitir alguna.")
+    parser.add_argument("--api-budget", type=int, default=None,
+                        help="Máximo de llamadas a TMDB/TVMaze por ejecución (0 = sin límite; EPG_API_BUDGET).")
+    parser.add_argument("--enrich-seconds", type=int, default=None,
+                        help="Máximo de segundos de red para enriquecer (0 = sin límite; EPG_ENRICH_SECONDS).")
+    parser.add_argument("--deadline", type=float, default=None, metavar="MIN",
+                        help="Minutos disponibles: degrada el enriquecimiento al acercarse y siempre escribe la guía "
+                             "(0 = sin deadline; EPG_DEADLINE_MINUTES).")
+    parser.add_argument("--profile", nargs="?", const=PROFILE_DIR, default=None, metavar="DIR",
+                        help=f"Perfila cada etapa (pstats y stacks folded por fuente) en DIR (por defecto {PROFILE_DIR}/).")
+    parser.add_argument("--checkpoint", nargs="?", const=CHECKPOINT_FILE, default=None, metavar="FILE",
+                        help=f"Guarda el estado tras cada fuente y reanuda desde él (por defecto {CHECKPOINT_FILE}).")
+    parser.add_argument("--regional", type=parse_output_spec, action="append", default=None, metavar="GUIA=CANALES",
+                        help="Genera además esta guía con los canales de la lista indicada, en la misma pasada "
+                             "(repetible; p. ej. guia-latam.xml.gz=channels-latam.txt).")
+    parser.add_argument("--split-dir", default=None,
+                        help="Escribe además fragmentos por canal y por día con manifest.json en este directorio.")
+    subparsers = parser.add_subparsers(dest="command")
+    bench = subparsers.add_parser("bench-similarity", help="Compara paridad y velocidad de text_similarity.")
+    bench.add_argument("--pairs", type=int, default=20000, help="Cantidad máxima de pares a comparar.")
+    bench.add_argument("--threshold", type=float, default=0.58, help="Umbral usado en el modo con poda.")
+    merge = subparsers.add_parser("merge", help="Fusiona guías parciales y deltas de caché de builds por shards.")
+    merge.add_argument("parts", nargs="+", help="Guías parciales (*.part-i-of-N.xml.gz).")
+    merge.add_argument("--cache-deltas", nargs="*", default=[], help="Deltas de caché (*.part-i-of-N.json).")
+    merge.add_argument("--output", default=OUTPUT_FILE, help="Guía resultante.")
+    merge.add_argument("--cache", default=CACHE_FILE, help="Caché base sobre el que se aplican los deltas.")
+    serve = subparsers.add_parser("serve", help="Sirve la guía con consultas por canal y rango horario.")
+    serve.add_argument("--guide", default=OUTPUT_FILE, help="Guía a servir (se recarga al cambiar).")
+    serve.add_argument("--host", default="0.0.0.0")
+    serve.add_argument("--port", type=int, default=8080)
+    serve.add_argument("--reload-interval", type=int, default=SERVE_RELOAD_INTERVAL,
+                       help="Segundos entre comprobaciones de una guía nueva.")
+    prewarm = subparsers.add_parser("prewarm", help="Precalienta el caché de API con la programación cercana.")
+    prewarm.add_argument("--rate", type=parse_rate, default=PREWARM_CALLS_PER_SECOND, help="Llamadas por segundo.")
+    prewarm.add_argument("--max-calls", type=int, default=0, help="Tope de llamadas (0 = sin límite).")
+    prewarm.add_argument("--horizon", type=int, default=PREWARM_HORIZON_HOURS,
+                         help="Horas hacia adelante a considerar.")
+    now_next = subparsers.add_parser("now-next", help="Programa actual y siguiente desde una guía --seekable.")
+    now_next.add_argument("channels", nargs="+", help="Ids de canal.")
+    now_next.add_argument("--guide", default=OUTPUT_FILE)
+    now_next.add_argument("--at", default=None, help="Instante de consulta (epoch o XMLTV); por defecto ahora.")
+    args = parser.parse_args(argv)
+    if args.command == "now-next":
+        try:
+            ts = _parse_query_time(args.at, now_ts())
+        except ValueError as e:
+            now_next.error(f"--at: {e}")
+        try:
+            # El índice se valida al abrir (tamaño) y al leer cada canal (hash del miembro)
+            with SeekableGuide(args.guide) as guide:
+                for ch_id in args.channels:
+                    for elem in guide.now_next(ch_id, ts):
+                        print(f"{canonical_channel_id(ch_id)}\t{elem.get('start')}\t{elem.findtext('title') or ''}")
+        except ValueError as e:
+            sys.exit(f"now-next: {e}")
+        return
+    if args.command == "prewarm":
+        GuideBuilder().prewarm(calls_per_second=args.rate, max_calls=args.max_calls, horizon_hours=args.horizon)
+        return
+    if args.command == "serve":
+        serve_guide(args.guide, host=args.host, port=args.port, reload_interval=args.reload_interval)
+        return
+    if args.command == "bench-similarity":
+        ok = benchmark_text_similarity(max_pairs=args.pairs, threshold=args.threshold)
+        raise SystemExit(0 if ok else 1)
+    if args.command == "merge":
+        merge_partial_guides(args.parts, args.output)
+        if args.cache_deltas:
+            merge_cache_deltas(args.cache_deltas, args.cache)
+        return
+    main(workers=args.workers, shard=args.shard, split_dir=args.split_dir, delta=args.delta,
+         seekable=args.seekable, full_scan=args.full_scan, api_budget=args.api_budget,
+         enrich_seconds=args.enrich_seconds, profile=args.profile, checkpoint=args.checkpoint,
+         deadline_minutes=args.deadline, regional_outputs=args.regional)
+
 if __name__ == "__main__":
-    main()
+    cli()
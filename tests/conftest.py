@@ -0,0 +1,65 @@
+import os
+import sys
+
+import pytest
+
+# Sin API key: el enriquecimiento no sale a la red durante los tests
+os.environ["TMDB_API_KEY"] = ""
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main as M  # noqa: E402
+
+
+def programme_xml(channel, index, title=None, day="20260105"):
+    hour = index % 24
+    return (
+        f'<programme start="{day}{hour:02d}0000 +0000" stop="{day}{hour:02d}3000 +0000" channel="{channel}">'
+        f'<title lang="es">{title or f"Programa {index}"}</title>'
+        f'<desc lang="es">Descripción del programa {index}.</desc>'
+        f"</programme>\n"
+    )
+
+
+def feed_xml(channels, programmes):
+    """XMLTV mínimo: channels = ids, programmes = [(canal, índice, título)]."""
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n<tv>\n']
+    for ch in channels:
+        parts.append(f'<channel id="{ch}"><display-name>{ch}</display-name></channel>\n')
+    for ch, index, title in programmes:
+        parts.append(programme_xml(ch, index, title))
+    parts.append("</tv>\n")
+    return "".join(parts).encode("utf-8")
+
+
+class CollectingWriter:
+    def __init__(self):
+        self.channels = {}
+        self.programmes = []
+
+    def channel(self, canonical_ch_id, data):
+        self.channels.setdefault(canonical_ch_id, data)
+
+    def programme(self, canonical_ch_id, start, stop, data):
+        self.programmes.append((canonical_ch_id, start, stop, data))
+
+
+def new_state():
+    return {
+        "channel_source_assigned": {},
+        "written_channels": set(),
+        "written_programmes_by_channel": M.ProgrammeHistory(),
+    }
+
+
+@pytest.fixture(autouse=True)
+def isolated_run(tmp_path, monkeypatch):
+    """Cada test corre en un directorio propio y con caché vacío en memoria."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(M, "api_cache", {})
+    monkeypatch.setattr(M, "cache_loaded", True)
+    monkeypatch.setattr(M, "cache_path", str(tmp_path / "api_cache.json"))
+    monkeypatch.setattr(M, "feed_health", {})
+    monkeypatch.setattr(M, "enrichment_scheduler", None)
+    monkeypatch.setattr(M, "run_deadline", None)
+    monkeypatch.setattr(M, "tmdb_title_index", None)
+    yield
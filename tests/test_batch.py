@@ -0,0 +1,61 @@
+import os
+
+import pytest
+
+import main as M
+
+FEED = os.path.join(os.path.dirname(__file__), "data", "feed-it.xml")
+URL = "http://example.invalid/epg-it.xml"
+
+
+def enrich(batch_size):
+    enricher = M.FeedBatchEnricher(URL, batch_size=batch_size)
+    results = []
+    for elem in M.iter_feed_elements(FEED):
+        if elem.tag == "programme":
+            results += enricher.add(elem, elem.get("channel"), M.canonical_channel_id(elem.get("channel")))
+    return results + enricher.flush()
+
+
+def test_batch_size_does_not_change_output():
+    assert enrich(1) == enrich(2) == enrich(1000)
+
+
+def test_batch_drops_exact_repeats_and_keeps_order():
+    results = enrich(1000)
+    assert [r[1][8:12] for r in results] == ["2000", "2100", "2230"]
+    assert {r[0] for r in results} == {"uno.it"}
+    assert all(r[5] == (r[1], r[2]) for r in results)
+
+
+def test_batch_matches_per_programme_enrichment():
+    batch_titles = [r[3] for r in enrich(2)]
+    titles = []
+    seen = set()
+    for elem in M.iter_feed_elements(FEED):
+        if elem.tag != "programme":
+            continue
+        data = M.XML.tostring(elem)
+        if data in seen:
+            continue
+        seen.add(data)
+        auth = M.should_use_tvmaze_authoritative(URL, elem.get("channel"))
+        titles.append(M.process_programme(
+            elem, elem.get("start"), prefer_latam=M.is_latam_feed(URL),
+            spanish_season_episode_format=M.use_spanish_season_episode_format(URL),
+            tvmaze_authoritative=auth)[0])
+    assert batch_titles == titles
+    assert batch_titles[0] == "Il Commissario | Season 2 Episode 5"
+
+
+@pytest.mark.parametrize("kept", [1, 2])
+def test_flush_returns_pending_programmes(kept):
+    enricher = M.FeedBatchEnricher(URL, batch_size=1000)
+    added = 0
+    # Los elementos se liberan al avanzar el parseo: se agregan mientras se recorren
+    for elem in M.iter_feed_elements(FEED):
+        if elem.tag == "programme" and added < kept:
+            assert enricher.add(elem, elem.get("channel"), "uno.it") == []
+            added += 1
+    assert len(enricher.flush()) == kept
+    assert enricher.flush() == []
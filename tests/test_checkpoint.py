@@ -0,0 +1,114 @@
+import pytest
+
+import main as M
+from conftest import CollectingWriter, feed_xml, new_state
+
+URLS = ["http://example.invalid/epg-a.it.xml", "http://example.invalid/epg-b.it.xml"]
+
+
+def recording_writer():
+    writer = M.GuideWriter([CollectingWriter()])
+    writer.recorded = []
+    return writer
+
+
+def process(tmp_path, url, programmes, state, writer):
+    path = tmp_path / "feed.xml"
+    path.write_bytes(feed_xml(sorted({ch for ch, _, _ in programmes}), programmes))
+    M.process_feed_sequential(url, str(path), {"a.it", "b.it"}, state, writer)
+
+
+def history_columns(history):
+    return {ch: [list(getattr(h, name)) for name in M.ChannelHistory.__slots__]
+            for ch, h in history.channels.items()}
+
+
+def run_two_feeds(tmp_path, checkpoint):
+    state, writer = new_state(), recording_writer()
+    checkpoint.start(full_scan=True)
+    checkpoint.mark(state)
+    process(tmp_path, URLS[0], [("A.it", i, None) for i in range(6)], state, writer)
+    checkpoint.append(URLS[0], state, writer)
+    # La segunda fuente repite canal A (ya asignado) y aporta B
+    process(tmp_path, URLS[1], [("A.it", 7, None)] + [("B.it", i, "Noticias") for i in range(4)], state, writer)
+    checkpoint.append(URLS[1], state, writer)
+    return state, writer
+
+
+def test_checkpoint_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setattr(M, "feed_channel_index", {"feeds": {}})
+    scheduler = M.EnrichmentScheduler(max_calls=50)
+    scheduler.calls, scheduler.lookups = 12, 5
+    monkeypatch.setattr(M, "enrichment_scheduler", scheduler)
+    path = str(tmp_path / "guia.checkpoint")
+    state, writer = run_two_feeds(tmp_path, M.BuildCheckpoint(path, "firma"))
+
+    monkeypatch.setattr(M, "enrichment_scheduler", M.EnrichmentScheduler(max_calls=50))
+    resumed = M.BuildCheckpoint(path, "firma")
+    fragments = resumed.load()
+    assert [f["url"] for f in fragments] == URLS and resumed.full_scan
+    restored_state, restored_writer = new_state(), M.GuideWriter([CollectingWriter()])
+    for fragment in fragments:
+        M.BuildCheckpoint.apply(fragment, restored_state, restored_writer)
+
+    assert restored_state["channel_source_assigned"] == state["channel_source_assigned"]
+    assert restored_state["written_channels"] == state["written_channels"]
+    history, restored_history = state["written_programmes_by_channel"], restored_state["written_programmes_by_channel"]
+    assert restored_history.strings == history.strings
+    assert restored_history.norm_ids == history.norm_ids
+    assert history_columns(restored_history) == history_columns(history)
+    assert len(writer.outputs[0].programmes) == 10
+    assert restored_writer.outputs[0].programmes == writer.outputs[0].programmes
+    assert restored_writer.outputs[0].channels == writer.outputs[0].channels
+    # El presupuesto gastado antes del corte sigue contando
+    assert (M.enrichment_scheduler.calls, M.enrichment_scheduler.lookups) == (12, 5)
+
+
+def test_checkpoint_drops_incomplete_fragment(tmp_path, monkeypatch):
+    monkeypatch.setattr(M, "feed_channel_index", {"feeds": {}})
+    path = str(tmp_path / "guia.checkpoint")
+    run_two_feeds(tmp_path, M.BuildCheckpoint(path, "firma"))
+    size = M.os.path.getsize(path)
+    with open(path, "ab") as f:
+        f.write(b"\x80\x05\x95 fragmento cortado")
+    resumed = M.BuildCheckpoint(path, "firma")
+    assert [f["url"] for f in resumed.load()] == URLS
+    assert M.os.path.getsize(path) == size
+    assert M.BuildCheckpoint(path, "otra firma").load() is None
+
+
+def test_failed_feed_is_not_journaled_and_retried_on_resume(tmp_path, monkeypatch):
+    monkeypatch.setattr(M, "feed_channel_index", {"feeds": {}})
+    (tmp_path / "canales.txt").write_text("A.it\nB.it\n", encoding="utf-8")
+    urls = URLS + ["http://example.invalid/epg-c.it.xml"]
+    feeds = {urls[0]: feed_xml(["A.it"], [("A.it", i, None) for i in range(3)]),
+             urls[1]: feed_xml(["B.it"], [("B.it", i, None) for i in range(3)]),
+             urls[2]: feed_xml([], [])}
+    failing = {urls[1]: ConnectionError("sin red"),
+               # Corte del proceso: el checkpoint queda para la próxima ejecución
+               urls[2]: KeyboardInterrupt()}
+    fetched = []
+
+    def fetch(url, path):
+        fetched.append(url)
+        if url in failing:
+            raise failing[url]
+        with open(path, "wb") as f:
+            f.write(feeds[url])
+
+    monkeypatch.setattr(M, "fetch_feed", fetch)
+    options = dict(channels_file=str(tmp_path / "canales.txt"), output_file=str(tmp_path / "guia.xml.gz"),
+                   cache_file=str(tmp_path / "api_cache.json"), epg_urls=urls,
+                   checkpoint=str(tmp_path / "guia.checkpoint"), full_scan=True)
+    with pytest.raises(KeyboardInterrupt):
+        M.GuideBuilder(**options).build()
+    assert fetched == urls
+
+    fetched.clear()
+    failing.clear()
+    M.GuideBuilder(**options).build()
+    # La fuente que terminó no se repite; la que falló sí
+    assert fetched == urls[1:]
+    with M.gzip.open(options["output_file"], "rb") as f:
+        channels = {elem.get("channel") for elem in M.iter_feed_elements(f) if elem.tag == "programme"}
+    assert channels == {"a.it", "b.it"}
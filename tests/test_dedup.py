@@ -0,0 +1,47 @@
+import main as M
+
+
+def history_with(*programmes):
+    history = M.ProgrammeHistory()
+    for start, stop, title in programmes:
+        history.add("c1.it", start, stop, title)
+    return history
+
+
+def is_duplicate(history, start, stop, title):
+    return M.is_duplicate_programme("c1.it", start, stop, title, history)
+
+
+def test_overlapping_airing_of_same_title_is_duplicate():
+    history = history_with(("20260105200000 +0000", "20260105210000 +0000", "Los Simpson"))
+    # Mismo programa con otro huso y título con distinta puntuación
+    assert is_duplicate(history, "20260105170500 -0300", "20260105180000 -0300", "Los Simpson!")
+    assert not is_duplicate(history, "20260105203000 +0000", "20260105213000 +0000", "Los Simpson")
+    assert not is_duplicate(history, "20260105200000 +0000", "20260105210000 +0000", "Noticias")
+    assert M.is_duplicate_programme("c2.it", "20260105200000 +0000", "20260105210000 +0000", "Los Simpson",
+                                    history) is False
+
+
+def test_zero_duration_programme_only_matches_exact_repeat():
+    # Esta rama antes usaba nombres inexistentes y cortaba la fuente con NameError
+    history = history_with(("20260105200000 +0000", "20260105200000 +0000", "Cierre"))
+    assert is_duplicate(history, "20260105200000 +0000", "20260105200000 +0000", "Cierre")
+    assert not is_duplicate(history, "20260105170000 -0300", "20260105170000 -0300", "Cierre")
+    assert not is_duplicate(history, "20260105200000 +0000", "20260105200000 +0000", "Apertura")
+
+
+def test_unparseable_times_fall_back_to_exact_strings():
+    history = history_with(("mañana", "pasado", "Especial"))
+    assert is_duplicate(history, "mañana", "pasado", "Especial")
+    assert not is_duplicate(history, "mañana", "otro día", "Especial")
+
+
+def test_history_stores_epochs_and_interned_texts():
+    history = history_with(("20260105200000 +0000", "20260105210000 +0000", "Los Simpson"),
+                           ("20260105210000 +0000", "20260105220000 +0000", "Los Simpson"))
+    channel = history.get("c1.it")
+    assert list(channel.starts) == [M.xmltv_to_epoch("20260105200000 +0000"),
+                                    M.xmltv_to_epoch("20260105210000 +0000")]
+    assert channel.title_ids[0] == channel.title_ids[1]
+    assert history.strings[history.norm_ids[channel.title_ids[0]]] == M.normalize_text("Los Simpson")
+    assert history.total() == 2
@@ -0,0 +1,146 @@
+import pytest
+
+import main as M
+from conftest import CollectingWriter, feed_xml, new_state
+
+URL = "http://example.invalid/epg-it.xml"
+
+
+def truncated_feed(tmp_path, kept=10, total=20):
+    data = feed_xml(["C1.it"], [("C1.it", i, None) for i in range(total)])
+    # Corte justo después del programa número `kept`
+    cut = 0
+    for _ in range(kept):
+        cut = data.index(b"</programme>", cut) + len(b"</programme>")
+    path = tmp_path / "feed.xml"
+    path.write_bytes(data[:cut + 40])
+    return path
+
+
+def test_truncated_feed_keeps_buffered_programmes_sequential(tmp_path):
+    path = truncated_feed(tmp_path)
+    writer = CollectingWriter()
+    state = new_state()
+    with pytest.raises(Exception):
+        M.process_feed_sequential(URL, str(path), {"c1.it"}, state, writer)
+    assert len(writer.programmes) == 10
+    assert state["channel_source_assigned"]["c1.it"] == URL
+
+
+def test_truncated_feed_keeps_buffered_programmes_worker(tmp_path):
+    path = truncated_feed(tmp_path)
+    events, error, _, feed_channels, _ = M.enrich_feed_task(
+        1, URL, {"c1.it"}, M.feed_health_record(URL), prefetched_path=str(path)
+    )
+    assert error
+    assert feed_channels == {"c1.it"}
+    assert sum(1 for event in events if event[0] == "programme") == 10
+
+
+def test_worker_stops_reading_when_feeds_stage_expires(tmp_path, monkeypatch):
+    path = tmp_path / "feed.xml"
+    path.write_bytes(feed_xml(["C1.it"], [("C1.it", i, None) for i in range(20)]))
+    deadline = M.RunDeadline(100, started=M.time.time() - 95)
+    deadline.refused = 3
+    monkeypatch.setattr(M, "run_deadline", deadline)
+    events, error, _, _, refused = M.enrich_feed_task(
+        1, URL, {"c1.it"}, M.feed_health_record(URL), prefetched_path=str(path)
+    )
+    assert error == "interrumpida por deadline"
+    assert events == []
+    # Solo se informan las rechazadas durante esta tarea
+    assert refused == 0
+
+
+def test_sequential_feed_stops_reading_when_feeds_stage_expires(tmp_path, monkeypatch):
+    path = tmp_path / "feed.xml"
+    path.write_bytes(feed_xml(["C1.it"], [("C1.it", i, None) for i in range(20)]))
+    monkeypatch.setattr(M, "run_deadline", M.RunDeadline(100, started=M.time.time() - 95))
+    writer = CollectingWriter()
+    with pytest.raises(RuntimeError, match="deadline"):
+        M.process_feed_sequential(URL, str(path), {"c1.it"}, new_state(), writer)
+    assert writer.programmes == []
+
+
+def test_plan_parallel_skips_predicts_claims(monkeypatch):
+    monkeypatch.setattr(M, "feed_channel_index", {"feeds": {
+        "a": {"channels": ["x", "y"]},
+        "b": {"channels": ["x", "y"]},
+        "c": {"channels": ["y", "z"]},
+    }})
+    skipped, claimed_before = M.plan_parallel_skips(["a", "b", "c"], {"x", "y", "z"}, claimed={"w"})
+    assert skipped == {"b"}
+    assert claimed_before["a"] == {"w"}
+    assert claimed_before["c"] == {"w", "x", "y"}
+
+
+def test_last_good_copy_expires(tmp_path):
+    source = tmp_path / "feed.xml"
+    source.write_bytes(feed_xml(["C1.it"], [("C1.it", 0, None)]))
+    M.store_last_good_copy(URL, str(source))
+    store_path = M.feed_store_path(URL)
+    assert M.restore_last_good_copy(URL, str(tmp_path / "restored.xml"))
+    old = M.time.time() - M.FEED_STORE_MAX_AGE - 3600
+    M.os.utime(store_path, (old, old))
+    assert not M.restore_last_good_copy(URL, str(tmp_path / "restored.xml"))
+    assert not M.os.path.exists(store_path)
+
+
+def test_feed_skipped_when_indexed_channels_are_covered(tmp_path, monkeypatch):
+    monkeypatch.setattr(M, "feed_channel_index", {"feeds": {}, "last_full_scan": M.now_ts()})
+    monkeypatch.setattr(M, "CHANNEL_SOURCE_RULES", {"c3.it": ["http://example.invalid/otra.xml"]})
+    fetched = []
+
+    def fetch(url, path):
+        fetched.append(url)
+        with open(path, "wb") as f:
+            f.write(feed_xml(["C1.it", "C2.it", "C3.it"], [("C1.it", 0, None), ("C2.it", 0, None)]))
+
+    monkeypatch.setattr(M, "fetch_feed", fetch)
+    allowed = {"c1.it", "c2.it", "c3.it"}
+    # Sin registro previo la fuente se descarga y queda indexada
+    assert not M.can_skip_feed(URL, allowed, {"c1.it", "c2.it"})
+    assert M.process_feed_url("1/1", URL, allowed, new_state(), M.GuideWriter([CollectingWriter()]))
+    assert M.feed_channel_index["feeds"][URL]["channels"] == ["c1.it", "c2.it", "c3.it"]
+    # c3.it solo puede venir de otra fuente: no cuenta como aporte de esta
+    assert M.feed_claimable_channels(URL, allowed) == {"c1.it", "c2.it"}
+    assert not M.can_skip_feed(URL, allowed, {"c1.it"})
+    assert not M.feed_index_full_scan_due()
+
+    state = new_state()
+    state["channel_source_assigned"].update({"c1.it": "a", "c2.it": "b"})
+    assert M.process_feed_url("1/1", URL, allowed, state, M.GuideWriter([CollectingWriter()]))
+    assert fetched == [URL]
+    # El recorrido completo periódico descarga igual
+    assert M.process_feed_url("1/1", URL, allowed, state, M.GuideWriter([CollectingWriter()]), full_scan=True)
+    assert fetched == [URL, URL]
+    M.feed_channel_index["last_full_scan"] = M.now_ts() - M.FEED_INDEX_RESCAN_SECONDS - 1
+    assert M.feed_index_full_scan_due()
+
+
+def test_prioritized_scan_reads_header_and_main_pass_reuses_download(tmp_path, monkeypatch):
+    monkeypatch.setattr(M, "feed_channel_index", {"feeds": {}})
+    monkeypatch.setattr(M, "CHANNEL_SOURCE_RULES", {"c1.it": [URL]})
+    data = feed_xml(["C1.it"], [("C1.it", i, None) for i in range(3)])
+    # El escaneo solo lee la cabecera de canales: un error muy posterior no llega a parsearse
+    header = tmp_path / "cabecera.xml"
+    long_feed = feed_xml(["C1.it"], [("C1.it", i, None) for i in range(20000)])
+    header.write_bytes(long_feed[:long_feed.rindex(b"<programme")] + b"<programme <<< roto")
+    assert [elem.get("id") for elem in M.iter_feed_channels(str(header))] == ["C1.it"]
+
+    fetched = []
+
+    def fetch(url, path):
+        fetched.append(url)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    monkeypatch.setattr(M, "fetch_feed", fetch)
+    (tmp_path / "canales.txt").write_text("C1.it\n", encoding="utf-8")
+    builder = M.GuideBuilder(channels_file=str(tmp_path / "canales.txt"), output_file=str(tmp_path / "guia.xml.gz"),
+                             cache_file=str(tmp_path / "api_cache.json"), epg_urls=[URL])
+    builder.build()
+    assert fetched == [URL]
+    assert builder.prefetched == {} and not list(tmp_path.glob(M.TEMP_INPUT + "*"))
+    with M.gzip.open(tmp_path / "guia.xml.gz", "rb") as f:
+        assert sum(1 for elem in M.iter_feed_elements(f) if elem.tag == "programme") == 3
@@ -0,0 +1,169 @@
+import gzip
+import os
+
+import pytest
+
+import main as M
+from conftest import feed_xml, programme_xml
+
+
+def write_guide(path, channels, programmes):
+    with open(path, "wb") as f:
+        f.write(gzip.compress(feed_xml(channels, programmes), mtime=0))
+
+
+def test_guide_output_spools_programmes_to_disk(tmp_path):
+    path = str(tmp_path / "guia.xml.gz")
+    output = M.XmltvGuideOutput(path)
+    output.channel("c1.it", b'<channel id="c1.it" />')
+    for i in (3, 1, 2):
+        output.programme("c1.it", f"2026010{i}000000 +0000", f"2026010{i}010000 +0000",
+                         programme_xml("c1.it", i).strip().encode("utf-8"))
+    # En memoria solo quedan offsets; los bytes están en el spool
+    assert all(len(entry) == 4 for entry in output.programmes["c1.it"])
+    assert os.path.exists(output.spool_path)
+    output.close()
+    assert not os.path.exists(output.spool_path)
+    with gzip.open(path, "rb") as f:
+        starts = [elem.get("start") for elem in M.iter_feed_elements(f) if elem.tag == "programme"]
+    assert starts == sorted(starts) and len(starts) == 3
+
+
+def test_guide_delta_streams_against_indexed_base(tmp_path):
+    old_path, new_path = str(tmp_path / "old.xml.gz"), str(tmp_path / "new.xml.gz")
+    write_guide(old_path, ["a.it", "b.it"], [("a.it", i, None) for i in range(6)] + [("b.it", 0, None)])
+    write_guide(new_path, ["a.it", "c.it"],
+                [("a.it", i, "Otro" if i == 3 else None) for i in range(2, 8)] + [("c.it", 1, None)])
+    previous = M.index_guide_entries(old_path, str(tmp_path / "base.sqlite"))
+    delta = M.build_guide_delta(previous, new_path)
+    assert delta["base_sha256"] == M.file_sha256(old_path)
+    assert delta["channels"]["removed"] == ["b.it"]
+    assert [c["id"] for c in delta["channels"]["added"]] == ["c.it"]
+    programmes = delta["programmes"]
+    assert [(p["channel"], p["start"][8:10]) for p in programmes["added"]] == [
+        ("a.it", "06"), ("a.it", "07"), ("c.it", "01")]
+    assert [p["start"][8:10] for p in programmes["changed"]] == ["03"]
+    assert [(p["channel"], p["start"][8:10]) for p in programmes["removed"]] == [
+        ("a.it", "00"), ("a.it", "01"), ("b.it", "00")]
+
+
+def test_delta_path_follows_the_guide():
+    assert M.guide_delta_path(M.OUTPUT_FILE) == "guia.delta.json.gz"
+    shard_guide, _ = M.shard_output_paths((1, 3))
+    assert M.guide_delta_path(shard_guide) == shard_guide[:-len(".xml.gz")] + ".delta.json.gz"
+    assert M.guide_delta_path("salida/otra.xml") == "salida/otra.delta.json.gz"
+
+
+def build_seekable(path, seekable=True, titles=("Uno", "Dos")):
+    output = M.XmltvGuideOutput(path, seekable=seekable)
+    output.channel("c1.it", b'<channel id="c1.it" />')
+    for i, title in enumerate(titles):
+        output.programme("c1.it", f"2026010{i + 1}000000 +0000", f"2026010{i + 1}010000 +0000",
+                         programme_xml("c1.it", i, title).strip().encode("utf-8"))
+    output.close()
+
+
+def test_plain_build_removes_stale_seekable_index(tmp_path):
+    path = str(tmp_path / "guia.xml.gz")
+    build_seekable(path)
+    assert os.path.exists(path + M.SEEKABLE_INDEX_SUFFIX)
+    build_seekable(path, seekable=False)
+    assert not os.path.exists(path + M.SEEKABLE_INDEX_SUFFIX)
+
+
+def test_seekable_guide_rejects_index_of_another_guide(tmp_path):
+    path = str(tmp_path / "guia.xml.gz")
+    build_seekable(path)
+    with M.SeekableGuide(path) as guide:
+        assert guide.channel_ids() == ["c1.it"]
+    stale_index = open(path + M.SEEKABLE_INDEX_SUFFIX, "rb").read()
+    build_seekable(path, titles=("Uno", "Otro título"))
+    with open(path + M.SEEKABLE_INDEX_SUFFIX, "wb") as f:
+        f.write(stale_index)
+    with pytest.raises(ValueError, match="no corresponde"):
+        M.SeekableGuide(path)
+    # Mismo tamaño, otro contenido: se detecta al leer el miembro del canal
+    build_seekable(path, titles=("Uno", "Dso"))
+    with open(path + M.SEEKABLE_INDEX_SUFFIX, "wb") as f:
+        f.write(stale_index)
+    with M.SeekableGuide(path) as guide:
+        with pytest.raises(ValueError, match="no corresponde"):
+            guide.programmes("c1.it")
+
+
+def build_split(directory, title=b"<programme />"):
+    output = M.SplitGuideOutput(str(directory))
+    output.channel("c1.it", b'<channel id="c1.it" />')
+    # 00:30 en -0300 es 03:30 UTC: posterior al otro programa aunque su texto ordene antes
+    output.programme("c1.it", "20260105003000 -0300", "20260105013000 -0300", b"<programme />")
+    output.programme("c1.it", "20260105010000 +0000", "20260105020000 +0000", title)
+    output.close()
+    return open(directory / "manifest.json", "rb").read()
+
+
+def test_split_manifest_is_stable_and_uses_epochs(tmp_path, monkeypatch):
+    monkeypatch.setattr(M, "now_ts", lambda: 1000)
+    first = build_split(tmp_path)
+    monkeypatch.setattr(M, "now_ts", lambda: 2000)
+    assert build_split(tmp_path) == first
+    manifest = M.json.loads(first)
+    assert manifest["generated"] == 1000
+    entry = manifest["channels"]["c1.it"]
+    assert entry["first_start"] == M.xmltv_to_epoch("20260105010000 +0000")
+    assert entry["last_stop"] == M.xmltv_to_epoch("20260105013000 -0300")
+    # Un cambio de contenido sí renueva el manifest
+    assert M.json.loads(build_split(tmp_path, title=b"<programme><title>Otro</title></programme>"))["generated"] == 2000
+
+
+def test_split_output_spools_and_buckets_by_utc_day(tmp_path):
+    output = M.SplitGuideOutput(str(tmp_path / "split"))
+    output.channel("c1.it", b'<channel id="c1.it"><display-name>Primero</display-name></channel>')
+    output.channel("c1.it", b'<channel id="c1.it"><display-name>Segundo</display-name></channel>')
+    # 22:00 en -0300 ya es el día siguiente en UTC
+    output.programme("c1.it", "20260105220000 -0300", "20260105230000 -0300", b"<programme />")
+    output.programme("c1.it", "20260105120000 +0000", "20260105130000 +0000", b"<programme />")
+    assert all(len(entry) == 4 for entry in output.programmes["c1.it"])
+    assert os.path.exists(output.spool_path)
+    output.close()
+    assert not os.path.exists(output.spool_path)
+    manifest = M.json.loads((tmp_path / "split" / "manifest.json").read_text(encoding="utf-8"))
+    assert {day: entry["programmes"] for day, entry in manifest["days"].items()} == {"20260105": 1, "20260106": 1}
+    with gzip.open(tmp_path / "split" / "channels" / "c1.it.xml.gz", "rb") as f:
+        channel = f.read()
+    assert b"Primero" in channel and b"Segundo" not in channel
+
+
+def guide_channels(path):
+    with gzip.open(path, "rb") as f:
+        return sorted({elem.get("channel") for elem in M.iter_feed_elements(f) if elem.tag == "programme"})
+
+
+def test_regional_guides_come_from_one_pass(tmp_path, monkeypatch):
+    monkeypatch.setattr(M, "feed_channel_index", {"feeds": {}})
+    urls = ["http://example.invalid/epg-a.it.xml", "http://example.invalid/epg-b.it.xml"]
+    feeds = {urls[0]: feed_xml(["C1.it", "C2.it"], [("C1.it", 0, None), ("C2.it", 1, None)]),
+             urls[1]: feed_xml(["C3.it", "C4.it"], [("C3.it", 2, None), ("C4.it", 3, None)])}
+    fetched = []
+
+    def fetch(url, path):
+        fetched.append(url)
+        with open(path, "wb") as f:
+            f.write(feeds[url])
+
+    monkeypatch.setattr(M, "fetch_feed", fetch)
+    (tmp_path / "canales.txt").write_text("C1.it\nC2.it\n", encoding="utf-8")
+    (tmp_path / "latam.txt").write_text("C2.it\nC3.it\n", encoding="utf-8")
+    regional_path = str(tmp_path / "guia-latam.xml.gz")
+    M.GuideBuilder(channels_file=str(tmp_path / "canales.txt"), output_file=str(tmp_path / "guia.xml.gz"),
+                   cache_file=str(tmp_path / "api_cache.json"), epg_urls=urls,
+                   regional_outputs=[(regional_path, str(tmp_path / "latam.txt"))]).build()
+    assert fetched == urls
+    assert guide_channels(tmp_path / "guia.xml.gz") == ["c1.it", "c2.it"]
+    assert guide_channels(regional_path) == ["c2.it", "c3.it"]
+
+
+def test_regional_output_spec():
+    assert M.parse_output_spec(" guia-latam.xml.gz = latam.txt ") == ("guia-latam.xml.gz", "latam.txt")
+    for spec in ("guia.xml.gz", "=latam.txt", "guia.xml.gz="):
+        with pytest.raises(M.argparse.ArgumentTypeError):
+            M.parse_output_spec(spec)
@@ -0,0 +1,49 @@
+import pstats
+
+import main as M
+from conftest import CollectingWriter, feed_xml, new_state
+
+URL = "http://example.invalid/epg-perfil.it.xml"
+
+
+class FakeDownload:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size=None):
+        yield self.payload
+
+
+class FakeSession:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def get(self, url, stream=False, timeout=None):
+        return FakeDownload(self.payload)
+
+
+def test_every_profile_stage_measures_a_profiled_function(tmp_path, monkeypatch):
+    payload = feed_xml(["c1.it"], [("c1.it", i, None) for i in range(4)])
+    monkeypatch.setattr(M, "get_session", lambda: FakeSession(payload))
+    monkeypatch.setattr(M, "feed_channel_index", {"feeds": {}})
+    monkeypatch.setattr(M, "profile_dir", None)
+    directory = str(tmp_path / "perfil")
+    M.start_profiling(directory)
+    writer = M.GuideWriter([CollectingWriter()])
+    assert M.process_feed_url("1/1", URL, {"c1.it"}, new_state(), writer, full_scan=True)
+    monkeypatch.setattr(M, "profile_dir", None)
+    assert len(writer.outputs[0].programmes) == 4
+
+    stats = pstats.Stats(*M.glob.glob(M.os.path.join(directory, "*.pstats"))).stats
+    missing = [stage for stage, function_path in M.PROFILE_STAGE_FUNCTIONS
+               if M.profile_stage_key(function_path) not in stats]
+    assert missing == []
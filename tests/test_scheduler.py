@@ -0,0 +1,83 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+import main as M
+from conftest import feed_xml
+
+
+def _admit_keys(keys):
+    return [M.enrichment_scheduler.admits(key) for key in keys]
+
+
+def test_workers_share_one_budget(tmp_path, monkeypatch):
+    shared_path = str(tmp_path / "shared.sqlite")
+    M.create_shared_cache(shared_path)
+    scheduler = M.EnrichmentScheduler(max_calls=20)
+    scheduler.ranks = {f"k{i}": i for i in range(40)}
+    monkeypatch.setattr(M, "enrichment_scheduler", scheduler.share(2))
+    keys = [f"k{i}" for i in range(40)]
+    with ProcessPoolExecutor(max_workers=2, initializer=M._init_feed_worker,
+                             initargs=(shared_path, M.cache_path, scheduler, None, None)) as pool:
+        admitted = list(pool.map(_admit_keys, [keys[:20], keys[20:]]))
+    # Con el plan global, solo las claves mejor ubicadas pasan, sin importar el worker
+    per_lookup = max(M.ENRICH_CALLS_PER_LOOKUP, 1.0)
+    assert sum(admitted[0]) == int(-(-20 // per_lookup)) and not any(admitted[1])
+    assert scheduler.lookups == sum(admitted[0]) and scheduler.deferred == 40 - scheduler.lookups
+
+
+def test_affordable_lookups_uses_remaining_budget():
+    scheduler = M.EnrichmentScheduler(max_calls=100)
+    initial = scheduler.affordable_lookups()
+    # Llamadas que no fueron lookups (detalles, episodios) achican lo que queda
+    scheduler.calls = 50
+    assert scheduler.affordable_lookups() == 50 / max(M.ENRICH_CALLS_PER_LOOKUP, 1.0) < initial
+
+
+def test_prewarm_rate_must_be_positive():
+    assert M.parse_rate("0.5") == 0.5
+    for value in ("0", "-1", "nan", "rápido"):
+        with pytest.raises(M.argparse.ArgumentTypeError):
+            M.parse_rate(value)
+
+
+def test_rate_limited_calls_do_not_sleep_holding_the_lock(monkeypatch):
+    scheduler = M.EnrichmentScheduler(min_interval=0.2)
+    sleeps = []
+
+    def fake_sleep(seconds):
+        # Otro hilo debe poder tomar el lock mientras este espera su turno
+        assert M._api_budget_lock.acquire(blocking=False)
+        M._api_budget_lock.release()
+        sleeps.append(seconds)
+
+    class Session:
+        def get(self, url, params=None, timeout=None):
+            return url
+
+    monkeypatch.setattr(M.time, "sleep", fake_sleep)
+    monkeypatch.setattr(M, "get_session", lambda: Session())
+    for _ in range(3):
+        scheduler.call("http://api.invalid/", {})
+    assert scheduler.calls == 3
+    # Cada llamada reserva un turno min_interval después del anterior
+    assert len(sleeps) == 2 and sleeps[1] > sleeps[0] > 0.1
+
+
+def test_plan_includes_tvmaze_lookups_of_authoritative_channels(tmp_path, monkeypatch):
+    url = "http://example.invalid/epg-us.xml"
+    source = tmp_path / "feed.xml"
+    source.write_bytes(feed_xml(["C1.us"], [("C1.us", 20, "Serie Cualquiera S01E02")]))
+    M.store_last_good_copy(url, str(source))
+    builder = M.GuideBuilder(epg_urls=[url])
+    keys = [candidate[0] for candidate in builder.iter_lookup_candidates({"c1.us"}, {"c1.us": 0})]
+    assert len(keys) == 2 and keys[1].startswith("tvmaze_plan:")
+
+    # El build pide admisión al plan con la misma clave que se planificó
+    admitted = []
+    monkeypatch.setattr(M, "api_admits", lambda key: admitted.append(key) or False)
+    with M.gzip.open(M.feed_store_path(url), "rb") as f:
+        for elem in M.iter_feed_elements(f):
+            if elem.tag == "programme":
+                M.process_programme(elem, elem.get("start"), tvmaze_authoritative=True)
+    assert admitted == [keys[1]]
@@ -0,0 +1,60 @@
+import gzip
+import threading
+import urllib.request
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import main as M
+from conftest import feed_xml
+
+
+@pytest.fixture
+def guide_server(tmp_path):
+    path = tmp_path / "guia.xml.gz"
+    path.write_bytes(gzip.compress(feed_xml(["c1.it"], [("c1.it", i, None) for i in range(24)])))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), M.GuideRequestHandler)
+    server.guide_index = M.GuideIndex(str(path))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def get_etag(url):
+    with urllib.request.urlopen(url) as response:
+        return response.headers["ETag"]
+
+
+def test_guide_etag_follows_resolved_window(guide_server, monkeypatch):
+    monkeypatch.setattr(M, "now_ts", lambda: 1767571200)
+    first = get_etag(guide_server + "/guide.xml")
+    assert get_etag(guide_server + "/guide.xml") == first
+    # Sin from/to la ventana avanza con el reloj: el ETag anterior ya no vale
+    monkeypatch.setattr(M, "now_ts", lambda: 1767571200 + 3600)
+    assert get_etag(guide_server + "/guide.xml") != first
+    # Con ventana explícita el ETag no depende del reloj
+    fixed = get_etag(guide_server + "/guide.xml?from=1767571200&to=1767600000")
+    monkeypatch.setattr(M, "now_ts", lambda: 1767571200)
+    assert get_etag(guide_server + "/guide.xml?from=1767571200&to=1767600000") == fixed
+
+
+def test_range_includes_long_programme_started_earlier(tmp_path):
+    path = tmp_path / "guia.xml.gz"
+    programmes = [("20260105000000", "20260105060000", "Maratón"),
+                  ("20260105010000", "20260105013000", "Corto 1"),
+                  ("20260105020000", "20260105023000", "Corto 2"),
+                  ("20260105070000", "20260105080000", "Después")]
+    xml = "".join(f'<programme start="{start} +0000" stop="{stop} +0000" channel="c1.it"><title>{title}</title>'
+                  f"</programme>" for start, stop, title in programmes)
+    path.write_bytes(gzip.compress(f"<tv>{xml}</tv>".encode("utf-8")))
+    index = M.GuideIndex(str(path))
+    start_ts = M.xmltv_to_epoch("20260105030000 +0000")
+    titles = [M.XML.fromstring(p[2]).findtext("title") for p in index.range("c1.it", start_ts, start_ts + 3600)]
+    assert titles == ["Maratón"]
+
+
+def test_now_next_rejects_invalid_at():
+    with pytest.raises(SystemExit) as exc:
+        M.cli(["now-next", "c1.it", "--at", "mañana"])
+    assert exc.value.code == 2
@@ -0,0 +1,7 @@
+import main as M
+
+
+def test_shard_paths_follow_builder_paths():
+    assert M.shard_output_paths((1, 3), "out/regional.xml.gz", "cache/api.json") == (
+        "out/regional.part-1-of-3.xml.gz", "cache/api.part-1-of-3.json")
+    assert M.shard_output_paths((0, 2)) == ("guia.part-0-of-2.xml.gz", "api_cache.part-0-of-2.json")
@@ -0,0 +1,23 @@
+import main as M
+
+
+def test_parent_cache_set_after_creating_shared_cache(tmp_path, capsys, monkeypatch):
+    monkeypatch.setattr(M, "shared_cache_db", None)
+    path = str(tmp_path / "shared.sqlite")
+    M.create_shared_cache(path)
+    assert M.shared_cache_db is None
+    M.cache_set("k", {"v": 1})
+    assert "Error caché compartido" not in capsys.readouterr().out
+    assert M.cache_get("k") == {"v": 1}
+
+
+def test_worker_entries_are_merged(tmp_path, monkeypatch):
+    path = str(tmp_path / "shared.sqlite")
+    M.create_shared_cache(path)
+    monkeypatch.setattr(M, "shared_cache_db", None)
+    M.open_shared_cache(path)
+    M.cache_set("worker", [1, 2])
+    M.close_shared_cache()
+    monkeypatch.setattr(M, "api_cache", {})
+    assert M.merge_shared_cache(path) == 1
+    assert M.cache_get("worker") == [1, 2]
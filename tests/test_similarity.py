@@ -0,0 +1,42 @@
+import pytest
+
+import main as M
+
+TITLES = M.BENCHMARK_SAMPLE_TITLES + [
+    "The Walking Dead", "The Walking Dead: Daryl Dixon", "Fear the Walking Dead",
+    "La casa de papel", "Casa de papel: Corea", "CSI: Miami", "CSI: Vegas", "Noticias 24",
+    "Los Simpson", "The Simpsons", "M3GAN 2.0", "Megan", "", "!!!",
+]
+
+
+@pytest.mark.parametrize("threshold", [0.4, 0.58, 0.78])
+def test_bounded_similarity_keeps_accept_reject_decisions(threshold):
+    for a in TITLES:
+        for b in TITLES:
+            reference = M._text_similarity_reference(a, b)
+            bounded = M.text_similarity(a, b, min_ratio=threshold)
+            assert (bounded >= threshold) == (reference >= threshold), (a, b)
+            if bounded >= threshold:
+                assert bounded == reference, (a, b)
+
+
+def reference_normalize(text):
+    # Implementación previa a la tabla de textos normalizados
+    if not text:
+        return ""
+    text = text.lower()
+    text = M.unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+    text = M.re.sub(r"[^a-z0-9\s]", " ", text)
+    return " ".join(text.split())
+
+
+def test_interned_normalization_matches_original():
+    texts = TITLES + ["Ñandú  ÁGIL", "Canción\tdel año", "ＦＵＬＬ　ＷＩＤＴＨ", "Ⅻ Capítulo", "Straße", "İstanbul",
+                      "  espacios   extra  ", "S01E02 - El regreso", None]
+    for text in texts:
+        expected = reference_normalize(text)
+        assert M.normalize_text(text) == expected, text
+        assert M.token_set(text) == {t for t in expected.split() if len(t) > 2 and t not in M.STOPWORDS}
+    # El texto normalizado se comparte (internado) entre llamadas
+    assert M.normalize_text("Los Simpson!") is M.normalize_text("los  simpson")
+    assert M._normalized_entry.cache_info().maxsize == M.NORMALIZED_TEXT_CACHE_SIZE
@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import main as M
+
+
+def reference_epoch(text):
+    stamp = datetime.strptime(text[:14], "%Y%m%d%H%M%S")
+    tz = text[14:].strip()
+    offset = timedelta(hours=int(tz[1:3]), minutes=int(tz[3:5])) * (-1 if tz[:1] == "-" else 1) if tz else timedelta()
+    return int(stamp.replace(tzinfo=timezone(offset)).timestamp())
+
+
+@pytest.mark.parametrize("text", [
+    "20260105200000 +0000",
+    "20260105200000 -0300",
+    "20260105200000 +0530",
+    "20240229235959 +1400",
+    "19691231235959 -1200",
+    "20260105200000",
+    "20261231233000 -0030",
+])
+def test_epoch_matches_datetime(text):
+    assert M.xmltv_to_epoch(text) == reference_epoch(text)
+
+
+@pytest.mark.parametrize("text", [
+    "", None, "2026010520", "20250229120000 +0000", "20261301000000", "20260105246000", "2026O105200000",
+])
+def test_invalid_timestamps(text):
+    assert M.xmltv_to_epoch(text) is None
+
+
+def test_format_round_trip():
+    for offset in (None, 0, -180, 330, -30):
+        for epoch in (0, 951782400, 1767643200, -86400 * 365):
+            text = M.format_xmltv_time(epoch, offset)
+            assert M.xmltv_to_epoch(text) == epoch
+            assert datetime.fromtimestamp(epoch + (offset or 0) * 60, timezone.utc).strftime("%Y%m%d%H%M%S") == text[:14]
+
+
+def test_shift_keeps_zone_suffix():
+    assert M.shift_xmltv_time("20260131233000 -0300", 45) == "20260201001500 -0300"
+    assert M.shift_xmltv_time("20240301001500", -30) == "20240229234500"
+    assert M.shift_xmltv_time("20260105200000 UTC", 10) is None
+
+
+def test_air_date_uses_source_clock():
+    assert M.xmltv_air_date("20260105233000 -0300") == "2026-01-05"
+    with pytest.raises(ValueError):
+        M.xmltv_air_date("20260230000000")
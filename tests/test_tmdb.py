@@ -0,0 +1,115 @@
+import main as M
+
+
+class FakeResponse:
+    def __init__(self, status_code, payload=None):
+        self.status_code = status_code
+        self.payload = payload
+
+    def json(self):
+        return self.payload
+
+
+ITEM = {"id": 7, "media_type": "tv", "name": "Los Simpson", "first_air_date": "1989-12-17"}
+
+
+def test_match_not_cached_when_localized_details_refused(monkeypatch):
+    monkeypatch.setattr(M, "TMDB_API_KEY", "x")
+
+    def refuse(url, params):
+        M.enrichment_scheduler.refused += 1
+        raise M.ApiCallRefused(url)
+
+    monkeypatch.setattr(M, "enrichment_scheduler", M.EnrichmentScheduler(max_calls=1))
+    monkeypatch.setattr(M, "api_get", refuse)
+    match = M._store_tmdb_match("tmdb_match:k", ITEM, 9.0, prefer_latam=True)
+    assert match["id"] == 7 and "localized_title" not in match
+    assert "tmdb_match:k" not in M.api_cache
+
+
+def test_match_cached_with_localized_details(monkeypatch):
+    monkeypatch.setattr(M, "TMDB_API_KEY", "x")
+    monkeypatch.setattr(M, "api_get", lambda url, params: FakeResponse(200, {"name": "Los Simpson", "overview": "o"}))
+    match = M._store_tmdb_match("tmdb_match:k", ITEM, 9.0, prefer_latam=True)
+    assert match["localized_title"] == "Los Simpson"
+    assert M.api_cache["tmdb_match:k"]["data"]["localized_title"] == "Los Simpson"
+
+
+def failing_get(url, params):
+    raise ConnectionError("sin red")
+
+
+def test_network_error_is_not_cached_as_miss(monkeypatch):
+    monkeypatch.setattr(M, "TMDB_API_KEY", "x")
+    monkeypatch.setattr(M, "api_get", failing_get)
+    assert M.find_tmdb_match("Una Serie Cualquiera") is None
+    assert not any(key.startswith("tmdb_match:") for key in M.api_cache)
+
+
+def test_empty_search_results_are_cached_as_miss(monkeypatch):
+    monkeypatch.setattr(M, "TMDB_API_KEY", "x")
+    monkeypatch.setattr(M, "api_get", lambda url, params: FakeResponse(200, {"results": []}))
+    assert M.find_tmdb_match("Una Serie Cualquiera") is None
+    assert [M.api_cache[k]["data"] for k in M.api_cache if k.startswith("tmdb_match:")] == [{}]
+
+
+def test_localized_details_error_not_cached_but_404_is(monkeypatch):
+    monkeypatch.setattr(M, "TMDB_API_KEY", "x")
+    monkeypatch.setattr(M, "api_get", failing_get)
+    assert M.tmdb_get_localized_details(7, "tv", prefer_latam=True) == (None, None)
+    assert not any(key.startswith("tmdb_details:") for key in M.api_cache)
+    monkeypatch.setattr(M, "api_get", lambda url, params: FakeResponse(404))
+    assert M.tmdb_get_localized_details(7, "tv") == (None, None)
+    assert [M.api_cache[k]["data"] for k in M.api_cache if k.startswith("tmdb_details:")] == [{}, {}]
+
+
+def test_episode_details_error_not_cached_but_404_is(monkeypatch):
+    monkeypatch.setattr(M, "TMDB_API_KEY", "x")
+    monkeypatch.setattr(M, "api_get", failing_get)
+    assert M.tmdb_get_episode_details(7, 1, 2) == (None, None)
+    assert not any(key.startswith("tmdb_episode:") for key in M.api_cache)
+
+    monkeypatch.setattr(M, "api_get", lambda url, params: FakeResponse(404))
+    assert M.tmdb_get_episode_details(7, 1, 2) == (None, None)
+    assert {M.api_cache[k]["data"].__class__ for k in M.api_cache if k.startswith("tmdb_episode:")} == {dict}
+
+
+def test_index_hit_of_parent_series_does_not_skip_search(monkeypatch):
+    monkeypatch.setattr(M, "TMDB_API_KEY", "x")
+    parent = {"id": 1402, "media_type": "tv", "name": "The Walking Dead", "first_air_date": "2010-10-31"}
+    spin_off = {"id": 211684, "media_type": "tv", "name": "The Walking Dead: Daryl Dixon",
+                "first_air_date": "2023-09-10"}
+    index = M._new_tmdb_title_index()
+    M._tmdb_index_add_item(index, parent)
+    monkeypatch.setattr(M, "tmdb_title_index", index)
+    searches = []
+
+    def fake_get(url, params):
+        if "/search/" in url:
+            searches.append(params["query"])
+            return FakeResponse(200, {"results": [parent, spin_off]})
+        return FakeResponse(404)
+
+    monkeypatch.setattr(M, "api_get", fake_get)
+    # La serie madre del índice supera el mínimo, pero no es el mismo título: hay que buscar
+    match = M.find_tmdb_match("The Walking Dead: Daryl Dixon")
+    assert searches and match["id"] == 211684
+    # Un nombre idéntico del índice sí evita la red
+    searches.clear()
+    assert M.find_tmdb_match("The Walking Dead")["id"] == 1402 and not searches
+
+
+def test_secondary_tmdb_searches_respect_fallback_stage(monkeypatch):
+    monkeypatch.setattr(M, "TMDB_API_KEY", "x")
+    monkeypatch.setattr(M, "run_deadline", M.RunDeadline(100, started=M.time.time() - 75))
+    searches = []
+
+    def fake_get(url, params):
+        searches.append(params["query"])
+        return FakeResponse(200, {"results": []})
+
+    monkeypatch.setattr(M, "api_get", fake_get)
+    # Con título en inglés hay dos búsquedas; pasado el umbral "fallback" solo va la principal
+    assert M.find_tmdb_match("La casa de papel", english_title="Money Heist") is None
+    assert searches == ["Money Heist"]
+    assert not any(key.startswith("tmdb_match:") for key in M.api_cache)
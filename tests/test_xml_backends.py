@@ -0,0 +1,51 @@
+import os
+
+import pytest
+
+import main as M
+
+pytest.importorskip("lxml")
+
+FEED = os.path.join(os.path.dirname(__file__), "data", "feed-it.xml")
+URL = "http://example.invalid/epg-it.xml"
+BACKENDS = [M.StdlibXmlBackend(), M.LxmlXmlBackend()]
+
+
+def serialized(backend):
+    return [(elem.tag, backend.tostring(elem)) for elem in backend.iter_elements(FEED)]
+
+
+def enriched(backend, monkeypatch):
+    monkeypatch.setattr(M, "XML", backend)
+    enricher = M.FeedBatchEnricher(URL)
+    results = []
+    for elem in M.iter_feed_elements(FEED):
+        if elem.tag == "channel":
+            results.append(M.serialize_channel(elem, M.canonical_channel_id(elem.get("id"))))
+        else:
+            results += enricher.add(elem, elem.get("channel"), M.canonical_channel_id(elem.get("channel")))
+    return results + enricher.flush()
+
+
+def test_backends_serialize_identically():
+    stdlib, lxml = (serialized(backend) for backend in BACKENDS)
+    assert stdlib == lxml
+    assert any(b' />' in data for _, data in stdlib)
+
+
+def test_backends_enrich_identically(monkeypatch):
+    assert enriched(BACKENDS[0], monkeypatch) == enriched(BACKENDS[1], monkeypatch)
+
+
+def test_header_only_stops_at_first_programme():
+    for backend in BACKENDS:
+        assert [elem.tag for elem in backend.iter_elements(FEED, header_only=True)] == ["channel"]
+
+
+def test_backends_clone_without_tail():
+    for backend in BACKENDS:
+        elem = backend.fromstring(b"<tv><a x='1'>t<b/></a>fin</tv>")[0]
+        elem.tail = "cola"
+        clone = backend.clone(elem)
+        assert backend.tostring(clone) == b'<a x="1">t<b /></a>'
+        assert elem.tail == "cola"